@@ -2,11 +2,63 @@ import os
 import csv
 import re
 import sys
-from PIL import Image
+import json
+import hashlib
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image, ImageOps
 import pytesseract
 
-# You might need to point to your tesseract executable if it's not in your PATH
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+# Tesseract is looked up on PATH unless TESSERACT_CMD or --tesseract points to the executable,
+# e.g. C:\Program Files\Tesseract-OCR\tesseract.exe on Windows
+TESSERACT_CMD_ENV = 'TESSERACT_CMD'
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Bump when the OCR settings change, so cached text produced by the old settings is not reused
+OCR_CACHE_VERSION = 1
+
+# Checkpoint is flushed after this many newly OCR'd images
+CHECKPOINT_EVERY = 25
+
+# Preprocessing defaults. Spec sheets are scanned at far higher resolution than tesseract needs
+DEFAULT_MAX_WIDTH = 1800
+# Skew is searched in this range (degrees) at DESKEW_STEP resolution
+DESKEW_RANGE = 5.0
+DESKEW_STEP = 0.5
+# The skew estimate is computed on a copy scaled to this width
+DESKEW_SAMPLE_WIDTH = 600
+
+HEADERS = [
+    'tag_number',
+    'Shut-off Pressures P1 / P2',
+    'Power Failure Pos.',
+    'Manufacturer / Model',
+    'Body Style',
+    'Required Travel / Angle',
+    'Bench Range'
+]
+
+# Note: These regexes assume the format is roughly "Label: Value" or "Label Value"
+FIELD_PATTERNS = {
+    'Shut-off Pressures P1 / P2': r"Shut-off Pressures.*?[:\s]+(.*?)(?:\n|$)",
+    'Power Failure Pos.': r"Power Failure Pos.*?[:\s]+(.*?)(?:\n|$)",
+    'Manufacturer / Model': r"Manufacturer.*?Model.*?[:\s]+(.*?)(?:\n|$)",
+    'Body Style': r"Body Style.*?[:\s]+(.*?)(?:\n|$)",
+    'Required Travel / Angle': r"Required Travel.*?Angle.*?[:\s]+(.*?)(?:\n|$)",
+    'Bench Range': r"Bench Range.*?[:\s]+(.*?)(?:\n|$)",
+}
+
+
+def configure_tesseract(tesseract_cmd=None):
+    """
+    Points pytesseract at the tesseract executable given on the command line or in TESSERACT_CMD.
+    """
+    tesseract_cmd = tesseract_cmd or os.environ.get(TESSERACT_CMD_ENV)
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
 
 def extract_value(text, pattern):
     """
@@ -17,105 +69,433 @@ def extract_value(text, pattern):
         return match.group(1).strip()
     return ""
 
-def process_images(root_dir, output_csv):
+
+def parse_fields(tag_number, text, settings=None):
     """
-    Walks through the directory structure, OCRs images, and extracts data.
+    Builds one CSV row from the OCR text of a spec sheet.
+    With regions, each field is read from its own crop; a crop that does not contain its
+    label is taken to hold just the value.
     """
-    
-    headers = [
-        'tag_number',
-        'Shut-off Pressures P1 / P2',
-        'Power Failure Pos.',
-        'Manufacturer / Model',
-        'Body Style',
-        'Required Travel / Angle',
-        'Bench Range'
-    ]
-
-    extracted_data = []
-    
-    # Walk through the directory
-    # Expected: root_dir/TAG_NUMBER/Valves_Specs/image.jpg
-    
-    print(f"Scanning directory: {root_dir}")
-    
-    for tag_folder in os.listdir(root_dir):
-        tag_path = os.path.join(root_dir, tag_folder)
-        
-        if not os.path.isdir(tag_path):
+    row = {'tag_number': tag_number}
+    if not (settings and settings.regions):
+        for field, pattern in FIELD_PATTERNS.items():
+            row[field] = extract_value(text, pattern)
+        return row
+
+    region_texts = json.loads(text)
+    for field, pattern in FIELD_PATTERNS.items():
+        region_text = region_texts.get(field, '')
+        row[field] = extract_value(region_text, pattern) or ' '.join(region_text.split())
+    return row
+
+
+def find_spec_images(root_dir):
+    """
+    Yields (tag_number, image_path) for the first spec sheet image of every tag.
+    Expected layout: root_dir/TAG_NUMBER/Valves_Specs/image.jpg
+    """
+    for tag_folder in sorted(os.listdir(root_dir)):
+        specs_dir = os.path.join(root_dir, tag_folder, "Valves_Specs")
+        if not os.path.isdir(specs_dir):
             continue
-            
-        # The tag number is the folder name
-        tag_number = tag_folder
-        
-        specs_dir = os.path.join(tag_path, "Valves_Specs")
-        if not os.path.exists(specs_dir):
+        # Assuming one spec sheet per tag, only the first image is read
+        for file in sorted(os.listdir(specs_dir)):
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                yield tag_folder, os.path.join(specs_dir, file)
+                break
+
+
+def file_digest(path):
+    """
+    Returns the SHA-256 hex digest of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class OCRCache:
+    """
+    On-disk OCR results keyed by the SHA-256 of the image, so an image is OCR'd once
+    no matter how often it is renamed, copied or rescanned.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, digest, variant):
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.v{OCR_CACHE_VERSION}.{variant}.txt")
+
+    def get(self, digest, variant=''):
+        try:
+            with open(self._path(digest, variant), encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, digest, text, variant=''):
+        path = self._path(digest, variant)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+class Checkpoint:
+    """
+    Remembers the digest of every image already processed, keyed by path and validated by
+    size and mtime, so an interrupted or repeated run neither re-hashes nor re-OCRs unchanged files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def _stamp(image_path):
+        stat = os.stat(image_path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def digest_for(self, image_path):
+        entry = self.entries.get(image_path)
+        if entry and entry['stamp'] == self._stamp(image_path):
+            return entry['digest']
+        return None
+
+    def record(self, image_path, digest):
+        self.entries[image_path] = {'stamp': self._stamp(image_path), 'digest': digest}
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+
+class OCRSettings:
+    """
+    How an image is prepared and read.
+
+    `regions` maps a field name to its label box on the spec sheet as (left, top, right, bottom)
+    fractions of the page, e.g. {"Body Style": [0.05, 0.42, 0.95, 0.47]}. With regions, each box
+    is cropped out and OCR'd on its own; without, the whole page is read and searched by regex.
+    """
+
+    def __init__(self, regions=None, max_width=DEFAULT_MAX_WIDTH, binarize=True, deskew=True):
+        self.regions = regions or {}
+        self.max_width = max_width
+        self.binarize = binarize
+        self.deskew = deskew
+
+    @classmethod
+    def from_file(cls, regions_path=None, **kwargs):
+        regions = None
+        if regions_path:
+            with open(regions_path, encoding='utf-8') as f:
+                regions = json.load(f)
+        return cls(regions=regions, **kwargs)
+
+    def cache_variant(self):
+        """Short key identifying these settings in the OCR cache."""
+        raw = json.dumps([sorted(self.regions.items()), self.max_width, self.binarize, self.deskew])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:12]
+
+
+def otsu_threshold(image):
+    """
+    Returns the Otsu threshold of a greyscale image, computed from its histogram.
+    """
+    histogram = image.histogram()
+    total = sum(histogram)
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    sum_background = weight_background = 0
+    best_threshold, best_variance = 127, 0.0
+    for i, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
             continue
-            
-        for file in os.listdir(specs_dir):
-            if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                image_path = os.path.join(specs_dir, file)
-                print(f"Processing {tag_number} - {file}...")
-                
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += i * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = i, variance
+    return best_threshold
+
+
+def estimate_skew(image):
+    """
+    Returns the rotation (degrees) that makes the text lines of a binarized page horizontal.
+    Text lines are horizontal when the row profile is sharpest, i.e. when row means vary most.
+    """
+    sample = image
+    if image.width > DESKEW_SAMPLE_WIDTH:
+        sample = image.resize(
+            (DESKEW_SAMPLE_WIDTH, max(1, image.height * DESKEW_SAMPLE_WIDTH // image.width)),
+            Image.BILINEAR,
+        )
+    sample = ImageOps.invert(sample)
+    best_angle, best_score = 0.0, -1.0
+    steps = int(DESKEW_RANGE / DESKEW_STEP)
+    for step in range(-steps, steps + 1):
+        angle = step * DESKEW_STEP
+        rotated = sample.rotate(angle, resample=Image.BILINEAR, fillcolor=0)
+        # Squashing to one column averages every row in C
+        profile = rotated.resize((1, rotated.height), Image.BOX).tobytes()
+        mean = sum(profile) / len(profile)
+        score = sum((value - mean) ** 2 for value in profile)
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+def preprocess(image, settings):
+    """
+    Greyscale, downscale, binarize and deskew a spec sheet page.
+    """
+    image = ImageOps.exif_transpose(image).convert('L')
+    if settings.max_width and image.width > settings.max_width:
+        height = image.height * settings.max_width // image.width
+        image = image.resize((settings.max_width, height), Image.LANCZOS)
+    if settings.binarize:
+        threshold = otsu_threshold(image)
+        image = image.point(lambda value: 255 if value > threshold else 0)
+    if settings.deskew:
+        angle = estimate_skew(image)
+        if angle:
+            image = image.rotate(angle, resample=Image.BICUBIC, expand=False, fillcolor=255)
+    return image
+
+
+def crop_region(image, box):
+    left, top, right, bottom = box
+    return image.crop((
+        int(left * image.width), int(top * image.height),
+        int(right * image.width), int(bottom * image.height),
+    ))
+
+
+def ocr_image(image_path, settings=None, tesseract_cmd=None):
+    """
+    OCRs a single image. Runs inside a worker process.
+    Returns the page text, or a JSON object of per-region texts when settings define regions.
+    """
+    configure_tesseract(tesseract_cmd)
+    settings = settings or OCRSettings()
+    with Image.open(image_path) as image:
+        page = preprocess(image, settings)
+    if not settings.regions:
+        return pytesseract.image_to_string(page)
+    texts = {}
+    for field, box in settings.regions.items():
+        # psm 6: a single uniform block of text
+        texts[field] = pytesseract.image_to_string(crop_region(page, box), config='--psm 6')
+    return json.dumps(texts)
+
+
+def process_images(root_dir, output_csv, workers=None, cache_dir=None, checkpoint_path=None,
+                   tesseract_cmd=None, settings=None):
+    """
+    Walks through the directory structure, OCRs images, and extracts data.
+    OCR runs in a pool of `workers` processes (all cores by default); only images whose
+    content is not already in the OCR cache for these settings are sent to it.
+    """
+    settings = settings or OCRSettings()
+    variant = settings.cache_variant()
+    cache = OCRCache(cache_dir or os.path.join(root_dir, '.ocr_cache'))
+    checkpoint = Checkpoint(checkpoint_path)
+
+    print(f"Scanning directory: {root_dir}")
+
+    texts = {}
+    pending = {}
+    for tag_number, image_path in find_spec_images(root_dir):
+        digest = checkpoint.digest_for(image_path) or file_digest(image_path)
+        text = cache.get(digest, variant)
+        if text is None:
+            pending[image_path] = (tag_number, digest)
+        else:
+            texts[tag_number] = text
+            checkpoint.record(image_path, digest)
+
+    print(f"{len(texts)} images cached, {len(pending)} to OCR")
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(ocr_image, image_path, settings, tesseract_cmd): image_path
+                for image_path in pending
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                image_path = futures[future]
+                tag_number, digest = pending[image_path]
                 try:
-                    text = pytesseract.image_to_string(Image.open(image_path))
-                    
-                    # Normalize text for easier matching (optional)
-                    # text = text.replace('\n', ' ')
-                    
-                    # Extract fields using Regex
-                    # Note: These regexes assume the format is roughly "Label: Value" or "Label Value"
-                    # We might need to adjust based on actual OCR output.
-                    
-                    row = {'tag_number': tag_number}
-                    
-                    # 1. Shut-off Pressures P1 / P2
-                    # Patterns can be tricky. Looking for "Shut-off Pressures" then some value until newline or next label
-                    row['Shut-off Pressures P1 / P2'] = extract_value(text, r"Shut-off Pressures.*?[:\s]+(.*?)(?:\n|$)")
-                    
-                    # 2. Power Failure Pos.
-                    row['Power Failure Pos.'] = extract_value(text, r"Power Failure Pos.*?[:\s]+(.*?)(?:\n|$)")
-                    
-                    # 3. Manufacturer / Model
-                    row['Manufacturer / Model'] = extract_value(text, r"Manufacturer.*?Model.*?[:\s]+(.*?)(?:\n|$)")
-                    
-                    # 4. Body Style
-                    row['Body Style'] = extract_value(text, r"Body Style.*?[:\s]+(.*?)(?:\n|$)")
-                    
-                    # 5. Required Travel / Angle
-                    row['Required Travel / Angle'] = extract_value(text, r"Required Travel.*?Angle.*?[:\s]+(.*?)(?:\n|$)")
-                    
-                    # 6. Bench Range
-                    row['Bench Range'] = extract_value(text, r"Bench Range.*?[:\s]+(.*?)(?:\n|$)")
-                    
-                    extracted_data.append(row)
-                    
-                    # Assuming one spec sheet per tag, we can break after finding one.
-                    # If there are multiple pages, we might need to concat text.
-                    # For now, let's assume the first image has the data or we just process all and take the last (or merge).
-                    # Let's break for now to avoid duplicates if there are multiple images for the same thing.
-                    break 
-                    
+                    text = future.result()
                 except Exception as e:
                     print(f"Error processing {image_path}: {e}")
+                    continue
+                print(f"[{done}/{len(pending)}] Processed {tag_number}")
+                cache.set(digest, text, variant)
+                checkpoint.record(image_path, digest)
+                texts[tag_number] = text
+                if done % CHECKPOINT_EVERY == 0:
+                    checkpoint.save()
+
+    checkpoint.save()
+
+    extracted_data = [parse_fields(tag_number, texts[tag_number], settings) for tag_number in sorted(texts)]
 
     # Write to CSV
     print(f"Writing results to {output_csv}...")
     with open(output_csv, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=headers)
+        writer = csv.DictWriter(csvfile, fieldnames=HEADERS)
         writer.writeheader()
         writer.writerows(extracted_data)
 
     print("Done.")
 
-if __name__ == "__main__":
-    # Adjust paths relative to where the script is run
+
+def load_reference(reference_csv):
+    with open(reference_csv, newline='', encoding='utf-8') as f:
+        return {row['tag_number']: row for row in csv.DictReader(f)}
+
+
+def normalize(value):
+    return ' '.join(value.lower().split())
+
+
+def run_benchmark(images, settings, workers=None, tesseract_cmd=None):
+    """
+    OCRs `images` ([(tag_number, image_path)]) without the cache. Returns (rows, seconds).
+    """
+    started = time.perf_counter()
+    rows = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(ocr_image, image_path, settings, tesseract_cmd): tag_number
+            for tag_number, image_path in images
+        }
+        for future in as_completed(futures):
+            tag_number = futures[future]
+            try:
+                rows[tag_number] = parse_fields(tag_number, future.result(), settings)
+            except Exception as e:
+                print(f"Error processing {tag_number}: {e}")
+    return rows, time.perf_counter() - started
+
+
+def score_fields(rows, images, reference):
+    """
+    Returns {field: (found, expected, agree)}: how many images got a value, how many have one in
+    the reference, and how many of those match it once case and whitespace are ignored.
+    """
+    scores = {}
+    for field in HEADERS[1:]:
+        found = sum(1 for row in rows.values() if row[field])
+        expected = [tag for tag, _ in images if reference[tag][field]]
+        agree = sum(
+            1 for tag in expected
+            if tag in rows and normalize(rows[tag][field]) == normalize(reference[tag][field])
+        )
+        scores[field] = (found, len(expected), agree)
+    return scores
+
+
+def benchmark(root_dir, reference_csv, settings_by_name, limit=None, workers=None, tesseract_cmd=None):
+    """
+    Times every settings variant over the same images and reports images/sec and, per field,
+    how often a value was found and how often it agrees with the reference CSV.
+    """
+    reference = load_reference(reference_csv)
+    images = [(tag, path) for tag, path in find_spec_images(root_dir) if tag in reference]
+    if limit:
+        images = images[:limit]
+    if not images:
+        print("No images with a reference row found.")
+        return
+
+    print(f"Benchmarking {len(images)} images against {reference_csv}")
+    for name, settings in settings_by_name.items():
+        rows, seconds = run_benchmark(images, settings, workers, tesseract_cmd)
+        print(f"\n{name}: {len(images) / seconds:.2f} images/sec ({seconds:.1f}s, {len(rows)} read)")
+        print(f"  {'field':<28} {'found':>7} {'ref':>7} {'agree':>7}")
+        for field, (found, expected, agree) in score_fields(rows, images, reference).items():
+            agree_rate = f"{agree / expected:.0%}" if expected else '-'
+            print(f"  {field:<28} {found / len(images):>7.0%} {expected / len(images):>7.0%} {agree_rate:>7}")
+
+
+def parse_args(argv=None):
     base_dir = os.getcwd()
-    media_root = os.path.join(base_dir, "media", "AFC 3", "Valves Specs")
-    output_file = os.path.join(base_dir, "extracted_data_afc3.csv")
-    
-    if not os.path.exists(media_root):
-        print(f"Error: Directory not found: {media_root}")
+    parser = argparse.ArgumentParser(description="OCR valve spec sheet images into a CSV file.")
+    parser.add_argument('command', nargs='?', choices=['extract', 'benchmark'], default='extract',
+                        help="extract (default) writes the CSV; benchmark compares raw and preprocessed OCR")
+    parser.add_argument('--root', default=os.path.join(base_dir, "media", "AFC 3", "Valves Specs"),
+                        help="Directory holding one folder per tag number")
+    parser.add_argument('--output', default=os.path.join(base_dir, "extracted_data_afc3.csv"))
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of OCR processes (default: all cores)")
+    parser.add_argument('--cache-dir', default=None,
+                        help="OCR result cache (default: <root>/.ocr_cache)")
+    parser.add_argument('--checkpoint', default=os.path.join(base_dir, ".ocr_checkpoint.json"),
+                        help="Resumable progress file; pass an empty string to disable")
+    parser.add_argument('--tesseract', default=None,
+                        help=f"Path to the tesseract executable (default: ${TESSERACT_CMD_ENV} or PATH)")
+    parser.add_argument('--regions', default=None,
+                        help="JSON file of field label boxes; see OCRSettings")
+    parser.add_argument('--max-width', type=int, default=DEFAULT_MAX_WIDTH,
+                        help="Downscale pages wider than this before OCR (0 keeps full resolution)")
+    parser.add_argument('--no-binarize', dest='binarize', action='store_false')
+    parser.add_argument('--no-deskew', dest='deskew', action='store_false')
+    parser.add_argument('--reference', default=os.path.join(base_dir, "extracted_data_afc3.csv"),
+                        help="benchmark: CSV to score the extracted fields against")
+    parser.add_argument('--limit', type=int, default=None,
+                        help="benchmark: only use the first N images")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if not os.path.exists(args.root):
+        print(f"Error: Directory not found: {args.root}")
         sys.exit(1)
-        
-    process_images(media_root, output_file)
+
+    configure_tesseract(args.tesseract)
+    settings = OCRSettings.from_file(
+        args.regions, max_width=args.max_width or None, binarize=args.binarize, deskew=args.deskew
+    )
+
+    if args.command == 'benchmark':
+        benchmark(
+            args.root,
+            args.reference,
+            {
+                'full page, unprocessed': OCRSettings(max_width=None, binarize=False, deskew=False),
+                'preprocessed': settings,
+            },
+            limit=args.limit,
+            workers=args.workers,
+            tesseract_cmd=args.tesseract,
+        )
+    else:
+        process_images(
+            args.root,
+            args.output,
+            workers=args.workers,
+            cache_dir=args.cache_dir,
+            checkpoint_path=args.checkpoint or None,
+            tesseract_cmd=args.tesseract,
+            settings=settings,
+        )
@@ -0,0 +1,132 @@
+/*
+ * Chunked, resumable uploads (see valves/uploads.py).
+ *
+ * A file input with data-chunked-upload="<hidden field name>" is sent in chunks before its form is
+ * submitted; the form then posts only the upload id in that hidden field. The upload id is kept in
+ * localStorage, so submitting the same file again after a dropped connection resumes where the
+ * server stopped instead of starting from zero. Files smaller than one chunk are posted as usual.
+ *
+ * Include with: <script src="{% static 'js/chunked_upload.js' %}" data-upload-url="{% url 'valves:upload-start' %}"></script>
+ */
+(function () {
+    const uploadUrl = document.currentScript.dataset.uploadUrl;
+    const CHUNK_SIZE = 4 * 1024 * 1024;
+    const MAX_RETRIES = 6;
+
+    const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+
+    function resumeKey(file) {
+        return `chunked-upload:${file.name}:${file.size}:${file.lastModified}`;
+    }
+
+    async function sha256Hex(blob) {
+        // crypto.subtle only exists on HTTPS pages; the server then skips the chunk check
+        if (!window.crypto || !window.crypto.subtle) {
+            return null;
+        }
+        const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+        return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    async function send(url, options) {
+        const response = await fetch(url, { credentials: 'same-origin', ...options });
+        const data = await response.json().catch(() => ({}));
+        return { response, data };
+    }
+
+    async function startOrResume(file, csrfToken) {
+        const savedId = localStorage.getItem(resumeKey(file));
+        if (savedId) {
+            const { response, data } = await send(`${uploadUrl}${savedId}/`, { headers: { Accept: 'application/json' } });
+            if (response.ok) {
+                return data;
+            }
+            localStorage.removeItem(resumeKey(file));
+        }
+        const { response, data } = await send(uploadUrl, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'X-CSRFToken': csrfToken },
+            body: JSON.stringify({ filename: file.name, size: file.size }),
+        });
+        if (!response.ok) {
+            throw new Error(data.error || `Could not start the upload (${response.status}).`);
+        }
+        localStorage.setItem(resumeKey(file), data.upload_id);
+        return data;
+    }
+
+    async function uploadFile(file, csrfToken, onProgress) {
+        let state = await startOrResume(file, csrfToken);
+        let retries = 0;
+        onProgress(state.offset / file.size);
+        while (!state.complete) {
+            const chunk = file.slice(state.offset, state.offset + state.chunk_size);
+            const headers = {
+                'Content-Type': 'application/octet-stream',
+                'Upload-Offset': String(state.offset),
+                'X-CSRFToken': csrfToken,
+            };
+            const checksum = await sha256Hex(chunk);
+            if (checksum) {
+                headers['X-Chunk-SHA256'] = checksum;
+            }
+            let result;
+            try {
+                result = await send(`${uploadUrl}${state.upload_id}/`, { method: 'PUT', headers, body: chunk });
+            } catch (error) {
+                result = null;  // network error, retry the same chunk
+            }
+            if (result && (result.response.ok || result.response.status === 409)) {
+                // 409 carries the offset the server actually has
+                state = { ...state, ...result.data };
+                retries = 0;
+            } else if (result && result.response.status !== 400 && result.response.status < 500) {
+                localStorage.removeItem(resumeKey(file));
+                throw new Error(result.data.error || `Upload failed (${result.response.status}).`);
+            } else if (++retries > MAX_RETRIES) {
+                throw new Error('The upload keeps failing; submit the form again later to resume it.');
+            } else {
+                await sleep(1000 * 2 ** retries);
+            }
+            onProgress(state.offset / file.size);
+        }
+        localStorage.removeItem(resumeKey(file));
+        return state.upload_id;
+    }
+
+    document.addEventListener('submit', async function (event) {
+        const form = event.target;
+        const inputs = Array.from(form.querySelectorAll('input[type="file"][data-chunked-upload]'))
+            .filter(input => input.files.length && input.files[0].size > CHUNK_SIZE);
+        if (!inputs.length) {
+            return;
+        }
+        event.preventDefault();
+
+        const csrfToken = form.querySelector('[name="csrfmiddlewaretoken"]').value;
+        const buttons = form.querySelectorAll('button[type="submit"], input[type="submit"]');
+        buttons.forEach(button => { button.disabled = true; });
+        try {
+            for (const input of inputs) {
+                let status = input.parentNode.querySelector('.chunked-upload-status');
+                if (!status) {
+                    status = document.createElement('small');
+                    status.className = 'chunked-upload-status d-block mt-1 text-muted';
+                    input.after(status);
+                }
+                const uploadId = await uploadFile(input.files[0], csrfToken, fraction => {
+                    status.textContent = `Uploading ${input.files[0].name}: ${Math.floor(fraction * 100)}%`;
+                });
+                form.querySelector(`input[name="${input.dataset.chunkedUpload}"]`).value = uploadId;
+                // The file itself is no longer posted with the form
+                input.value = '';
+                status.textContent = 'Upload complete.';
+            }
+            // form.submit() does not fire this handler again
+            form.submit();
+        } catch (error) {
+            buttons.forEach(button => { button.disabled = false; });
+            alert(error.message);
+        }
+    });
+})();
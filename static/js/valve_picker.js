@@ -0,0 +1,116 @@
+/*
+ * Searchable valve picker (see ValvePickerWidget in valves/forms.py).
+ *
+ * A <select multiple data-valve-picker="<valves by factory url>"> holds only the selected valves.
+ * It is hidden behind a search box; typing fetches one page of the factory's matching valves at a
+ * time, and picking one adds it to the select. data-factory-input names the factory field of the
+ * form; changing the factory clears the selection.
+ *
+ * Rendered by {{ form.media }}, or include with: <script src="{% static 'js/valve_picker.js' %}"></script>
+ */
+(function () {
+    const PAGE_SIZE = 50;
+    const SEARCH_DELAY = 250;
+
+    function setUp(select) {
+        const url = select.dataset.valvePicker;
+        const factoryInput = select.form.querySelector(`[name="${select.dataset.factoryInput}"]`);
+
+        const picker = document.createElement('div');
+        picker.className = 'valve-picker';
+        picker.innerHTML = `
+            <div class="valve-picker-selected mb-2"></div>
+            <input type="search" class="form-control" placeholder="Search valves by tag..." autocomplete="off">
+            <div class="list-group valve-picker-results mt-1"></div>
+            <button type="button" class="btn btn-link btn-sm valve-picker-more d-none">Show more</button>`;
+        select.style.display = 'none';
+        select.after(picker);
+
+        const selected = picker.querySelector('.valve-picker-selected');
+        const search = picker.querySelector('input');
+        const results = picker.querySelector('.valve-picker-results');
+        const more = picker.querySelector('.valve-picker-more');
+        let offset = 0;
+        let timer = null;
+        let request = 0;
+
+        function renderSelected() {
+            selected.replaceChildren(...Array.from(select.selectedOptions, option => {
+                const badge = document.createElement('span');
+                badge.className = 'badge bg-secondary me-1';
+                badge.textContent = option.textContent + ' ';
+                const remove = document.createElement('a');
+                remove.href = '#';
+                remove.className = 'text-white';
+                remove.textContent = '×';
+                remove.addEventListener('click', event => {
+                    event.preventDefault();
+                    option.remove();
+                    renderSelected();
+                });
+                badge.append(remove);
+                return badge;
+            }));
+        }
+
+        function pick(valve) {
+            if (!select.querySelector(`option[value="${valve.valve_id}"]`)) {
+                select.append(new Option(valve.tag_number, valve.valve_id, true, true));
+                renderSelected();
+            }
+        }
+
+        async function load(append) {
+            const term = search.value.trim();
+            const current = ++request;
+            if (!append) {
+                offset = 0;
+                results.replaceChildren();
+            }
+            more.classList.add('d-none');
+            if (!term || !factoryInput.value) {
+                return;
+            }
+            const params = new URLSearchParams({ factory: factoryInput.value, q: term, limit: PAGE_SIZE, offset });
+            const response = await fetch(`${url}?${params}`, { credentials: 'same-origin' });
+            // A newer search has started in the meantime
+            if (current !== request || !response.ok) {
+                return;
+            }
+            const valves = await response.json();
+            for (const valve of valves) {
+                const item = document.createElement('button');
+                item.type = 'button';
+                item.className = 'list-group-item list-group-item-action py-1';
+                item.textContent = valve.tag_number;
+                item.addEventListener('click', () => pick(valve));
+                results.append(item);
+            }
+            offset += valves.length;
+            more.classList.toggle('d-none', valves.length < PAGE_SIZE);
+        }
+
+        function setEnabled() {
+            search.disabled = !factoryInput.value;
+            select.disabled = !factoryInput.value;
+        }
+
+        search.addEventListener('input', () => {
+            clearTimeout(timer);
+            timer = setTimeout(() => load(false), SEARCH_DELAY);
+        });
+        more.addEventListener('click', () => load(true));
+        factoryInput.addEventListener('change', () => {
+            select.replaceChildren();
+            renderSelected();
+            setEnabled();
+            load(false);
+        });
+        setEnabled();
+        renderSelected();
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        document.querySelectorAll('select[data-valve-picker]').forEach(setUp);
+    });
+})();
@@ -112,6 +112,53 @@ else:
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Cache versions (valves/caching.py) are bumped by web workers and by management commands alike,
+# so every process must share one cache. Set REDIS_URL in production: every list row, fragment and
+# tab read checks a version, which is a sub-millisecond round trip on Redis but a query on the
+# database cache. Without it the database cache is used (created with `manage.py createcachetable`),
+# or a file-based cache in CACHE_DIR. Bumps write a fresh value instead of incrementing, so they
+# are safe on backends without an atomic incr. The local-memory cache is private to each process
+# and only suits a single process that writes nothing from outside; set CACHE_BACKEND=locmem to
+# use it anyway.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+            'TIMEOUT': 60 * 60,
+        }
+    }
+elif os.environ.get('CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR'),
+            'TIMEOUT': 60 * 60,
+            'OPTIONS': {'MAX_ENTRIES': 20000},
+        }
+    }
+elif os.environ.get('CACHE_BACKEND') == 'locmem':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'valves',
+            'TIMEOUT': 60 * 60,
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'valves_cache',
+            'TIMEOUT': 60 * 60,
+            'OPTIONS': {'MAX_ENTRIES': 20000},
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -169,6 +216,10 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Media is only served to logged-in users. Behind nginx, valves.views.protected_media checks the
+# login and hands the file over with X-Accel-Redirect to this internal location (see nginx/conf.d);
+# leave it empty to have Django send the file itself, e.g. with runserver.
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX', '' if DEBUG else '/protected-media/')
 
 LOGIN_URL = 'valves:login' # اسم الـ URL بتاع صفحة تسجيل الدخول
 LOGIN_REDIRECT_URL = 'valves:home' # اسم الـ URL للصفحة اللي هيتوجه ليها بعد تسجيل الدخول بنجاح
@@ -2,9 +2,9 @@
 URL configuration for valve_project project.
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+from valves.views import protected_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -12,10 +12,7 @@ urlpatterns = [
     path('i18n/', include('django.conf.urls.i18n')),
     path('api/auth/', include('djoser.urls')),
     path('api/auth/', include('djoser.urls.authtoken')),
+    # Media files require a login; nginx sends the bytes (see MEDIA_ACCEL_REDIRECT_PREFIX)
+    re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), protected_media, name='protected-media'),
     path('', include('valves.urls')),  # Include the valves app URLs at the root
-]
-
-# Serve media files during development
-if settings.DEBUG:
-    print(f"DEBUG: MEDIA_URL={settings.MEDIA_URL}, MEDIA_ROOT={settings.MEDIA_ROOT}")
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""
+Maintenance activities as a lookup table.
+
+What was done on a maintenance record lives in MaintenanceHistory.activities, a many-to-many
+link to MaintenanceActivity, so "every packing replacement" is an index lookup on the link
+table instead of a LIKE scan. MaintenanceHistory.maintenance_activities keeps the comma-joined
+names for display; the m2m_changed handler in valves/signals.py rewrites it whenever the links
+change, and bulk writers set both themselves.
+"""
+from django.db.models import Count
+from .caching import bump_valve_version
+from .models import MaintenanceActivity, MaintenanceHistory
+
+Link = MaintenanceHistory.activities.through
+
+
+def activity_ids(names):
+    """Returns {name: id} for the given activity names, creating the missing ones."""
+    names = list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+    ids = dict(MaintenanceActivity.objects.filter(name__in=names).values_list('name', 'pk'))
+    missing = [name for name in names if name not in ids]
+    if missing:
+        MaintenanceActivity.objects.bulk_create([MaintenanceActivity(name=name) for name in missing], ignore_conflicts=True)
+        ids.update(MaintenanceActivity.objects.filter(name__in=missing).values_list('name', 'pk'))
+    return ids
+
+
+def set_activities(record, names):
+    """Replaces the activities of a saved record with the named ones."""
+    record.activities.set(activity_ids(names).values())
+
+
+def link_activities(records, names_per_record):
+    """
+    Links freshly created records to their activities with one bulk insert. Sends no m2m_changed,
+    so the records' maintenance_activities must already hold the names.
+    """
+    ids = activity_ids(name for names in names_per_record for name in names)
+    Link.objects.bulk_create([
+        Link(maintenancehistory_id=record.pk, maintenanceactivity_id=ids[name.strip()])
+        for record, names in zip(records, names_per_record)
+        for name in dict.fromkeys(name for name in names if name and name.strip())
+    ])
+
+
+def refresh_activity_labels(record_ids):
+    """Rewrites maintenance_activities of the given records from their links, in activity order."""
+    record_ids = set(record_ids)
+    labels = {record_id: [] for record_id in record_ids}
+    for record_id, name in Link.objects.filter(maintenancehistory_id__in=record_ids).order_by(
+        'maintenanceactivity_id'
+    ).values_list('maintenancehistory_id', 'maintenanceactivity__name'):
+        labels[record_id].append(name)
+    for record_id, names in labels.items():
+        MaintenanceHistory.objects.filter(pk=record_id).update(maintenance_activities=','.join(names))
+    # update() sends no post_save, so the valve tabs showing these records are refreshed here
+    bump_valve_version(*MaintenanceHistory.objects.filter(pk__in=record_ids).values_list('valve_id', flat=True))
+    return labels
+
+
+def filter_by_activities(queryset, names):
+    """Keeps the records that include every named activity."""
+    for name in names:
+        queryset = queryset.filter(activities__name=name)
+    return queryset
+
+
+def activity_counts(queryset):
+    """
+    Returns [(activity name, number of records), ...] for the records of `queryset`, most frequent
+    first, from one grouped query over the link table.
+    """
+    return list(
+        Link.objects.filter(maintenancehistory__in=queryset.order_by().values('pk'))
+        .values_list('maintenanceactivity__name')
+        .annotate(records=Count('maintenancehistory_id'))
+        .order_by('-records', 'maintenanceactivity__name')
+    )
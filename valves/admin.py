@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Valve, SparePart, PartCode, MaintenanceHistory, MaintenancePart, ValveType, ValveStatus, Manufacturer, Technician, Shutdown
+from .models import Valve, SparePart, PartCode, MaintenanceHistory, MaintenancePart, ValveType, ValveStatus, Manufacturer, Technician, Shutdown, Document, MaintenanceActivity
 
 @admin.register(Valve)
 class ValveAdmin(admin.ModelAdmin):
@@ -26,8 +26,10 @@ class ValveAdmin(admin.ModelAdmin):
 @admin.register(MaintenanceHistory)
 class MaintenanceHistoryAdmin(admin.ModelAdmin):
     list_display = ('maintenance_id', 'valve', 'maintenance_date', 'technician')
-    list_filter = ('maintenance_date', 'technician')
+    list_filter = ('maintenance_date', 'technician', 'activities')
     search_fields = ('valve__tag_number', 'maintenance_notes')
+    filter_horizontal = ('activities',)
+    readonly_fields = ('maintenance_activities',)
 
 @admin.register(PartCode)
 class PartCodeAdmin(admin.ModelAdmin):
@@ -41,4 +43,11 @@ admin.site.register(ValveType)
 admin.site.register(ValveStatus)
 admin.site.register(Manufacturer)
 admin.site.register(Technician)
+admin.site.register(MaintenanceActivity)
 admin.site.register(Shutdown)
+
+@admin.register(Document)
+class DocumentAdmin(admin.ModelAdmin):
+    list_display = ('relative_path', 'factory', 'doc_type', 'size', 'indexed_at')
+    list_filter = ('factory', 'doc_type')
+    search_fields = ('relative_path',)
@@ -0,0 +1,101 @@
+"""
+In-process index of valve tag numbers for autocomplete.
+
+Each worker process keeps every tag in memory, sorted by its normalized form (upper case, with
+hyphens, spaces and underscores removed, so 'fv 1001' finds 'FV-1001'). A lookup never touches
+the database: prefix matches come from a binary search, and substring matches from str.find over
+all the normalized tags joined into one string. Writes to valves bump a shared cache version
+(see valves/caching.py); a worker rebuilds its copy on the first lookup after the version changed.
+"""
+import re
+import threading
+from bisect import bisect_left, bisect_right
+from .caching import tag_index_version
+from .models import Valve
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# Separates the tags in TagIndex.haystack; normalized tags never contain it
+_SEPARATOR = '\n'
+_IGNORED = re.compile(r'[\s_-]+')
+
+
+def normalize_tag(tag):
+    return _IGNORED.sub('', tag).upper()
+
+
+class TagIndex:
+    """Tag numbers sorted by their normalized form, with the factory each belongs to."""
+
+    def __init__(self, rows):
+        entries = sorted((normalize_tag(tag), tag, factory_id) for tag, factory_id in rows)
+        self.keys = [key for key, _, _ in entries]
+        self.tags = [tag for _, tag, _ in entries]
+        self.factory_ids = [factory_id for _, _, factory_id in entries]
+        self.haystack = _SEPARATOR.join(self.keys)
+        # Offset of every key in the haystack, to map a substring hit back to its entry
+        self.offsets = []
+        offset = 0
+        for key in self.keys:
+            self.offsets.append(offset)
+            offset += len(key) + 1
+
+    @classmethod
+    def build(cls):
+        return cls(Valve.objects.values_list('tag_number', 'factory_id'))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def search(self, term, factory_id=None, limit=DEFAULT_LIMIT):
+        """
+        Returns at most `limit` tags matching `term`: tags that start with it first, in tag order,
+        then tags that only contain it. With `factory_id`, only that factory's tags are returned.
+        """
+        needle = normalize_tag(term)
+        if not needle or limit <= 0:
+            return []
+        results = []
+
+        start = bisect_left(self.keys, needle)
+        # Every key starting with needle sorts before needle followed by the highest character
+        end = bisect_right(self.keys, needle + '\uffff', lo=start)
+        for i in range(start, end):
+            if factory_id is None or self.factory_ids[i] == factory_id:
+                results.append(self.tags[i])
+                if len(results) == limit:
+                    return results
+
+        position = self.haystack.find(needle)
+        while position != -1:
+            i = bisect_right(self.offsets, position) - 1
+            # Prefix matches were taken above
+            if position != self.offsets[i] and (factory_id is None or self.factory_ids[i] == factory_id):
+                results.append(self.tags[i])
+                if len(results) == limit:
+                    break
+            # Continue after this key, so a key containing the term twice is listed once
+            position = self.haystack.find(needle, self.offsets[i] + len(self.keys[i]) + 1)
+        return results
+
+
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+
+def get_tag_index():
+    """Returns this process's tag index, rebuilding it if valves changed since it was built."""
+    global _index, _index_version
+    version = tag_index_version()
+    if _index is None or _index_version != version:
+        with _lock:
+            if _index is None or _index_version != version:
+                _index = TagIndex.build()
+                _index_version = version
+    return _index
+
+
+def autocomplete_tags(term, factory_id=None, limit=DEFAULT_LIMIT):
+    return get_tag_index().search(term, factory_id=factory_id, limit=min(limit, MAX_LIMIT))
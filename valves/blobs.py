@@ -0,0 +1,198 @@
+"""
+Content-addressed storage for media files.
+
+Every media path referenced by a ValveImage, a maintenance before/after image or the document
+index is hard-linked to a blob named after its SHA-256, MEDIA_ROOT/.blobs/<sha[:2]>/<sha>. Paths
+with the same content therefore share one inode, so a spec sheet uploaded under ten valves is
+stored once. Paths keep working unchanged for the ImageFields, the document index and nginx.
+
+MediaFile records which blob each path is linked to; MediaBlob.ref_count counts those paths, and
+a blob is removed once no path refers to it. Media files are never modified in place (storage
+always writes new files), which is what makes sharing inodes safe.
+"""
+import logging
+import os
+from itertools import chain
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+from .documents import file_sha256
+from .models import Document, MaintenanceHistory, MediaBlob, MediaFile, ValveImage
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = '.blobs'
+
+
+def blob_path(sha256):
+    return os.path.join(settings.MEDIA_ROOT, BLOB_DIR, sha256[:2], sha256)
+
+
+def media_path(name):
+    return os.path.join(settings.MEDIA_ROOT, *name.split('/'))
+
+
+def referenced_paths():
+    """Every media path referenced from the database, with '/' separators."""
+    names = chain(
+        ValveImage.objects.values_list('image', flat=True),
+        MaintenanceHistory.objects.values_list('before_image', flat=True),
+        MaintenanceHistory.objects.values_list('after_image', flat=True),
+        Document.objects.values_list('relative_path', flat=True),
+    )
+    return {name.replace('\\', '/') for name in names if name}
+
+
+def is_referenced(name):
+    return (
+        ValveImage.objects.filter(image=name).exists()
+        or MaintenanceHistory.objects.filter(before_image=name).exists()
+        or MaintenanceHistory.objects.filter(after_image=name).exists()
+        or Document.objects.filter(relative_path=name).exists()
+    )
+
+
+def _is_linked(media_file, stat):
+    if media_file is None or media_file.mtime_ns != stat.st_mtime_ns:
+        return False
+    try:
+        return os.path.samestat(stat, os.stat(blob_path(media_file.blob_id)))
+    except FileNotFoundError:
+        return False
+
+
+def _link_to_blob(source, sha256):
+    """Makes `source` a hard link of the blob, creating the blob from it if needed."""
+    target = blob_path(sha256)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+        return
+    except FileExistsError:
+        pass
+    if os.path.samefile(source, target):
+        return
+    # Swap the duplicate for a link to the blob in one rename, so readers never see a missing file
+    temp = f'{source}.blob-link'
+    os.link(target, temp)
+    os.replace(temp, source)
+
+
+def _release(blob_id):
+    # A blob already at zero (e.g. released twice) stays there; a PositiveIntegerField cannot go below
+    MediaBlob.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    if MediaBlob.objects.filter(pk=blob_id, ref_count__lte=0).delete()[0]:
+        try:
+            os.remove(blob_path(blob_id))
+        except FileNotFoundError:
+            pass
+
+
+def add_file(name, sha256=None):
+    """
+    Links the media file `name` to the blob of its content. Returns the MediaFile, or None if the
+    file does not exist or cannot be hard-linked. Files already linked cost a couple of stat calls.
+    """
+    name = name.replace('\\', '/')
+    path = media_path(name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    media_file = MediaFile.objects.filter(path=name).first()
+    if _is_linked(media_file, stat):
+        return media_file
+
+    sha256 = sha256 or file_sha256(path)
+    try:
+        _link_to_blob(path, sha256)
+    except OSError as e:
+        # e.g. a filesystem without hard links; the file simply stays a separate copy
+        logger.warning("Could not link %s to its blob: %s", name, e)
+        return None
+
+    with transaction.atomic():
+        MediaBlob.objects.get_or_create(sha256=sha256, defaults={'size': stat.st_size})
+        previous_blob_id = media_file.blob_id if media_file else None
+        media_file, _ = MediaFile.objects.update_or_create(
+            path=name, defaults={'blob_id': sha256, 'mtime_ns': os.stat(path).st_mtime_ns},
+        )
+        if previous_blob_id != sha256:
+            MediaBlob.objects.filter(pk=sha256).update(ref_count=F('ref_count') + 1)
+            if previous_blob_id:
+                _release(previous_blob_id)
+    return media_file
+
+
+def release_file(name):
+    """Forgets `name` once nothing references it; its blob goes when its last path does."""
+    name = name.replace('\\', '/')
+    if is_referenced(name):
+        return
+    with transaction.atomic():
+        media_file = MediaFile.objects.filter(path=name).first()
+        if media_file is not None:
+            media_file.delete()
+            _release(media_file.blob_id)
+
+
+def deduplicate(dry_run=False, progress=None):
+    """
+    Links every referenced media file to its blob, drops the paths that are no longer referenced
+    and recounts the references. Returns a summary dict; with dry_run only the duplicates are counted.
+    """
+    summary = {'files': 0, 'linked': 0, 'released': 0, 'blobs': 0, 'bytes_saved': 0, 'failed': 0}
+    known = {media_file.path: media_file for media_file in MediaFile.objects.all()}
+    # Reuse the hashes of the document index where the file has not changed since
+    indexed = {
+        path: (size, mtime_ns, sha256)
+        for path, size, mtime_ns, sha256 in Document.objects.values_list('relative_path', 'size', 'mtime_ns', 'sha256')
+    }
+    names = sorted(referenced_paths())
+    sizes_by_hash = {}
+    for name in names:
+        try:
+            stat = os.stat(media_path(name))
+        except FileNotFoundError:
+            continue
+        summary['files'] += 1
+        if _is_linked(known.get(name), stat):
+            sha256 = known[name].blob_id
+        else:
+            size, mtime_ns, sha256 = indexed.get(name, (None, None, None))
+            if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns) or not sha256:
+                sha256 = file_sha256(media_path(name))
+            if not dry_run:
+                if add_file(name, sha256) is None:
+                    summary['failed'] += 1
+                    continue
+                summary['linked'] += 1
+        sizes_by_hash.setdefault(sha256, []).append(stat.st_size)
+        if progress and summary['files'] % 500 == 0:
+            progress(summary)
+
+    summary['blobs'] = len(sizes_by_hash)
+    summary['bytes_saved'] = sum(sum(sizes[1:]) for sizes in sizes_by_hash.values())
+    if dry_run:
+        return summary
+
+    referenced = set(names)
+    for name in known.keys() - referenced:
+        release_file(name)
+        summary['released'] += 1
+
+    # Recount from the links themselves, repairing counts left behind by interrupted runs
+    with transaction.atomic():
+        counts = dict(MediaFile.objects.values('blob').annotate(n=Count('id')).values_list('blob', 'n'))
+        blobs = list(MediaBlob.objects.all())
+        for blob in blobs:
+            blob.ref_count = counts.get(blob.sha256, 0)
+        MediaBlob.objects.bulk_update(blobs, ['ref_count'], batch_size=1000)
+        orphans = [blob.sha256 for blob in blobs if blob.ref_count == 0]
+        MediaBlob.objects.filter(pk__in=orphans).delete()
+    for sha256 in orphans:
+        try:
+            os.remove(blob_path(sha256))
+        except FileNotFoundError:
+            pass
+    return summary
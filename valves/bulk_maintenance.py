@@ -0,0 +1,61 @@
+"""
+Creates many maintenance records in one go, for the bulk entry grid and its API endpoint.
+
+The rows' tag numbers, technician names and activities are each resolved with one query, missing
+technicians are created with one bulk_create, and the records and their activity links are
+inserted with one bulk_create each, all in one transaction. Rows are saved all together or not at all: if any row has an error, nothing is
+written and the errors are reported per row, so the crew can fix those rows and submit again.
+"""
+from django.db import transaction
+from .activities import link_activities
+from .caching import bump_valve_version
+from .models import MaintenanceHistory, Technician, Valve
+
+MAX_ROWS = 200
+
+
+def create_maintenance_records(rows):
+    """
+    `rows` are dicts with valve_tag_number, technician_name, maintenance_date and optionally
+    oracle_code, maintenance_activities (a list), maintenance_notes and is_active.
+
+    Returns (records, errors): the created records, or [] and {row index: {field: [messages]}}.
+    """
+    tags = {row['valve_tag_number'].strip() for row in rows}
+    valve_ids = dict(Valve.objects.filter(tag_number__in=tags).values_list('tag_number', 'valve_id'))
+
+    errors = {}
+    for index, row in enumerate(rows):
+        if row['valve_tag_number'].strip() not in valve_ids:
+            errors[index] = {'valve_tag_number': ["No valve found with this tag number."]}
+    if errors:
+        return [], errors
+
+    names = {row['technician_name'].strip() for row in rows}
+    with transaction.atomic():
+        technicians = {}
+        for technician in Technician.objects.filter(name__in=names).order_by('-pk'):
+            # Names are not unique; use the oldest technician, as get_or_create would find
+            technicians[technician.name] = technician
+        missing = sorted(names - technicians.keys())
+        if missing:
+            created = Technician.objects.bulk_create([Technician(name=name) for name in missing])
+            technicians.update((technician.name, technician) for technician in created)
+
+        records = MaintenanceHistory.objects.bulk_create([
+            MaintenanceHistory(
+                valve_id=valve_ids[row['valve_tag_number'].strip()],
+                technician=technicians[row['technician_name'].strip()],
+                maintenance_date=row['maintenance_date'],
+                oracle_code=row.get('oracle_code') or None,
+                maintenance_activities=','.join(row.get('maintenance_activities') or []),
+                maintenance_notes=row.get('maintenance_notes') or None,
+                is_active=row.get('is_active', True),
+            )
+            for row in rows
+        ])
+        link_activities(records, [row.get('maintenance_activities') or [] for row in rows])
+
+    # bulk_create sends no model signals
+    bump_valve_version(*{record.valve_id for record in records})
+    return records, {}
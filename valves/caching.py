@@ -0,0 +1,94 @@
+import secrets
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+VALVE_VERSION_KEY = 'valves:version:%s'
+PART_CODES_VERSION_KEY = 'valves:version:part-codes'
+LOOKUPS_VERSION_KEY = 'valves:version:lookups'
+TAG_INDEX_VERSION_KEY = 'valves:version:tag-index'
+
+
+def _new_version():
+    # A random value rather than cache.incr(): on the database and file caches incr is a
+    # get-then-set, so two concurrent bumps could both write the same number and a reader could
+    # keep a version that already holds stale content. Every bump here is a single write of a
+    # value no reader has seen, and a counter that was evicted never restarts at an old value.
+    return secrets.randbits(62)
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_on_commit(*keys):
+    # After commit, so no request can cache the rows being replaced under the new version
+    transaction.on_commit(lambda: cache.set_many({key: _new_version() for key in keys}, None))
+
+
+def require_shared_cache():
+    """
+    Raises ImproperlyConfigured when the default cache lives in this process's memory. Commands
+    that write valve data call this first: the versions they bump there would never reach the
+    web workers, which would keep serving the old pages.
+    """
+    if isinstance(caches['default'], LocMemCache):
+        raise ImproperlyConfigured(
+            "The default cache is the local-memory cache, which this command cannot share with the "
+            "web server. Set REDIS_URL, or use the database cache (the default; run `manage.py createcachetable`)."
+        )
+
+
+def valve_version(valve_id):
+    """Current cache version of one valve; part of every cache key derived from that valve."""
+    return _get_version(VALVE_VERSION_KEY % valve_id)
+
+
+def valve_versions(valve_ids):
+    """Cache versions of several valves in one cache round trip, as {valve_id: version}."""
+    keys = {VALVE_VERSION_KEY % valve_id: valve_id for valve_id in valve_ids}
+    found = cache.get_many(keys)
+    versions = {keys[key]: version for key, version in found.items()}
+    for key, valve_id in keys.items():
+        if valve_id not in versions:
+            versions[valve_id] = _get_version(key)
+    return versions
+
+
+def bump_valve_version(*valve_ids):
+    """Marks every cached entry derived from the given valves as stale, once the current transaction commits."""
+    keys = [VALVE_VERSION_KEY % valve_id for valve_id in set(valve_ids) if valve_id is not None]
+    if keys:
+        _bump_on_commit(*keys)
+
+
+def part_codes_version():
+    """Cache version shared by everything derived from the part code catalogue as a whole."""
+    return _get_version(PART_CODES_VERSION_KEY)
+
+
+def bump_part_codes_version():
+    _bump_on_commit(PART_CODES_VERSION_KEY)
+
+
+def lookups_version():
+    """Cache version of the lookup tables (types, statuses, manufacturers, factories) shown with every valve."""
+    return _get_version(LOOKUPS_VERSION_KEY)
+
+
+def bump_lookups_version():
+    _bump_on_commit(LOOKUPS_VERSION_KEY)
+
+
+def tag_index_version():
+    """Version of the valve tags and their factories; worker processes rebuild their tag index when it moves."""
+    return _get_version(TAG_INDEX_VERSION_KEY)
+
+
+def bump_tag_index_version():
+    _bump_on_commit(TAG_INDEX_VERSION_KEY)
@@ -0,0 +1,49 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from .models import Factory, Valve
+
+DASHBOARD_CACHE_KEY = 'valves:dashboard'
+DASHBOARD_CACHE_TIMEOUT = 60 * 15  # Safety net for writes that bypass model signals
+
+
+def build_factory_dashboard():
+    """
+    Builds the home page statistics with a single grouped query.
+    Every factory is annotated with its total, operational and needs-maintenance valve counts.
+    """
+    factories = Factory.objects.annotate(
+        total_valves=Count('valve'),
+        operational_valves=Count('valve', filter=Q(valve__status__name__icontains='Operational')),
+        needs_maintenance_valves=Count('valve', filter=Q(valve__status__name__icontains='Needs Maintenance')),
+    ).order_by('name')
+
+    main_factories = []
+    zld_factory = None
+    for factory in factories:
+        if factory.name == 'ZLD':
+            zld_factory = factory
+        else:
+            main_factories.append(factory)
+
+    return {
+        'main_factories': main_factories,
+        'zld_factory': zld_factory,
+        'recent_valves': list(Valve.objects.order_by('-valve_id')[:5]),
+    }
+
+
+def get_factory_dashboard():
+    """
+    Returns the cached dashboard snapshot, rebuilding it on a cache miss.
+    """
+    snapshot = cache.get(DASHBOARD_CACHE_KEY)
+    if snapshot is None:
+        snapshot = build_factory_dashboard()
+        cache.set(DASHBOARD_CACHE_KEY, snapshot, DASHBOARD_CACHE_TIMEOUT)
+    return snapshot
+
+
+def invalidate_dashboard():
+    # After commit, so a concurrent request cannot cache a snapshot of the rows being replaced
+    transaction.on_commit(lambda: cache.delete(DASHBOARD_CACHE_KEY))
@@ -0,0 +1,179 @@
+"""
+Index of the document files under MEDIA_ROOT/<factory>/<document type>/.
+
+The documents page reads the Document table instead of walking the media directory on every
+request. scan_documents() keeps the table in sync: it lists a directory again only when the
+directory's mtime differs from the one recorded at the last scan, and still stats the known
+subdirectories of an unchanged directory, since a change deep in the tree does not touch the
+mtime of its ancestors. Files are re-hashed only when their size or mtime changed.
+
+A file rewritten in place does not change its directory's mtime; run a full scan to pick it up.
+"""
+import hashlib
+import os
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction
+from .models import Document, DocumentFolder
+from .thumbnails import THUMBS_DIR
+
+# Top-level media directories that do not hold documents (valve images are tracked by ValveImage)
+EXCLUDED_TOP_LEVEL_DIRS = {'valves'}
+
+# Documents live at least this many directories below MEDIA_ROOT: <factory>/<document type>/...
+DOCUMENT_DEPTH = 2
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _join(folder, name):
+    return f'{folder}/{name}' if folder else name
+
+
+def _is_excluded(folder, name):
+    if name == THUMBS_DIR:
+        return True
+    # Hidden top-level directories hold work in progress, e.g. chunked uploads in .uploads/
+    return not folder and (name.startswith('.') or name.lower() in EXCLUDED_TOP_LEVEL_DIRS)
+
+
+def _document_for(folder, relative_path, stat, absolute_path):
+    parts = relative_path.split('/')
+    return Document(
+        folder=folder,
+        factory=parts[0],
+        doc_type=parts[1],
+        relative_path=relative_path,
+        name='/'.join(parts[DOCUMENT_DEPTH:]),
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        sha256=file_sha256(absolute_path),
+    )
+
+
+def _upsert_documents(documents):
+    Document.objects.bulk_create(
+        documents,
+        update_conflicts=True,
+        unique_fields=['relative_path'],
+        update_fields=['folder', 'factory', 'doc_type', 'name', 'size', 'mtime_ns', 'sha256', 'indexed_at'],
+    )
+
+
+class DocumentScanner:
+    """
+    Synchronizes Document and DocumentFolder with the files under `media_root`.
+
+    With full=True every directory is listed regardless of its recorded mtime.
+    """
+
+    def __init__(self, media_root=None, full=False):
+        self.media_root = media_root or settings.MEDIA_ROOT
+        self.full = full
+        self.summary = {'folders_scanned': 0, 'folders_skipped': 0, 'added': 0, 'updated': 0, 'removed': 0}
+
+    def run(self):
+        folders = {folder.path: folder for folder in DocumentFolder.objects.all()}
+        children = defaultdict(list)
+        for path in folders:
+            if path:
+                children[path.rpartition('/')[0]].append(path)
+
+        seen = set()
+        pending = ['']
+        while pending:
+            path = pending.pop()
+            try:
+                mtime_ns = os.stat(os.path.join(self.media_root, path)).st_mtime_ns
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            seen.add(path)
+            folder = folders.get(path)
+            if folder is not None and not self.full and folder.mtime_ns == mtime_ns:
+                # The listing is unchanged, but subdirectories may have changed below it
+                self.summary['folders_skipped'] += 1
+                pending.extend(children[path])
+                continue
+            pending.extend(self.scan_folder(path, folder, mtime_ns))
+            self.summary['folders_scanned'] += 1
+
+        gone = [path for path in folders if path not in seen]
+        if gone:
+            self.summary['removed'] += Document.objects.filter(folder__path__in=gone).count()
+            DocumentFolder.objects.filter(path__in=gone).delete()
+        return self.summary
+
+    def scan_folder(self, path, folder, mtime_ns):
+        """
+        Lists one directory, syncs the documents directly inside it and returns its subdirectories.
+        """
+        absolute_dir = os.path.join(self.media_root, path)
+        subdirs, files = [], {}
+        with os.scandir(absolute_dir) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not _is_excluded(path, entry.name):
+                        subdirs.append(_join(path, entry.name))
+                elif entry.is_file():
+                    files[entry.name] = entry.stat()
+
+        with transaction.atomic():
+            # The mtime read before listing is stored, so a change made during the scan is seen next time
+            if folder is None:
+                folder = DocumentFolder.objects.create(path=path, mtime_ns=mtime_ns)
+            else:
+                folder.mtime_ns = mtime_ns
+                folder.save(update_fields=['mtime_ns', 'scanned_at'])
+
+            if path.count('/') + 1 < DOCUMENT_DEPTH:
+                return subdirs
+
+            existing = {
+                relative_path: (size, file_mtime_ns)
+                for relative_path, size, file_mtime_ns in folder.documents.values_list('relative_path', 'size', 'mtime_ns')
+            }
+            changed = []
+            for name, stat in files.items():
+                relative_path = _join(path, name)
+                previous = existing.pop(relative_path, None)
+                if previous == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                changed.append(_document_for(folder, relative_path, stat, os.path.join(absolute_dir, name)))
+                self.summary['updated' if previous else 'added'] += 1
+            _upsert_documents(changed)
+            if existing:
+                Document.objects.filter(relative_path__in=existing).delete()
+                self.summary['removed'] += len(existing)
+        return subdirs
+
+
+def scan_documents(media_root=None, full=False):
+    """Runs an incremental (or full) scan of the media directory and returns the summary dict."""
+    return DocumentScanner(media_root=media_root, full=full).run()
+
+
+def index_document(relative_path, media_root=None):
+    """
+    Adds or refreshes a single file in the index, e.g. right after an upload.
+    Returns the Document, or None if the path is not a document location.
+    """
+    media_root = media_root or settings.MEDIA_ROOT
+    relative_path = relative_path.replace('\\', '/').strip('/')
+    parts = relative_path.split('/')
+    if len(parts) <= DOCUMENT_DEPTH or '..' in parts or _is_excluded('', parts[0]) or THUMBS_DIR in parts:
+        return None
+    absolute_path = os.path.join(media_root, *parts)
+    stat = os.stat(absolute_path)
+
+    # The folder's mtime is left alone so the next scan still lists it and picks up its other changes
+    folder, _ = DocumentFolder.objects.get_or_create(path=relative_path.rpartition('/')[0])
+    _upsert_documents([_document_for(folder, relative_path, stat, absolute_path)])
+    return Document.objects.get(relative_path=relative_path)
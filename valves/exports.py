@@ -0,0 +1,229 @@
+"""
+Row generators and streaming responses shared by the export command and the list view exports.
+
+Rows are read with .iterator(chunk_size=...), so an export holds one chunk in memory at a time.
+Flat exports use values_list() over joins; exports with to-many columns prefetch once per chunk.
+"""
+import csv
+import re
+import zipfile
+from xml.sax.saxutils import escape
+from django.http import StreamingHttpResponse
+from django.db.models import Prefetch
+from .models import MaintenanceHistory, MaintenancePart, Valve
+
+DEFAULT_CHUNK_SIZE = 2000
+
+MAINTENANCE_EXPORT_HEADERS = ['Factory', 'Tag_Number', 'Date', 'Work_Done', 'Test', 'Technician']
+
+
+def split_maintenance_notes(notes):
+    """
+    Splits notes written by the importer ("<work done>\\nTest: <test>") into (work_done, test).
+    """
+    notes = notes or ''
+    if 'Test:' in notes:
+        parts = notes.split('Test:')
+        return parts[0].strip(), parts[1].strip()
+    return notes, ''
+
+
+def maintenance_export_rows(queryset=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields one list per maintenance record, in MAINTENANCE_EXPORT_HEADERS order.
+    """
+    if queryset is None:
+        queryset = MaintenanceHistory.objects.order_by('maintenance_id')
+    rows = queryset.values_list(
+        'valve__factory__name', 'valve__tag_number', 'maintenance_date', 'maintenance_notes', 'technician__name'
+    ).iterator(chunk_size=chunk_size)
+    for factory, tag, maintenance_date, notes, technician in rows:
+        work_done, test = split_maintenance_notes(notes)
+        yield [factory or '', tag, maintenance_date.strftime('%d-%m-%Y'), work_done, test, technician or '']
+
+
+VALVE_EXPORT_HEADERS = ['Tag Number', 'Name', 'Factory', 'Type', 'Location', 'Status', 'Manufacturer', 'Model Number']
+
+
+def valve_export_rows(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    return (
+        list(row) for row in queryset.values_list(
+            'tag_number', 'name', 'factory__name', 'valve_type__name', 'location', 'status__name',
+            'manufacturer__name', 'model_number',
+        ).iterator(chunk_size=chunk_size)
+    )
+
+
+PART_CODE_EXPORT_HEADERS = [
+    'SAP Code', 'Oracle Code', 'Description', 'Part Number', 'Manufacturer', 'Unit of Measure',
+    'Category', 'Condition', 'Location', 'Valves',
+]
+
+
+def part_code_export_rows(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    # With chunk_size, iterator() runs the valve prefetch once per chunk
+    part_codes = queryset.prefetch_related(
+        Prefetch('associated_valves', queryset=Valve.objects.only('valve_id', 'tag_number'))
+    ).iterator(chunk_size=chunk_size)
+    for code in part_codes:
+        yield [
+            code.sap_code, code.oracle_code, code.description, code.part_number, code.manufacturer_co,
+            code.unit_of_measure, code.category, code.condition, code.location,
+            ', '.join(valve.tag_number for valve in code.associated_valves.all()),
+        ]
+
+
+SHUTDOWN_EXPORT_HEADERS = MAINTENANCE_EXPORT_HEADERS + ['Parts Used']
+
+
+def shutdown_export_rows(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    records = queryset.select_related('valve__factory', 'technician').prefetch_related(
+        Prefetch('maintenancepart_set', queryset=MaintenancePart.objects.select_related('code'))
+    ).iterator(chunk_size=chunk_size)
+    for record in records:
+        work_done, test = split_maintenance_notes(record.maintenance_notes)
+        parts = '; '.join(
+            f"{part.code.sap_code} - {part.code.description}" for part in record.maintenancepart_set.all()
+        )
+        yield [
+            record.valve.factory.name if record.valve.factory else '',
+            record.valve.tag_number,
+            record.maintenance_date.strftime('%d-%m-%Y'),
+            work_done,
+            test,
+            record.technician.name if record.technician else '',
+            parts,
+        ]
+
+
+# Streaming responses
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Rows written between two flushes of the response
+STREAM_BATCH_ROWS = 500
+
+
+class _Echo:
+    """File-like object whose write() returns the data, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(headers, rows):
+    writer = csv.writer(_Echo())
+    # Excel needs the BOM to open UTF-8 (e.g. Arabic) text correctly
+    yield '\ufeff' + writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+class _Sink:
+    """Write-only buffer drained by the XLSX generator after every batch of rows."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def _xlsx_row(values):
+    cells = []
+    for value in values:
+        text = _XML_ILLEGAL.sub('', '' if value is None else str(value))
+        cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>')
+    return '<row>' + ''.join(cells) + '</row>'
+
+
+def stream_xlsx(headers, rows, sheet_name='Export'):
+    """
+    Writes a single-sheet workbook with inline strings, yielding the zip bytes as they are produced,
+    so the workbook is never held in memory.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as workbook:
+        workbook.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES)
+        workbook.writestr('_rels/.rels', XLSX_ROOT_RELS)
+        workbook.writestr('xl/workbook.xml', XLSX_WORKBOOK.format(name=escape(sheet_name[:31])))
+        workbook.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS)
+        yield sink.drain()
+
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(headers).encode('utf-8'))
+            batch = []
+            for row in rows:
+                batch.append(_xlsx_row(row))
+                if len(batch) >= STREAM_BATCH_ROWS:
+                    sheet.write(''.join(batch).encode('utf-8'))
+                    batch = []
+                    yield sink.drain()
+            sheet.write(''.join(batch).encode('utf-8'))
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
+
+
+def export_response(export_format, filename, headers, rows):
+    """
+    Streams `rows` as a CSV or XLSX attachment named `filename` (without extension).
+    """
+    if export_format == 'xlsx':
+        response = StreamingHttpResponse(stream_xlsx(headers, rows, sheet_name=filename), content_type=XLSX_CONTENT_TYPE)
+    else:
+        response = StreamingHttpResponse(stream_csv(headers, rows), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
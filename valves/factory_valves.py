@@ -0,0 +1,72 @@
+"""
+Cached valve lists per factory, for the valve selectors of the shutdown form.
+
+The full list of a factory is serialized once, to JSON and to gzip-compressed JSON, and cached
+under the tag index version (see valves/caching.py), which moves whenever a valve's tag or
+factory changes. The view answers repeated requests for an unchanged list with a 304 through
+the payload's ETag.
+
+Each encoding gets its own ETag, so a cache in between never answers a client with a body in an
+encoding it did not ask for. Brotli is offered when the optional `brotli` package is installed.
+"""
+import gzip
+import hashlib
+import json
+import re
+from django.core.cache import cache
+from django.middleware.gzip import re_accepts_gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+from .caching import tag_index_version
+from .models import Valve
+
+FACTORY_VALVES_CACHE_TIMEOUT = 60 * 60
+DEFAULT_SEARCH_LIMIT = 50
+re_accepts_brotli = re.compile(r'\bbr\b')
+MAX_SEARCH_LIMIT = 200
+
+
+def factory_valves_payload(factory_id):
+    """
+    Returns {'etag': ..., 'json': bytes, 'gzip': bytes} for every valve of a factory, by tag, with
+    'br': bytes as well when brotli is installed.
+    """
+    key = 'valves:factory-valves:%s:%s' % (factory_id, tag_index_version())
+    payload = cache.get(key)
+    if payload is None:
+        valves = list(Valve.objects.filter(factory_id=factory_id).order_by('tag_number').values('valve_id', 'tag_number'))
+        content = json.dumps(valves, separators=(',', ':')).encode('utf-8')
+        payload = {
+            'etag': '"%s"' % hashlib.md5(content).hexdigest(),
+            'json': content,
+            'gzip': gzip.compress(content, compresslevel=6, mtime=0),
+        }
+        if brotli is not None:
+            payload['br'] = brotli.compress(content, quality=5)
+        cache.set(key, payload, FACTORY_VALVES_CACHE_TIMEOUT)
+    return payload
+
+
+def negotiate_encoding(payload, accept_encoding):
+    """
+    Picks the smallest body the client accepts. Returns (body, content encoding or None, ETag);
+    the ETag of an encoded body carries the encoding as a suffix.
+    """
+    if 'br' in payload and re_accepts_brotli.search(accept_encoding):
+        encoding = 'br'
+    elif re_accepts_gzip.search(accept_encoding):
+        encoding = 'gzip'
+    else:
+        return payload['json'], None, payload['etag']
+    return payload[encoding], encoding, '%s-%s"' % (payload['etag'][:-1], encoding)
+
+
+def search_factory_valves(factory_id, term, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+    """One page of a factory's valves whose tag contains `term`, by tag."""
+    limit = max(0, min(limit, MAX_SEARCH_LIMIT))
+    offset = max(0, offset)
+    valves = Valve.objects.filter(factory_id=factory_id, tag_number__icontains=term).order_by('tag_number')
+    return list(valves.values('valve_id', 'tag_number')[offset:offset + limit])
@@ -1,5 +1,53 @@
 from django import forms
-from .models import Valve, SparePart, PartCode, MaintenanceHistory, Shutdown, Technician
+from django.core.exceptions import ValidationError
+from django.urls import reverse_lazy
+from PIL import Image
+from .models import Valve, SparePart, PartCode, MaintenanceHistory, Shutdown, Technician, ChunkedUpload
+from .activities import set_activities
+from .bulk_maintenance import MAX_ROWS
+from .uploads import claim_upload
+
+class ChunkedUploadField(forms.UUIDField):
+    """
+    Hidden field carrying the id of a completed chunked upload (see valves/uploads.py), filled in by
+    static/js/chunked_upload.js in place of a large file input. Cleans to the ChunkedUpload.
+    Only uploads of `user` are accepted, which ChunkedUploadFormMixin sets to the submitting user;
+    without one no upload is.
+    """
+    widget = forms.HiddenInput
+
+    def __init__(self, image=False, **kwargs):
+        self.image = image
+        self.user = None
+        kwargs.setdefault('required', False)
+        super().__init__(**kwargs)
+
+    def to_python(self, value):
+        upload_id = super().to_python(value)
+        if upload_id is None:
+            return None
+        # Someone else's upload id gets the same answer as an unknown one
+        upload = ChunkedUpload.objects.filter(pk=upload_id, user=self.user, completed_at__isnull=False).first()
+        if upload is None:
+            raise ValidationError("The uploaded file is missing or incomplete. Please upload it again.")
+        if self.image:
+            try:
+                with Image.open(upload.temp_path) as image:
+                    image.verify()
+            except Exception:
+                raise ValidationError(forms.ImageField.default_error_messages['invalid_image'])
+        return upload
+
+
+class ChunkedUploadFormMixin:
+    """Takes the submitting user as `user=` and hands it to the form's ChunkedUploadFields."""
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        for field in self.fields.values():
+            if isinstance(field, ChunkedUploadField):
+                field.user = user
+
 
 class ValveForm(forms.ModelForm):
     class Meta:
@@ -78,7 +126,28 @@ class PartCodeForm(forms.ModelForm):
             'category': 'Category',
         }
 
-class MaintenanceHistoryForm(forms.ModelForm):
+MAINTENANCE_ACTIVITY_CHOICES = [
+    ('On site', 'On site'),
+    ('In the workshop', 'In the workshop'),
+    ('Gland tightening', 'Gland tightening'),
+    ('Adding packing', 'Adding packing'),
+    ('Replacing packing', 'Replacing packing'),
+    ('Replacing actuator', 'Replacing actuator'),
+    ('Replacing bushing', 'Replacing bushing'),
+    ('Replacing diaphragm', 'Replacing diaphragm'),
+    ('Replacing plug', 'Replacing plug'),
+    ('Machining plug', 'Machining plug'),
+    ('Replacing seat', 'Replacing seat'),
+    ('Machining seat', 'Machining seat'),
+    ('Replacing cage', 'Replacing cage'),
+    ('Machining cage', 'Machining cage'),
+    ('Welding plug', 'Welding plug'),
+    ('Welding seat', 'Welding seat'),
+    ('Welding body', 'Welding body'),
+    ('Machining body', 'Machining body'),
+]
+
+class MaintenanceHistoryForm(ChunkedUploadFormMixin, forms.ModelForm):
     valve_tag_number = forms.CharField(
         label='Valve Tag Number',
         widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Start typing to search for a valve...'}),
@@ -90,35 +159,18 @@ class MaintenanceHistoryForm(forms.ModelForm):
         required=True
     )
     maintenance_activities = forms.MultipleChoiceField(
-        choices=[
-            ('On site', 'On site'),
-            ('In the workshop', 'In the workshop'),
-            ('Gland tightening', 'Gland tightening'),
-            ('Adding packing', 'Adding packing'),
-            ('Replacing packing', 'Replacing packing'),
-            ('Replacing actuator', 'Replacing actuator'),
-            ('Replacing bushing', 'Replacing bushing'),
-            ('Replacing diaphragm', 'Replacing diaphragm'),
-            ('Replacing plug', 'Replacing plug'),
-            ('Machining plug', 'Machining plug'),
-            ('Replacing seat', 'Replacing seat'),
-            ('Machining seat', 'Machining seat'),
-            ('Replacing cage', 'Replacing cage'),
-            ('Machining cage', 'Machining cage'),
-            ('Welding plug', 'Welding plug'),
-            ('Welding seat', 'Welding seat'),
-            ('Welding body', 'Welding body'),
-            ('Machining body', 'Machining body'),
-        ],
+        choices=MAINTENANCE_ACTIVITY_CHOICES,
         widget=forms.CheckboxSelectMultiple,
         required=False
     )
+    before_image_upload = ChunkedUploadField(image=True)
+    after_image_upload = ChunkedUploadField(image=True)
 
     class Meta:
         model = MaintenanceHistory
         fields = [
             'valve_tag_number', 'valve', 'maintenance_date', 
-            'oracle_code', 'maintenance_activities', 'maintenance_notes', 'is_active', 
+            'oracle_code', 'maintenance_notes', 'is_active', 
             'before_image', 'after_image'
         ]
         widgets = {
@@ -127,8 +179,8 @@ class MaintenanceHistoryForm(forms.ModelForm):
             'oracle_code': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'SAP Code / Oracle Code / Order Number'}),
             'maintenance_notes': forms.Textarea(attrs={'class': 'form-control', 'rows': 5}),
             'is_active': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
-            'before_image': forms.FileInput(attrs={'class': 'form-control'}),
-            'after_image': forms.FileInput(attrs={'class': 'form-control'}),
+            'before_image': forms.FileInput(attrs={'class': 'form-control', 'data-chunked-upload': 'before_image_upload'}),
+            'after_image': forms.FileInput(attrs={'class': 'form-control', 'data-chunked-upload': 'after_image_upload'}),
         }
         labels = {
             'valve': 'Valve ID',
@@ -148,8 +200,7 @@ class MaintenanceHistoryForm(forms.ModelForm):
                 self.fields['valve_tag_number'].initial = self.instance.valve.tag_number
             if self.instance.technician:
                 self.fields['technician_name'].initial = self.instance.technician.name
-            if self.instance.maintenance_activities:
-                self.fields['maintenance_activities'].initial = self.instance.maintenance_activities.split(',')
+            self.fields['maintenance_activities'].initial = [activity.name for activity in self.instance.activities.all()]
 
     def clean(self):
         cleaned_data = super().clean()
@@ -172,23 +223,95 @@ class MaintenanceHistoryForm(forms.ModelForm):
         instance = super().save(commit=False)
         instance.technician = self.cleaned_data.get('technician')
         instance.valve = self.cleaned_data.get('valve')
-        instance.maintenance_activities = ','.join(self.cleaned_data.get('maintenance_activities', []))
+
+        # Images sent through the chunked upload API are moved to where the ImageField would store them
+        for field_name in ('before_image', 'after_image'):
+            upload = self.cleaned_data.get(f'{field_name}_upload')
+            if upload:
+                field_file = getattr(instance, field_name)
+                field_file.name = claim_upload(upload, field_file.field.generate_filename(instance, upload.filename))
         
         if commit:
             instance.save()
+            self._save_m2m()
         return instance
 
+    def _save_m2m(self):
+        super()._save_m2m()
+        # Also rewrites instance.maintenance_activities (see valves/activities.py)
+        set_activities(self.instance, self.cleaned_data.get('maintenance_activities', []))
+
+class BulkMaintenanceRowForm(forms.Form):
+    """One row of the bulk maintenance grid; tags and technicians are resolved for all rows at once."""
+    valve_tag_number = forms.CharField(
+        max_length=100, widget=forms.TextInput(attrs={'class': 'form-control form-control-sm valve-tag-input'})
+    )
+    technician_name = forms.CharField(
+        max_length=255, widget=forms.TextInput(attrs={'class': 'form-control form-control-sm', 'list': 'technicians-list'})
+    )
+    maintenance_date = forms.DateField(widget=forms.DateInput(attrs={'class': 'form-control form-control-sm', 'type': 'date'}))
+    oracle_code = forms.CharField(
+        max_length=255, required=False, widget=forms.TextInput(attrs={'class': 'form-control form-control-sm'})
+    )
+    maintenance_activities = forms.MultipleChoiceField(
+        choices=MAINTENANCE_ACTIVITY_CHOICES,
+        widget=forms.SelectMultiple(attrs={'class': 'form-select form-select-sm', 'size': 3}),
+        required=False
+    )
+    maintenance_notes = forms.CharField(
+        required=False, widget=forms.Textarea(attrs={'class': 'form-control form-control-sm', 'rows': 1})
+    )
+    is_active = forms.BooleanField(initial=True, required=False, widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}))
+
+
+class BaseBulkMaintenanceFormSet(forms.BaseFormSet):
+    def rows(self):
+        """The cleaned data of the rows that were filled in, as (form, data) pairs."""
+        return [(form, form.cleaned_data) for form in self.forms if form.has_changed() and form.cleaned_data]
+
+
+BulkMaintenanceFormSet = forms.formset_factory(
+    BulkMaintenanceRowForm, formset=BaseBulkMaintenanceFormSet, extra=10, max_num=MAX_ROWS, validate_max=True
+)
+
+
+class ValvePickerWidget(forms.SelectMultiple):
+    """
+    Multiple select that renders only the selected valves as <option>s. static/js/valve_picker.js
+    adds a search box that pages through the factory's other valves from get_valves_by_factory,
+    so the page stays the same size however many valves the factory has.
+    """
+
+    class Media:
+        js = ('js/valve_picker.js',)
+
+    def __init__(self, attrs=None):
+        attrs = {'data-valve-picker': reverse_lazy('valves:get-valves-by-factory'), **(attrs or {})}
+        super().__init__(attrs)
+
+    def optgroups(self, name, value, attrs=None):
+        choices = self.choices
+        selected = [pk for pk in value if str(pk).isdigit()]
+        self.choices = list(choices.queryset.filter(pk__in=selected).values_list('pk', 'tag_number')) if selected else []
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = choices
+
+
 class ShutdownReportForm(forms.ModelForm):
+    # Submitted ids are checked with one pk__in query against the factory's valves
     valves = forms.ModelMultipleChoiceField(
         queryset=Valve.objects.all(),
-        widget=forms.SelectMultiple(attrs={'class': 'select2-multiple', 'multiple': 'multiple'}),
+        widget=ValvePickerWidget(attrs={'class': 'form-control', 'data-factory-input': 'factory'}),
         required=False
     )
 
     class Meta:
         model = Shutdown
-        fields = ['factory', 'start_date', 'end_date', 'valves']
+        fields = ['name', 'factory', 'start_date', 'end_date', 'valves']
         widgets = {
+            'name': forms.TextInput(attrs={'class': 'form-control'}),
             'factory': forms.Select(attrs={'class': 'form-control'}),
             'start_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'end_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
@@ -210,9 +333,16 @@ class ShutdownReportForm(forms.ModelForm):
             self.fields['valves'].queryset = self.instance.factory.valve_set.order_by('tag_number')
             self.fields['valves'].widget.attrs.pop('disabled')
 
-class DocumentUploadForm(forms.Form):
+class DocumentUploadForm(ChunkedUploadFormMixin, forms.Form):
     factory = forms.CharField(max_length=100, widget=forms.TextInput(attrs={'class': 'form-control', 'list': 'factory-list'}))
     document_type = forms.CharField(max_length=100, widget=forms.TextInput(attrs={'class': 'form-control', 'list': 'doctype-list'}))
     name = forms.CharField(max_length=100, widget=forms.TextInput(attrs={'class': 'form-control'}))
-    file = forms.FileField(widget=forms.FileInput(attrs={'class': 'form-control'}))
+    file = forms.FileField(required=False, widget=forms.FileInput(attrs={'class': 'form-control', 'data-chunked-upload': 'upload'}))
+    upload = ChunkedUploadField()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('file') and not cleaned_data.get('upload') and 'upload' not in self.errors:
+            self.add_error('file', forms.Field.default_error_messages['required'])
+        return cleaned_data
         
\ No newline at end of file
@@ -0,0 +1,45 @@
+"""
+Versioned cache of the rendered valve summary shown at the top of the detail page.
+
+Entries are keyed by the valve's cache version and the lookups version (valves/caching.py), so a
+bumped version makes the old entry unreachable instead of requiring it to be deleted. A hit
+renders the detail page without touching the database.
+"""
+from django.core.cache import cache
+from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
+from django.utils.translation import get_language
+from .caching import lookups_version, valve_version
+from .models import Valve
+
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+VALVE_FRAGMENTS = {
+    'header': 'valves/fragments/valve_header.html',
+    'details': 'valves/fragments/valve_details.html',
+    'specs': 'valves/fragments/valve_specs.html',
+}
+
+
+def valve_fragments_key(valve_id):
+    return 'valves:fragments:%s:%s:%s:%s' % (
+        valve_id, valve_version(valve_id), lookups_version(), get_language()
+    )
+
+
+def get_valve_fragments(request, valve_id):
+    """
+    Returns the rendered summary fragments of a valve as a dict with 'tag_number' and one
+    HTML string per entry of VALVE_FRAGMENTS. Raises Http404 if the valve does not exist.
+    """
+    key = valve_fragments_key(valve_id)
+    fragments = cache.get(key)
+    if fragments is None:
+        valve = get_object_or_404(
+            Valve.objects.select_related('valve_type', 'status', 'manufacturer', 'factory'), pk=valve_id
+        )
+        fragments = {'tag_number': valve.tag_number}
+        for name, template_name in VALVE_FRAGMENTS.items():
+            fragments[name] = render_to_string(template_name, {'valve': valve}, request=request)
+        cache.set(key, fragments, FRAGMENT_CACHE_TIMEOUT)
+    return fragments
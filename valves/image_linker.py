@@ -0,0 +1,159 @@
+"""
+Links image files under MEDIA_ROOT to valves as ValveImage records.
+
+The media directory is walked once with os.scandir, and the existing links are loaded in one
+query. The links to add, and with `prune` the links whose file has disappeared, are then computed
+as set differences and written with bulk_create and batched deletes. Each management command
+supplies a rule that maps an image's path to a (tag number, category) pair.
+"""
+import os
+import re
+from django.conf import settings
+from django.db import transaction
+from .caching import bump_valve_version
+from .models import ValveImage
+from .scripts.part_code_loader import load_valve_ids_by_tag
+from .thumbnails import THUMBS_DIR
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp')
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def walk_files(media_root):
+    """
+    Yields the path of every file under media_root, relative to it and with '/' separators.
+    Thumbnail folders and hidden folders (e.g. unfinished uploads) are skipped.
+    """
+    pending = ['']
+    while pending:
+        folder = pending.pop()
+        with os.scandir(os.path.join(media_root, folder)) as entries:
+            for entry in entries:
+                path = f'{folder}/{entry.name}' if folder else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != THUMBS_DIR and not entry.name.startswith('.'):
+                        pending.append(path)
+                elif entry.is_file():
+                    yield path
+
+
+# Rules: each takes a relative path and returns (tag number, category) or None
+
+def category_from_folder(parts):
+    # e.g. 'AFC I/P&ID drawings/FV-1_page_1.jpg'
+    if len(parts) > 2:
+        if 'P&ID' in parts[1]:
+            return 'P&ID'
+        if 'Maintenance' in parts[1]:
+            return 'Maintenance_Reports'
+    return 'Valves_Specs'
+
+
+def page_prefix_rule(path):
+    """Tag taken from file names like 'HV-33002_page_1.jpg', category from the folder."""
+    parts = path.split('/')
+    if '_page_' not in parts[-1]:
+        return None
+    return parts[-1].split('_page_')[0], category_from_folder(parts)
+
+
+TAG_PATTERN = re.compile(r'([A-Z]{1,3}-\d{3,5}[A-Z]?)', re.IGNORECASE)
+
+
+def tag_pattern_rule(path):
+    """Tag matched at the start of the file name, e.g. 'AV-21707 scan.jpg'."""
+    match = TAG_PATTERN.match(path.rsplit('/', 1)[-1])
+    if match is None:
+        return None
+    return match.group(1), 'Valves_Specs'
+
+
+def folder_layout_rule(path):
+    """Images laid out as <factory>/<category>/<tag number>/<file>."""
+    parts = path.split('/')
+    categories = {choice for choice, _ in ValveImage.IMAGE_CATEGORIES}
+    if len(parts) != 4 or parts[1] not in categories:
+        return None
+    return parts[2], parts[1]
+
+
+class ImageLinker:
+    """
+    Computes and applies the ValveImage changes for the image files under `media_root`.
+
+    Image files whose rule yields the tag of a known valve are linked unless that exact
+    (valve, path) link exists. Only with `prune` are links whose file no longer exists deleted;
+    an unmounted media directory would otherwise unlink every image. With `dry_run`, run() only
+    plans; the summary reports what would change.
+    """
+
+    def __init__(self, rule, extensions=IMAGE_EXTENSIONS, media_root=None, dry_run=False, prune=False,
+                 batch_size=DEFAULT_BATCH_SIZE, description=None):
+        self.rule = rule
+        self.extensions = tuple(extensions)
+        self.media_root = str(media_root or settings.MEDIA_ROOT)
+        self.dry_run = dry_run
+        self.prune = prune
+        self.batch_size = batch_size
+        # Optional callable: tag number -> description of a new link
+        self.description = description
+        self.summary = {'images': 0, 'created': 0, 'already_linked': 0, 'unmatched': 0, 'deleted': 0}
+        self.unknown_tags = set()
+
+    def plan(self):
+        """
+        Works out the links to create and the links to delete, in two queries, and fills the summary.
+        """
+        valve_ids = load_valve_ids_by_tag()
+        links = list(ValveImage.objects.values_list('pk', 'valve_id', 'image'))
+        linked = {(valve_id, image.replace('\\', '/')) for _, valve_id, image in links}
+
+        on_disk = set()
+        self.to_create = []
+        for path in walk_files(self.media_root):
+            on_disk.add(path)
+            if not path.lower().endswith(self.extensions):
+                continue
+            self.summary['images'] += 1
+            match = self.rule(path)
+            if match is None:
+                self.summary['unmatched'] += 1
+                continue
+            tag_number, category = match
+            valve_id = valve_ids.get(tag_number.upper())
+            if valve_id is None:
+                self.unknown_tags.add(tag_number)
+                continue
+            if (valve_id, path) in linked:
+                self.summary['already_linked'] += 1
+                continue
+            self.to_create.append(ValveImage(
+                valve_id=valve_id,
+                image=path,
+                category=category,
+                description=self.description(tag_number) if self.description else None,
+            ))
+
+        # Number of files of any kind found, so callers can refuse to prune an empty directory
+        self.files = len(on_disk)
+        self.stale_ids = []
+        if self.prune:
+            self.stale_ids = [pk for pk, _, image in links if image.replace('\\', '/') not in on_disk]
+        self.summary['created'] = len(self.to_create)
+        self.summary['deleted'] = len(self.stale_ids)
+        return self.summary
+
+    def apply(self):
+        with transaction.atomic():
+            ValveImage.objects.bulk_create(self.to_create, batch_size=self.batch_size)
+            for start in range(0, len(self.stale_ids), self.batch_size):
+                ValveImage.objects.filter(pk__in=self.stale_ids[start:start + self.batch_size]).delete()
+        # bulk_create sends no model signals
+        bump_valve_version(*{image.valve_id for image in self.to_create})
+
+    def run(self):
+        self.plan()
+        if not self.dry_run:
+            self.apply()
+        return self.summary
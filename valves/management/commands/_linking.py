@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.translation import gettext as _
+from valves.caching import require_shared_cache
+from valves.image_linker import IMAGE_EXTENSIONS, ImageLinker
+
+class LinkImagesCommand(BaseCommand):
+    """
+    Base for the image linking commands; subclasses set `rule` (see valves/image_linker.py).
+    """
+    rule = None
+    extensions = IMAGE_EXTENSIONS
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would change without writing to the database.')
+        parser.add_argument('--prune', action='store_true',
+                            help='Also remove links whose file is missing. Asks for confirmation first.')
+        parser.add_argument('--no-input', '--noinput', action='store_true', dest='no_input',
+                            help=_('Do NOT prompt for user input of any kind.'))
+
+    def description(self, tag_number):
+        return None
+
+    def confirm(self, options, summary):
+        """Asks before links are removed; adding links needs no confirmation."""
+        if options['no_input'] or not summary['deleted']:
+            return True
+        return input(f"Remove {summary['deleted']} links to missing files? [y/N] ").lower() == 'y'
+
+    def handle(self, *args, **options):
+        require_shared_cache()
+        linker = ImageLinker(
+            type(self).rule,
+            extensions=self.extensions,
+            prune=options['prune'],
+            description=self.description,
+        )
+        summary = linker.plan()
+        self.stdout.write(
+            f"Scanned {summary['images']} images: {summary['already_linked']} already linked, "
+            f"{summary['unmatched']} without a tag, {summary['created']} to link, "
+            f"{summary['deleted']} links to missing files."
+        )
+        if linker.unknown_tags:
+            self.stdout.write(self.style.WARNING(
+                f"{len(linker.unknown_tags)} tags match no valve, e.g. {', '.join(sorted(linker.unknown_tags)[:5])}"
+            ))
+
+        if summary['deleted'] and not linker.files:
+            raise CommandError(
+                f"{linker.media_root} contains no files; refusing to remove every image link. Is it mounted?"
+            )
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING("Dry run complete. No changes were made to the database."))
+            return
+        if not (summary['created'] or summary['deleted']):
+            self.stdout.write(self.style.SUCCESS("Nothing to change."))
+            return
+        if not self.confirm(options, summary):
+            self.stdout.write(self.style.ERROR("Operation cancelled."))
+            return
+
+        linker.apply()
+        self.stdout.write(self.style.SUCCESS(
+            f"Linked {summary['created']} new images and removed {summary['deleted']} links to missing files. "
+            "Run generate_thumbnails to create their thumbnails."
+        ))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from valves.blobs import deduplicate
+
+class Command(BaseCommand):
+    help = 'Collapse duplicate media files into hard links to shared content-addressed blobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how much space deduplication would save.')
+
+    def handle(self, *args, **options):
+        def progress(summary):
+            self.stdout.write(f"\rChecked {summary['files']} files", ending='')
+            self.stdout.flush()
+
+        summary = deduplicate(dry_run=options['dry_run'], progress=progress)
+        self.stdout.write('')
+        saved = filesizeformat(summary['bytes_saved'])
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(
+                f"Dry run: {summary['files']} files hold {summary['blobs']} distinct contents; "
+                f"deduplication would save {saved}."
+            ))
+            return
+        if summary['failed']:
+            self.stdout.write(self.style.WARNING(f"{summary['failed']} files could not be hard-linked; see the log."))
+        self.stdout.write(self.style.SUCCESS(
+            f"{summary['files']} files share {summary['blobs']} blobs ({saved} saved); "
+            f"{summary['linked']} newly linked, {summary['released']} unreferenced paths released."
+        ))
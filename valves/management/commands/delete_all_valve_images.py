@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from valves.caching import require_shared_cache
 from valves.models import ValveImage
 from django.utils.translation import gettext as _
 
@@ -17,6 +18,7 @@ class Command(BaseCommand):
 
     @transaction.atomic
     def handle(self, *args, **options):
+        require_shared_cache()
         no_input = options['no_input']
         image_count = ValveImage.objects.count()
 
@@ -1,34 +1,74 @@
 import csv
-from django.core.management.base import BaseCommand
+import gzip
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from valves.exports import DEFAULT_CHUNK_SIZE, MAINTENANCE_EXPORT_HEADERS, maintenance_export_rows
 from valves.models import MaintenanceHistory
 
+FORMATS = ('csv', 'csv.gz', 'jsonl')
+
 class Command(BaseCommand):
-    help = 'Export maintenance history to a CSV file'
-
-    def handle(self, *args, **kwargs):
-        output_file = 'extracted_data_updated.csv'
-        records = MaintenanceHistory.objects.all().select_related('valve', 'technician')
-        
-        with open(output_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Factory', 'Tag_Number', 'Date', 'Work_Done', 'Test', 'Technician'])
-            
-            for r in records:
-                factory = r.valve.factory.name if r.valve.factory else ''
-                tag = r.valve.tag_number
-                date = r.maintenance_date.strftime('%d-%m-%Y')
-                
-                # Split notes if they contain "Test:"
-                notes = r.maintenance_notes or ''
-                work_done = notes
-                test = ''
-                if 'Test:' in notes:
-                    parts = notes.split('Test:')
-                    work_done = parts[0].strip()
-                    test = parts[1].strip()
-                
-                tech = r.technician.name if r.technician else ''
-                
-                writer.writerow([factory, tag, date, work_done, test, tech])
-        
-        self.stdout.write(self.style.SUCCESS(f'Successfully exported {records.count()} records to {output_file}'))
+    help = 'Export maintenance history to a CSV, gzip-compressed CSV or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', type=str, default='extracted_data_updated.csv',
+                            help="Output path, or '-' for standard output.")
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Output format (default: inferred from the output file extension).')
+        parser.add_argument('--since', type=str, help='Only records on or after this date (YYYY-MM-DD).')
+        parser.add_argument('--factory', type=str, help='Only records of valves in this factory.')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        output_file = options['output']
+        output_format = options['format'] or self.infer_format(output_file)
+
+        records = MaintenanceHistory.objects.order_by('maintenance_id')
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid --since date: {options['since']}")
+            records = records.filter(maintenance_date__gte=since)
+        if options['factory']:
+            records = records.filter(valve__factory__name__iexact=options['factory'])
+
+        rows = maintenance_export_rows(records, chunk_size=options['chunk_size'])
+        with self.open_output(output_file, output_format) as f:
+            count = self.write_rows(f, output_format, rows)
+
+        if output_file != '-':
+            self.stdout.write(self.style.SUCCESS(f'Successfully exported {count} records to {output_file}'))
+
+    @staticmethod
+    def infer_format(output_file):
+        if output_file.endswith('.gz'):
+            return 'csv.gz'
+        if output_file.endswith(('.jsonl', '.ndjson')):
+            return 'jsonl'
+        return 'csv'
+
+    def open_output(self, output_file, output_format):
+        if output_file == '-':
+            if output_format == 'csv.gz':
+                return gzip.open(sys.stdout.buffer, 'wt', newline='', encoding='utf-8')
+            # Keep sys.stdout open when the with-block exits
+            return open(sys.stdout.fileno(), 'w', newline='', encoding='utf-8', closefd=False)
+        if output_format == 'csv.gz':
+            return gzip.open(output_file, 'wt', newline='', encoding='utf-8')
+        return open(output_file, 'w', newline='', encoding='utf-8')
+
+    @staticmethod
+    def write_rows(f, output_format, rows):
+        count = 0
+        if output_format == 'jsonl':
+            for count, row in enumerate(rows, start=1):
+                f.write(json.dumps(dict(zip(MAINTENANCE_EXPORT_HEADERS, row)), ensure_ascii=False))
+                f.write('\n')
+            return count
+        writer = csv.writer(f)
+        writer.writerow(MAINTENANCE_EXPORT_HEADERS)
+        for count, row in enumerate(rows, start=1):
+            writer.writerow(row)
+        return count
@@ -0,0 +1,38 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from valves.models import MaintenanceHistory, ValveImage
+from valves.thumbnails import make_thumbnails
+
+class Command(BaseCommand):
+    help = 'Create the missing thumbnails of valve images and maintenance before/after images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Number of worker processes (default: one per CPU).')
+        parser.add_argument('--force', action='store_true',
+                            help='Recreate thumbnails even when they are up to date.')
+
+    def handle(self, *args, **options):
+        names = sorted(set(filter(None, chain(
+            ValveImage.objects.values_list('image', flat=True),
+            MaintenanceHistory.objects.values_list('before_image', flat=True),
+            MaintenanceHistory.objects.values_list('after_image', flat=True),
+        ))))
+        self.stdout.write(f"Checking thumbnails of {len(names)} images with {options['workers']} workers")
+
+        # Workers only resize files, so they need no database connection
+        worker = partial(make_thumbnails, str(settings.MEDIA_ROOT), force=options['force'])
+        written = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            for done, count in enumerate(executor.map(worker, names, chunksize=8), start=1):
+                written += count
+                if done % 100 == 0:
+                    self.stdout.write(f"\rProcessed {done}/{len(names)} images", ending='')
+                    self.stdout.flush()
+
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} thumbnails for {len(names)} images.'))
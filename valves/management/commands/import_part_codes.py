@@ -1,10 +1,23 @@
 from django.core.management.base import BaseCommand
+from valves.caching import require_shared_cache
 from valves.scripts import part_code_loader
 
 class Command(BaseCommand):
     help = 'Loads part code data from CSV files.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--file', type=str, help='Part codes CSV (default: valves/part_codes_data.csv).')
+        parser.add_argument('--chunk-size', type=int, default=part_code_loader.DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--report', type=str, help='Where to write tags that match no valve.')
+
     def handle(self, *args, **options):
+        require_shared_cache()
         self.stdout.write('Starting part code data import...')
-        part_code_loader.run()
+        summary = part_code_loader.run_part_code_importer(
+            options['file'], chunk_size=options['chunk_size'], report_path=options['report']
+        )
+        self.stdout.write(
+            f"Part codes: {summary['part_codes']}, new spare parts: {summary['spare_parts_created']}, "
+            f"valve links: {summary['associations']}, unresolved tags: {summary['unresolved_tags']}"
+        )
         self.stdout.write(self.style.SUCCESS('Successfully finished importing part code data.'))
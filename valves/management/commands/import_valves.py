@@ -1,10 +1,12 @@
 from django.core.management.base import BaseCommand
+from valves.caching import require_shared_cache
 from valves.scripts import data_loader
 
 class Command(BaseCommand):
     help = 'Loads valve data from CSV files.'
 
     def handle(self, *args, **options):
+        require_shared_cache()
         self.stdout.write('Starting valve data import...')
         data_loader.run()
         self.stdout.write(self.style.SUCCESS('Successfully finished importing valve data.'))
@@ -1,11 +1,13 @@
 from django.core.management.base import BaseCommand
 from django.core import management
+from valves.caching import require_shared_cache
 from valves.scripts import data_loader, part_code_loader
 
 class Command(BaseCommand):
     help = 'Loads all data from CSV files.'
 
     def handle(self, *args, **options):
+        require_shared_cache()
         self.stdout.write('Starting all data loading...')
 
         self.stdout.write('Step 1: Populating lookup tables...')
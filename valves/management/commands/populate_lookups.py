@@ -1,10 +1,12 @@
 from django.core.management.base import BaseCommand
+from valves.caching import require_shared_cache
 from valves.models import ValveType, ValveStatus, Manufacturer, Technician
 
 class Command(BaseCommand):
     help = 'Populates initial lookup data for ValveType, ValveStatus, Manufacturer, and Technician.'
 
     def handle(self, *args, **options):
+        require_shared_cache()
         self.stdout.write("Populating lookup tables...")
 
         # Populate ValveType
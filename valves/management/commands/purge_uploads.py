@@ -0,0 +1,14 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from valves.uploads import purge_stale_uploads
+
+class Command(BaseCommand):
+    help = 'Delete chunked uploads that were never finished or never attached to a form'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2,
+                            help='Delete uploads started more than this many days ago.')
+
+    def handle(self, *args, **options):
+        count = purge_stale_uploads(timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} stale uploads.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from valves import search
+
+class Command(BaseCommand):
+    help = 'Rebuilds the SQLite FTS5 valve search table (PostgreSQL trigram indexes maintain themselves).'
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'postgresql':
+            self.stdout.write('PostgreSQL trigram indexes are maintained by the database, nothing to rebuild.')
+            return
+        if not search.fts_available():
+            self.stdout.write(self.style.WARNING(f"Search table '{search.FTS_TABLE}' not found. Run migrations first."))
+            return
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} valves for search.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from valves.documents import scan_documents
+
+class Command(BaseCommand):
+    help = 'Refresh the document index from the media directory, listing only directories that changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='List every directory, e.g. to pick up files rewritten in place.')
+
+    def handle(self, *args, **options):
+        summary = scan_documents(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {summary['folders_scanned']} folders ({summary['folders_skipped']} unchanged): "
+            f"{summary['added']} added, {summary['updated']} updated, {summary['removed']} removed."
+        ))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from valves.caching import require_shared_cache
+from valves.scripts import data_loader
+
+class Command(BaseCommand):
+    help = 'Re-sequences valve sort_order from the order of tags in valves_data.csv.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            type=str,
+            help='CSV file whose first column lists tag numbers in display order (default: valves/valves_data.csv).',
+        )
+
+    def handle(self, *args, **options):
+        require_shared_cache()
+        updated, missing = data_loader.update_sort_order(options['file'])
+        if missing:
+            self.stdout.write(self.style.WARNING(f'{len(missing)} tags in the file have no matching valve:'))
+            for tag_number in missing:
+                self.stdout.write(f'  {tag_number}')
+        self.stdout.write(self.style.SUCCESS(f'Updated sort order for {updated} valves.'))
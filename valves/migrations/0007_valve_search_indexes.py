@@ -0,0 +1,57 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, OperationalError
+
+# Expression indexes match the UPPER(col::text) LIKE UPPER(...) SQL that icontains generates
+POSTGRES_INDEXES = [
+    ('valves_valve_tag_number_trgm', 'valves_valve', 'tag_number'),
+    ('valves_valve_name_trgm', 'valves_valve', 'name'),
+    ('valves_valve_location_trgm', 'valves_valve', 'location'),
+    ('valves_valvetype_name_trgm', 'valves_valvetype', 'name'),
+]
+
+FTS_TABLE = 'valves_valve_fts'
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for index_name, table, column in POSTGRES_INDEXES:
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS {index_name} ON {table} '
+                f'USING gin ((UPPER({column}::text)) gin_trgm_ops)'
+            )
+    elif vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                "USING fts5(tag_number, name, valve_type, location, tokenize='trigram')"
+            )
+        except OperationalError:
+            # SQLite built without FTS5 (or older than 3.34); search falls back to icontains
+            return
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, tag_number, name, valve_type, location) "
+            "SELECT v.valve_id, v.tag_number, COALESCE(v.name, ''), COALESCE(t.name, ''), COALESCE(v.location, '') "
+            "FROM valves_valve v LEFT JOIN valves_valvetype t ON t.id = v.valve_type_id"
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for index_name, _, _ in POSTGRES_INDEXES:
+            schema_editor.execute(f'DROP INDEX IF EXISTS {index_name}')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('valves', '0006_valve_butterfly_shaft_mat_valve_leakage_class_and_more'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
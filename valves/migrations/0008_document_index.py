@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('valves', '0007_valve_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentFolder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500, unique=True)),
+                ('mtime_ns', models.BigIntegerField(default=0)),
+                ('scanned_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Document',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('factory', models.CharField(max_length=100)),
+                ('doc_type', models.CharField(max_length=100)),
+                ('relative_path', models.CharField(max_length=500, unique=True)),
+                ('name', models.CharField(max_length=500)),
+                ('size', models.BigIntegerField(default=0)),
+                ('mtime_ns', models.BigIntegerField(default=0)),
+                ('sha256', models.CharField(blank=True, max_length=64)),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+                ('folder', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='documents', to='valves.documentfolder')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['factory', 'doc_type', 'name'], name='valves_document_listing'), models.Index(fields=['sha256'], name='valves_document_sha256')],
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:44
+
+import logging
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+# The choices of the maintenance form when activities became a table, in display order
+ACTIVITY_NAMES = [
+    'On site', 'In the workshop', 'Gland tightening', 'Adding packing', 'Replacing packing',
+    'Replacing actuator', 'Replacing bushing', 'Replacing diaphragm', 'Replacing plug', 'Machining plug',
+    'Replacing seat', 'Machining seat', 'Replacing cage', 'Machining cage', 'Welding plug', 'Welding seat',
+    'Welding body', 'Machining body',
+]
+
+BATCH_SIZE = 2000
+NAME_MAX_LENGTH = 100
+
+
+def split_activities(value):
+    names = []
+    for name in (value or '').split(','):
+        name = name.strip()
+        # The legacy field holds 500 characters; longer free-text entries are cut to fit the table
+        if len(name) > NAME_MAX_LENGTH:
+            logger.warning("Truncating activity to %d characters: %r", NAME_MAX_LENGTH, name)
+            name = name[:NAME_MAX_LENGTH].strip()
+        if name:
+            names.append(name)
+    return names
+
+
+def link_existing_activities(apps, schema_editor):
+    MaintenanceActivity = apps.get_model('valves', 'MaintenanceActivity')
+    MaintenanceHistory = apps.get_model('valves', 'MaintenanceHistory')
+    Link = MaintenanceHistory.activities.through
+
+    records = [
+        (record_id, split_activities(value))
+        for record_id, value in MaintenanceHistory.objects.exclude(maintenance_activities__isnull=True)
+        .exclude(maintenance_activities='').values_list('pk', 'maintenance_activities')
+    ]
+    names = list(ACTIVITY_NAMES)
+    for _, record_names in records:
+        names.extend(name for name in record_names if name not in names)
+    MaintenanceActivity.objects.bulk_create([MaintenanceActivity(name=name) for name in names], ignore_conflicts=True)
+    activity_ids = dict(MaintenanceActivity.objects.values_list('name', 'pk'))
+
+    links = []
+    for record_id, record_names in records:
+        for name in dict.fromkeys(record_names):
+            links.append(Link(maintenancehistory_id=record_id, maintenanceactivity_id=activity_ids[name]))
+    Link.objects.bulk_create(links, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('valves', '0010_media_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaintenanceActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=NAME_MAX_LENGTH, unique=True)),
+            ],
+            options={
+                'ordering': ['pk'],
+            },
+        ),
+        migrations.AddField(
+            model_name='maintenancehistory',
+            name='activities',
+            field=models.ManyToManyField(blank=True, related_name='maintenance_records', to='valves.maintenanceactivity'),
+        ),
+        # The comma-joined strings stay as they are, as the display copy of the links
+        migrations.RunPython(link_existing_activities, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,6 @@
 import os
+import uuid
+from django.conf import settings
 from django.db import models
 
 def get_valve_image_upload_path(instance, filename):
@@ -125,13 +127,25 @@ class PartCode(models.Model):
     def __str__(self):
         return self.sap_code or self.oracle_code or self.part_number
 
+class MaintenanceActivity(models.Model):
+    """One kind of maintenance work, e.g. 'Replacing packing'; see valves/activities.py."""
+    name = models.CharField(max_length=100, unique=True)
+
+    class Meta:
+        ordering = ['pk']
+
+    def __str__(self):
+        return self.name
+
 class MaintenanceHistory(models.Model):
     maintenance_id = models.AutoField(primary_key=True)
     valve = models.ForeignKey(Valve, on_delete=models.CASCADE, related_name='maintenance_records')
     technician = models.ForeignKey(Technician, on_delete=models.SET_NULL, null=True, blank=True)
     maintenance_date = models.DateField()
     oracle_code = models.CharField(max_length=255, null=True, blank=True)
+    # Comma-joined names of `activities`, kept for display; filter and count through `activities`
     maintenance_activities = models.CharField(max_length=500, blank=True, null=True)
+    activities = models.ManyToManyField(MaintenanceActivity, blank=True, related_name='maintenance_records')
     maintenance_notes = models.TextField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
     before_image = models.ImageField(upload_to=get_maintenance_image_upload_path, verbose_name="Before Image", null=True, blank=True)
@@ -159,3 +173,79 @@ class ValveImage(models.Model):
 
     def __str__(self):
         return f"Image for {self.valve.tag_number} - {self.get_category_display()}"
+
+class DocumentFolder(models.Model):
+    # A scanned directory under MEDIA_ROOT; its mtime tells the scanner whether to list it again
+    path = models.CharField(max_length=500, unique=True)
+    mtime_ns = models.BigIntegerField(default=0)
+    scanned_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.path or '.'
+
+class Document(models.Model):
+    folder = models.ForeignKey(DocumentFolder, on_delete=models.CASCADE, related_name='documents')
+    factory = models.CharField(max_length=100)
+    doc_type = models.CharField(max_length=100)
+    # Path relative to MEDIA_ROOT, with '/' separators
+    relative_path = models.CharField(max_length=500, unique=True)
+    # Path relative to the document type folder, shown in the list
+    name = models.CharField(max_length=500)
+    size = models.BigIntegerField(default=0)
+    mtime_ns = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    indexed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['factory', 'doc_type', 'name'], name='valves_document_listing'),
+            models.Index(fields=['sha256'], name='valves_document_sha256'),
+        ]
+
+    def __str__(self):
+        return self.relative_path
+
+    @property
+    def url(self):
+        return settings.MEDIA_URL + self.relative_path
+
+class ChunkedUpload(models.Model):
+    # A resumable upload in progress; chunks are appended to temp_path until offset reaches size
+    upload_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    # Optional checksum of the whole file, checked once the last chunk arrives
+    sha256 = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+    @property
+    def temp_path(self):
+        # Kept under MEDIA_ROOT so the finished file can be moved into place without copying
+        return os.path.join(settings.MEDIA_ROOT, '.uploads', f'{self.upload_id}.part')
+
+class MediaBlob(models.Model):
+    # Content-addressed copy of a media file, stored as MEDIA_ROOT/.blobs/<sha256[:2]>/<sha256>
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    # Number of MediaFile paths hard-linked to this blob
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
+class MediaFile(models.Model):
+    # A media path referenced by a ValveImage, a maintenance record or the document index
+    path = models.CharField(max_length=500, unique=True)
+    blob = models.ForeignKey(MediaBlob, on_delete=models.PROTECT, related_name='files')
+    # mtime of the shared inode when the path was linked; a different mtime means the path was replaced
+    mtime_ns = models.BigIntegerField()
+
+    def __str__(self):
+        return self.path
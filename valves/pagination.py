@@ -0,0 +1,195 @@
+import base64
+import binascii
+import json
+from collections.abc import Sequence
+from functools import cached_property
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F, Q
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(values, direction):
+    """Encodes the sort key of a boundary row into an opaque, URL-safe cursor."""
+    payload = json.dumps({'d': direction, 'k': values}, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns (values, direction) for a cursor, or (None, None) if it is missing or malformed."""
+    if not cursor:
+        return None, None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        direction = payload['d']
+        values = payload['k']
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        return None, None
+    if direction not in (NEXT, PREVIOUS):
+        return None, None
+    return values, direction
+
+
+def estimate_count(queryset):
+    """
+    Returns the number of rows a queryset would return.
+    On PostgreSQL the planner's row estimate is used so no table scan is needed,
+    other databases fall back to an exact COUNT(*).
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPage(Sequence):
+    """A single page of results, usable in templates like a Django Page object."""
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __repr__(self):
+        return f"<KeysetPage of {len(self)} objects>"
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    @property
+    def next_cursor(self):
+        if not self.has_next:
+            return None
+        return encode_cursor(self.paginator.key_for(self.object_list[-1]), NEXT)
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous:
+            return None
+        return encode_cursor(self.paginator.key_for(self.object_list[0]), PREVIOUS)
+
+    @property
+    def last_cursor(self):
+        return encode_cursor(None, PREVIOUS)
+
+    @cached_property
+    def approximate_count(self):
+        if not self.paginator.with_count:
+            return None
+        return estimate_count(self.paginator.queryset)
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset by seeking past the sort key of the previous page instead of using OFFSET.
+
+    `ordering` is a sequence of field names (prefixed with '-' for descending) that must
+    uniquely identify a row, e.g. ('-maintenance_date', '-maintenance_id'). Every page costs
+    the same indexed range scan no matter how deep the user has paged.
+    NULL values sort after every other value, as PostgreSQL does by default.
+    """
+
+    def __init__(self, queryset, ordering, per_page=15, with_count=False):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.with_count = with_count
+        self.fields = []
+        for name in ordering:
+            descending = name.startswith('-')
+            field_name = name.lstrip('-')
+            self.fields.append((field_name, descending, self._is_nullable(field_name)))
+
+    def _is_nullable(self, field_name):
+        try:
+            return self.queryset.model._meta.get_field(field_name).null
+        except FieldDoesNotExist:
+            # Annotations such as search ranks are never NULL
+            return False
+
+    def key_for(self, obj):
+        return [getattr(obj, field_name) for field_name, _, _ in self.fields]
+
+    def _order_by(self, reverse):
+        expressions = []
+        for field_name, descending, nullable in self.fields:
+            if descending != reverse:
+                expressions.append(F(field_name).desc(nulls_first=True) if nullable else F(field_name).desc())
+            else:
+                expressions.append(F(field_name).asc(nulls_last=True) if nullable else F(field_name).asc())
+        return expressions
+
+    @staticmethod
+    def _beyond(field_name, value, ascending):
+        """Rows that come strictly after `value` for one field, treating NULL as the largest value."""
+        if ascending:
+            if value is None:
+                return None
+            return Q(**{f'{field_name}__gt': value}) | Q(**{f'{field_name}__isnull': True})
+        if value is None:
+            return Q(**{f'{field_name}__isnull': False})
+        return Q(**{f'{field_name}__lt': value})
+
+    @staticmethod
+    def _equal(field_name, value):
+        if value is None:
+            return Q(**{f'{field_name}__isnull': True})
+        return Q(**{field_name: value})
+
+    def _seek(self, values, reverse):
+        """Builds `(a > x) OR (a = x AND b > y) ...` for the sort key, in the requested direction."""
+        condition = None
+        prefix = Q()
+        for (field_name, descending, _), value in zip(self.fields, values):
+            beyond = self._beyond(field_name, value, ascending=(descending == reverse))
+            if beyond is not None:
+                condition = prefix & beyond if condition is None else condition | (prefix & beyond)
+            prefix &= self._equal(field_name, value)
+        if condition is None:
+            return Q(pk__in=[])
+
+        # A plain range on the leading column lets the database seek straight into its index
+        field_name, descending, nullable = self.fields[0]
+        if not nullable and values[0] is not None:
+            lookup = 'gte' if descending == reverse else 'lte'
+            condition = Q(**{f'{field_name}__{lookup}': values[0]}) & condition
+        return condition
+
+    def get_page(self, cursor=None):
+        values, direction = decode_cursor(cursor)
+        if values is not None and (not isinstance(values, list) or len(values) != len(self.fields)):
+            values, direction = None, None
+
+        reverse = direction == PREVIOUS
+        queryset = self.queryset.order_by(*self._order_by(reverse))
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, reverse))
+
+        rows = list(queryset[:self.per_page + 1])
+        if not rows and values is not None:
+            # The cursor points past the data (rows were deleted meanwhile), start over
+            return self.get_page(None)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if reverse:
+            rows.reverse()
+            # A backwards page always has rows after it, unless it was requested as the last page
+            return KeysetPage(rows, self, has_next=values is not None, has_previous=has_more)
+        return KeysetPage(rows, self, has_next=has_more, has_previous=values is not None)
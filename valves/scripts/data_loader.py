@@ -1,146 +1,256 @@
 import csv
 import glob
 import os
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
 from valves.models import Valve, ValveType, ValveStatus, Manufacturer, Factory
+from valves.signals import after_bulk_valve_write
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-def run_valve_importer():
+FACTORY_NAME_MAP = {
+    'AFC1': 'AFC I',
+    'AFC2': 'AFC II',
+    'AFC3': 'AFC III',
+}
+
+# CSV column -> Valve field, for the spec columns copied as-is
+SPEC_COLUMNS = {
+    'Shut-off Pressures P1 / P2': 'shut_off_pressure',
+    'Power Failure Pos.': 'power_failure_pos',
+    'Body Style': 'body_style',
+    'Required Travel / Angle': 'required_travel_angle',
+    'Bench Range': 'bench_range',
+    'Plug/Stem MAT': 'plug_stem_mat',
+    'Butterfly/Shaft MAT': 'butterfly_shaft_mat',
+    'Seat/Guide MAT': 'seat_guide_mat',
+    'Seat Diameter': 'seat_diameter',
+    'Trim Coating': 'trim_coating',
+    'Leakage Class': 'leakage_class',
+    'Packing MAT': 'packing_mat',
+}
+
+VALVE_UPDATE_FIELDS = [
+    'factory', 'name', 'location', 'valve_type', 'status', 'manufacturer', 'model_number',
+    *SPEC_COLUMNS.values(),
+]
+
+DEFAULT_CHUNK_SIZE = 500
+
+# Valve foreign keys filled from the lookup tables after the rows are read
+LOOKUP_FIELDS = ['factory', 'valve_type', 'status', 'manufacturer']
+
+
+def factory_name_for(csv_file_path):
+    factory_name_from_file = os.path.basename(csv_file_path).split('.')[0].split('_')[0]
+    return FACTORY_NAME_MAP.get(factory_name_from_file, factory_name_from_file)
+
+
+def read_valve_rows(csv_file_path):
+    """
+    Yields one cleaned dict per CSV row; keys and values are stripped, missing cells are ''.
+    """
+    with open(csv_file_path, mode='r', encoding='utf-8') as file:
+        # Use DictReader for easier column access by name
+        reader = csv.DictReader(file)
+        # Clean fieldnames once to handle potential BOM or extra spaces in headers
+        reader.fieldnames = [field.strip().replace('\ufeff', '') for field in reader.fieldnames]
+        for row in reader:
+            yield {k.strip(): (v or '').strip() for k, v in row.items() if k is not None}
+
+
+def split_manufacturer_model(manufacturer_model):
+    """
+    Splits "Manufacturer / Model" into (manufacturer, model_number); either may be None.
+    """
+    if not manufacturer_model:
+        return None, None
+    parts = manufacturer_model.split('/')
+    if len(parts) > 1:
+        return parts[0].strip() or None, parts[1].strip()
+    return parts[0].strip() or None, None
+
+
+def resolve_lookups(model, names):
+    """
+    Returns {name: instance} for every name, creating the missing ones in a single batch.
+    """
+    names = set(filter(None, names))
+    existing = model.objects.in_bulk(names, field_name='name')
+    missing = names - existing.keys()
+    if missing:
+        model.objects.bulk_create([model(name=name) for name in missing], ignore_conflicts=True)
+        existing = model.objects.in_bulk(names, field_name='name')
+    return existing
+
+
+def _reason(error):
+    return '; '.join(f"{field}: {' '.join(messages)}" for field, messages in error.message_dict.items())
+
+
+def build_valve(tag_number, row):
+    """
+    Returns (valve, manufacturer name) for one CSV row, with the valve's lookups still unset.
+    Raises ValidationError with the reason if a value does not fit its column.
+    """
+    manufacturer, model_number = split_manufacturer_model(row.get('Manufacturer / Model'))
+    valve = Valve(
+        tag_number=tag_number,
+        name=f"Valve {tag_number}",
+        location="Not specified",
+        model_number=model_number,
+    )
+    for column, field in SPEC_COLUMNS.items():
+        setattr(valve, field, row.get(column) or None)
+    # The lookups are resolved in bulk later; validating them here would cost a query per row
+    valve.clean_fields(exclude=LOOKUP_FIELDS)
+    if manufacturer:
+        try:
+            Manufacturer(name=manufacturer).clean_fields()
+        except ValidationError as e:
+            raise ValidationError({'manufacturer': e.message_dict['name']})
+    return valve, manufacturer
+
+
+def run_valve_importer(db_dir=None, chunk_size=DEFAULT_CHUNK_SIZE):
     """
     Loads valve data from CSV files in the valves/valves_db/ directory into the database.
     The script extracts the factory name from the CSV filename.
-    It uses update_or_create to update existing valves or create new ones.
+
+    All files are read and every row is validated first; lookups are then resolved once and
+    valves are upserted on tag_number with bulk_create(update_conflicts=True), one transaction
+    per chunk. A tag listed more than once keeps the values of its last valid row. Rows without
+    a tag or with values that do not fit, and chunks the database rejects, are skipped and the
+    import carries on.
+    Returns a summary dict with the created, updated and skipped counts, and `errors`, a list of
+    (row or tag, reason) for the skipped rows.
     """
-    
-    db_dir = os.path.join(BASE_DIR, '..', 'valves_db')
-    csv_files = glob.glob(os.path.join(db_dir, '*.csv'))
-    
+    db_dir = db_dir or os.path.join(BASE_DIR, '..', 'valves_db')
+    csv_files = sorted(glob.glob(os.path.join(db_dir, '*.csv')))
+
+    summary = {'created': 0, 'updated': 0, 'skipped': 0, 'errors': []}
     if not csv_files:
         print(f"No CSV files found in {db_dir}")
-        return
+        return summary
 
     print(f"Found {len(csv_files)} CSV files to process.")
 
-    total_updated_count = 0
-    total_created_count = 0
+    def skip(where, reason, count=1):
+        summary['skipped'] += count
+        summary['errors'].append((where, reason))
 
+    valves_by_tag = {}
     for csv_file_path in csv_files:
-        factory_name_from_file = os.path.basename(csv_file_path).split('.')[0].split('_')[0]
-        factory_name_map = {
-            'AFC1': 'AFC I',
-            'AFC2': 'AFC II',
-            'AFC3': 'AFC III',
-        }
-        factory_name = factory_name_map.get(factory_name_from_file, factory_name_from_file)
-        print(f"Processing file: {csv_file_path} for factory: {factory_name}")
-
-        updated_count = 0
-        created_count = 0
-
+        factory_name = factory_name_for(csv_file_path)
+        print(f"Reading file: {csv_file_path} for factory: {factory_name}")
         try:
-            with open(csv_file_path, mode='r', encoding='utf-8') as file:
-                # Use DictReader for easier column access by name
-                reader = csv.DictReader(file)
-                # Clean fieldnames once to handle potential BOM or extra spaces in headers
-                # This ensures that subsequent row.get() calls use clean keys
-                reader.fieldnames = [field.strip().replace('\ufeff', '') for field in reader.fieldnames]
-                
-                for row in reader:
-                    try:
-                        if not row: # Skip empty rows
-                            continue
-                        # Create a new dictionary with cleaned keys and values for robust access
-                        cleaned_row = {k.strip(): v.strip() for k, v in row.items() if k is not None}
-                        
-
-
-                        tag_number = cleaned_row.get('tag_number')
-                        if not tag_number:
-                            continue
-                        
-
-                        
-
-                        
-                        manufacturer = None
-                        model_number = None
-                        manufacturer_model = cleaned_row.get('Manufacturer / Model')
-                        if manufacturer_model:
-                            parts = manufacturer_model.split('/')
-                            if len(parts) > 1:
-                                manufacturer = parts[0].strip()
-                                model_number = parts[1].strip()
-                            else:
-                                manufacturer = parts[0].strip()
-
-                        valve_data = {
-                            'factory': Factory.objects.get_or_create(name=factory_name)[0],
-                            'name': f"Valve {tag_number}",
-                            'location': "Not specified",
-                            'valve_type': ValveType.objects.get_or_create(name="General")[0],
-                            'status': ValveStatus.objects.get_or_create(name="Operational")[0],
-                            'manufacturer': Manufacturer.objects.get_or_create(name=manufacturer)[0] if manufacturer else None,
-                            'model_number': model_number,
-                            'shut_off_pressure': cleaned_row.get('Shut-off Pressures P1 / P2') or None,
-                            'power_failure_pos': cleaned_row.get('Power Failure Pos.') or None,
-                            'body_style': cleaned_row.get('Body Style') or None,
-                            'required_travel_angle': cleaned_row.get('Required Travel / Angle') or None,
-                            'bench_range': cleaned_row.get('Bench Range') or None,
-                            'plug_stem_mat': cleaned_row.get('Plug/Stem MAT') or None,
-                            'butterfly_shaft_mat': cleaned_row.get('Butterfly/Shaft MAT') or None,
-                            'seat_guide_mat': cleaned_row.get('Seat/Guide MAT') or None,
-                            'seat_diameter': cleaned_row.get('Seat Diameter') or None,
-                            'trim_coating': cleaned_row.get('Trim Coating') or None,
-                            'leakage_class': cleaned_row.get('Leakage Class') or None,
-                            'packing_mat': cleaned_row.get('Packing MAT') or None,
-                        }
-                        
-                        obj, created = Valve.objects.update_or_create(
-                            tag_number=tag_number,
-                            defaults=valve_data
-                        )
-
-                        if created:
-                            created_count += 1
-                        else:
-                            updated_count += 1
-
-                    except Exception as e:
-                        print(f"Error processing row: {row}. Error: {e}")
-                        continue
-            print(f"Finished processing {csv_file_path}.")
-            print(f"Created: {created_count}, Updated: {updated_count}")
-            total_created_count += created_count
-            total_updated_count += updated_count
-
+            # Line 1 is the header
+            for line, row in enumerate(read_valve_rows(csv_file_path), start=2):
+                where = f"{os.path.basename(csv_file_path)}:{line}"
+                tag_number = row.get('tag_number')
+                if not tag_number:
+                    skip(where, "no tag number")
+                    continue
+                try:
+                    valve, manufacturer = build_valve(tag_number, row)
+                except ValidationError as e:
+                    skip(f"{where} ({tag_number})", _reason(e))
+                    continue
+                valves_by_tag[tag_number] = (factory_name, manufacturer, valve)
         except FileNotFoundError:
             print(f"Error: File not found at path: {csv_file_path}")
-        except Exception as e:
-            print(f"A general error occurred during the process: {e}")
+
+    factories = resolve_lookups(Factory, (factory_name for factory_name, _, _ in valves_by_tag.values()))
+    manufacturers = resolve_lookups(Manufacturer, (manufacturer for _, manufacturer, _ in valves_by_tag.values()))
+    valve_type = resolve_lookups(ValveType, ["General"])["General"]
+    status = resolve_lookups(ValveStatus, ["Operational"])["Operational"]
+
+    valves = []
+    for factory_name, manufacturer, valve in valves_by_tag.values():
+        valve.factory = factories[factory_name]
+        valve.manufacturer = manufacturers.get(manufacturer)
+        valve.valve_type = valve_type
+        valve.status = status
+        valves.append(valve)
+
+    valve_ids = []
+    for start in range(0, len(valves), chunk_size):
+        chunk = valves[start:start + chunk_size]
+        try:
+            with transaction.atomic():
+                existing = set(
+                    Valve.objects.filter(tag_number__in=[v.tag_number for v in chunk]).values_list('tag_number', flat=True)
+                )
+                Valve.objects.bulk_create(
+                    chunk,
+                    update_conflicts=True,
+                    unique_fields=['tag_number'],
+                    update_fields=VALVE_UPDATE_FIELDS,
+                )
+        except DatabaseError as e:
+            skip(f"{chunk[0].tag_number} .. {chunk[-1].tag_number}", f"chunk rejected by the database: {e}", len(chunk))
+            print(f"Skipped {len(chunk)} valves: {e}")
+            continue
+        summary['updated'] += len(existing)
+        summary['created'] += len(chunk) - len(existing)
+        valve_ids.extend(v.pk for v in chunk)
+        print(f"Saved {start + len(chunk)}/{len(valves)} valves")
+
+    # bulk_create sends no model signals
+    after_bulk_valve_write(valve_ids, lookups_changed=True)
 
     print("-" * 50)
-    print(f"Total new valves created: {total_created_count}")
-    print(f"Total existing valves updated: {total_updated_count}")
+    print(f"Total new valves created: {summary['created']}")
+    print(f"Total existing valves updated: {summary['updated']}")
+    print(f"Rows skipped: {summary['skipped']}")
+    for where, reason in summary['errors']:
+        print(f"  {where}: {reason}")
+    return summary
+
+def read_sort_order(valves_data_csv):
+    """
+    Returns {tag_number: position} for the tags listed in valves_data.csv (header excluded).
+    A tag listed twice keeps its last position.
+    """
+    order = {}
+    with open(valves_data_csv, mode='r', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader)  # Skip header row
+        for i, row in enumerate(reader):
+            if row and row[0].strip():
+                order[row[0].strip()] = i
+    return order
+
 
-def update_sort_order():
+def update_sort_order(valves_data_csv=None, batch_size=1000):
     """
     Updates the sort_order field for each valve based on its order in the valves_data.csv file.
+    Tags are resolved in one query and the changed valves are written with bulk_update, which
+    issues one CASE statement per batch.
+    Returns (number of valves updated, sorted list of tags with no matching valve).
     """
-    valves_data_csv = os.path.join(BASE_DIR, '..', 'valves_data.csv')
+    valves_data_csv = valves_data_csv or os.path.join(BASE_DIR, '..', 'valves_data.csv')
     try:
-        with open(valves_data_csv, mode='r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader)  # Skip header row
-            for i, row in enumerate(reader):
-                if row:
-                    tag_number = row[0].strip()
-                    if tag_number:
-                        Valve.objects.filter(tag_number=tag_number).update(sort_order=i)
-        print("Successfully updated sort order for valves.")
+        order = read_sort_order(valves_data_csv)
     except FileNotFoundError:
         print(f"Error: {valves_data_csv} not found.")
-    except Exception as e:
-        print(f"An error occurred while updating sort order: {e}")
+        return 0, []
+
+    valves = Valve.objects.filter(tag_number__in=order).only('valve_id', 'tag_number', 'sort_order')
+    changed = []
+    found = set()
+    for valve in valves:
+        found.add(valve.tag_number)
+        if valve.sort_order != order[valve.tag_number]:
+            valve.sort_order = order[valve.tag_number]
+            changed.append(valve)
+
+    with transaction.atomic():
+        Valve.objects.bulk_update(changed, ['sort_order'], batch_size=batch_size)
+
+    missing = sorted(order.keys() - found)
+    print(f"Successfully updated sort order for {len(changed)} valves.")
+    return len(changed), missing
 
 def run():
     run_valve_importer()
@@ -0,0 +1,182 @@
+import csv
+import re
+from datetime import datetime
+from django.db import transaction
+from valves.caching import bump_valve_version
+from valves.models import Valve, Technician, MaintenanceHistory
+
+DEFAULT_CHUNK_SIZE = 2000
+
+# Tried in this order; the first format that parses wins
+DATE_FORMATS = ['%d-%m-%Y', '%d/%m/%Y %H:%M', '%m/%d/%Y', '%d/%m/%Y', '%m/%d/%Y %H:%M']
+
+_FORMAT_DIRECTIVES = {'%d': r'\d{1,2}', '%m': r'\d{1,2}', '%Y': r'\d{4}', '%H': r'\d{1,2}', '%M': r'\d{1,2}'}
+
+
+def _format_regex(fmt):
+    return re.compile(re.sub('|'.join(_FORMAT_DIRECTIVES), lambda m: _FORMAT_DIRECTIVES[m.group()], fmt))
+
+
+class DateParser:
+    """
+    Parses the free-form dates of the maintenance sheets with DATE_FORMATS.
+
+    Each input is reduced to its pattern (digits replaced by '9', e.g. '99-99-9999'); the formats
+    that can produce that pattern are worked out once per pattern, so most dates cost a single
+    strptime. Formats are still tried in DATE_FORMATS order, so ambiguous day/month inputs resolve
+    exactly as before. Parsed strings are memoized as well, since dates repeat heavily.
+    """
+
+    def __init__(self, formats=DATE_FORMATS):
+        self.formats = [(fmt, _format_regex(fmt)) for fmt in formats]
+        self.candidates_by_pattern = {}
+        self.parsed = {}
+
+    def candidates(self, date_str):
+        pattern = re.sub(r'\d', '9', date_str)
+        candidates = self.candidates_by_pattern.get(pattern)
+        if candidates is None:
+            candidates = [fmt for fmt, regex in self.formats if regex.fullmatch(date_str)]
+            self.candidates_by_pattern[pattern] = candidates
+        return candidates
+
+    def parse(self, date_str):
+        """Returns a date, or None if no format matches."""
+        if date_str in self.parsed:
+            return self.parsed[date_str]
+        parsed = None
+        for fmt in self.candidates(date_str):
+            try:
+                parsed = datetime.strptime(date_str, fmt).date()
+                break
+            except ValueError:
+                pass
+        self.parsed[date_str] = parsed
+        return parsed
+
+
+def read_chunks(csv_file_path, chunk_size):
+    """
+    Streams the CSV as lists of at most chunk_size rows.
+    """
+    with open(csv_file_path, mode='r', encoding='utf-8') as file:
+        chunk = []
+        for row in csv.DictReader(file):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def maintenance_notes_for(row):
+    work_done = (row.get('Work_Done') or '').strip()
+    test_info = (row.get('Test') or '').strip()
+    if test_info:
+        return f"{work_done}\nTest: {test_info}"
+    return work_done
+
+
+class MaintenanceImporter:
+    """
+    Upserts maintenance history rows on (valve, maintenance_date) in chunks.
+
+    Valves and technicians are resolved from maps loaded once; each chunk reads the matching
+    existing records in one query and writes them back with one bulk_create and one bulk_update.
+    """
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.dates = DateParser()
+        self.valve_ids = dict(Valve.objects.values_list('tag_number', 'valve_id'))
+        self.technician_ids = {}
+        for technician_id, name in Technician.objects.order_by('-pk').values_list('pk', 'name'):
+            # Names are not unique; keep the oldest technician, as get_or_create would find
+            self.technician_ids[name] = technician_id
+        self.summary = {'rows': 0, 'created': 0, 'updated': 0, 'skipped': 0, 'technicians_created': 0}
+        self.unknown_tags = set()
+        self.bad_dates = set()
+        self.touched_valve_ids = set()
+
+    def resolve_technicians(self, names):
+        missing = [name for name in dict.fromkeys(names) if name and name not in self.technician_ids]
+        if missing:
+            created = Technician.objects.bulk_create([Technician(name=name) for name in missing])
+            self.technician_ids.update((technician.name, technician.pk) for technician in created)
+            self.summary['technicians_created'] += len(created)
+
+    def parse_chunk(self, rows):
+        """
+        Returns {(valve_id, maintenance_date): (notes, technician name)}; later rows win.
+        """
+        records = {}
+        for row in rows:
+            tag_number = (row.get('Tag_Number') or '').strip()
+            valve_id = self.valve_ids.get(tag_number)
+            if valve_id is None:
+                if tag_number:
+                    self.unknown_tags.add(tag_number)
+                self.summary['skipped'] += 1
+                continue
+            date_str = (row.get('Date') or '').strip()
+            maintenance_date = self.dates.parse(date_str) if date_str else None
+            if maintenance_date is None:
+                if date_str:
+                    self.bad_dates.add(date_str)
+                self.summary['skipped'] += 1
+                continue
+            technician_name = (row.get('Technician') or '').strip()
+            records[(valve_id, maintenance_date)] = (maintenance_notes_for(row), technician_name)
+        return records
+
+    def import_chunk(self, rows):
+        self.summary['rows'] += len(rows)
+        records = self.parse_chunk(rows)
+        if not records:
+            return
+        with transaction.atomic():
+            self.resolve_technicians(name for _, name in records.values())
+
+            existing = {}
+            for record in MaintenanceHistory.objects.filter(
+                valve_id__in={valve_id for valve_id, _ in records},
+                maintenance_date__in={maintenance_date for _, maintenance_date in records},
+            ).order_by('-pk'):
+                # Keep the oldest record for a (valve, date) pair, as update_or_create would
+                existing[(record.valve_id, record.maintenance_date)] = record
+
+            to_create, to_update = [], []
+            for (valve_id, maintenance_date), (notes, technician_name) in records.items():
+                technician_id = self.technician_ids.get(technician_name)
+                record = existing.get((valve_id, maintenance_date))
+                if record is None:
+                    to_create.append(MaintenanceHistory(
+                        valve_id=valve_id,
+                        maintenance_date=maintenance_date,
+                        maintenance_notes=notes,
+                        technician_id=technician_id,
+                    ))
+                else:
+                    record.maintenance_notes = notes
+                    record.technician_id = technician_id
+                    to_update.append(record)
+
+            MaintenanceHistory.objects.bulk_create(to_create)
+            MaintenanceHistory.objects.bulk_update(to_update, ['maintenance_notes', 'technician'])
+
+        self.summary['created'] += len(to_create)
+        self.summary['updated'] += len(to_update)
+        self.touched_valve_ids.update(valve_id for valve_id, _ in records)
+
+    def run(self, csv_file_path, progress=None):
+        """
+        Imports the whole file and returns the summary dict. `progress(summary)` is called after each chunk.
+        """
+        for rows in read_chunks(csv_file_path, self.chunk_size):
+            self.import_chunk(rows)
+            if progress:
+                progress(self.summary)
+        # bulk writes send no model signals
+        bump_valve_version(*self.touched_valve_ids)
+        return self.summary
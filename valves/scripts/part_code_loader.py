@@ -1,74 +1,163 @@
 import csv
 import os
+from django.db import transaction
 from valves.models import PartCode, SparePart, Valve
+from valves.caching import bump_part_codes_version, bump_valve_version
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-def run_part_code_importer():
+DEFAULT_CHUNK_SIZE = 500
+
+PART_CODE_UPDATE_FIELDS = [
+    'oracle_code', 'part', 'description', 'location', 'category',
+    'condition', 'part_number', 'manufacturer_co', 'unit_of_measure',
+]
+
+
+def format_tag_number(tag):
+    # Remove spaces and convert to uppercase
+    tag = tag.strip().replace(' ', '').upper()
+    # Add hyphen after the first two letters if followed by numbers
+    if len(tag) > 2 and tag[0:2].isalpha() and tag[2:].isdigit():
+        tag = f"{tag[0:2]}-{tag[2:]}"
+    return tag
+
+
+def split_tag_numbers(raw):
+    """
+    Normalizes a tag_number cell such as "fv 33001, FV33002" into ['FV-33001', 'FV-33002'].
+    """
+    # Normalize tag_number: replace commas with slashes, then format each tag
+    tags = (format_tag_number(tag) for tag in raw.replace(',', '/').split('/'))
+    return [tag for tag in tags if tag]
+
+
+def load_valve_ids_by_tag():
+    """
+    Returns {TAG_NUMBER: valve_id} for every valve; keys are upper-cased for case-insensitive matching.
+    """
+    return {tag.upper(): valve_id for valve_id, tag in Valve.objects.values_list('valve_id', 'tag_number')}
+
+
+def read_part_code_rows(part_codes_csv):
+    """
+    Returns {sap_code: (row, tag_numbers)} from the CSV. A SAP code listed more than once keeps the
+    fields of its last row and the tags of all its rows.
+    """
+    rows = {}
+    with open(part_codes_csv, mode='r', encoding='utf-8-sig') as file:
+        for row in csv.DictReader(file):
+            sap_code = (row['sap_code'] or '').strip()
+            if not sap_code:
+                continue
+            tags = rows.get(sap_code, (None, []))[1]
+            tags.extend(split_tag_numbers(row['tag_number'] or ''))
+            rows[sap_code] = (row, tags)
+    return rows
+
+
+def build_part_code(sap_code, row):
+    def cell(column):
+        return (row[column] or '').strip()
+
+    return PartCode(
+        sap_code=sap_code,
+        oracle_code=cell('oracle_code'),
+        part_id=row['part_number'] or None,
+        description=cell('description'),
+        location=cell('warehouse_number'),
+        category=cell('category'),
+        condition=cell('condition'),
+        part_number=cell('part_number'),
+        manufacturer_co=cell('MANUFATURE_CO'),
+        unit_of_measure=cell('unit_of_measure'),
+    )
+
+
+def write_unresolved_report(report_path, unresolved):
+    with open(report_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['sap_code', 'tag_number'])
+        writer.writerows(unresolved)
+
+
+def run_part_code_importer(part_codes_csv=None, chunk_size=DEFAULT_CHUNK_SIZE, report_path=None):
     """
     Loads part code data from part_codes_data.csv into the database.
+
+    Spare parts are created and part codes upserted on sap_code in batches; valve associations
+    are resolved against a tag map loaded once and written with one bulk insert into the
+    through table per chunk. Tags without a valve are written to `report_path`.
+    Returns a summary dict.
     """
-    part_codes_csv = os.path.join(BASE_DIR, '..', 'part_codes_data.csv')
+    part_codes_csv = part_codes_csv or os.path.join(BASE_DIR, '..', 'part_codes_data.csv')
+    report_path = report_path or os.path.join(BASE_DIR, '..', 'part_code_unresolved_tags.csv')
+    summary = {'part_codes': 0, 'spare_parts_created': 0, 'associations': 0, 'unresolved_tags': 0}
+
     try:
-        with open(part_codes_csv, mode='r', encoding='utf-8-sig') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                try:
-                    if not row['sap_code']:
-                        continue
-
-                    # Create or get SparePart
-                    spare_part = None
-                    if row['part_number']:
-                        spare_part, created = SparePart.objects.get_or_create(
-                            part_id=row['part_number'],
-                            defaults={'part_name': row['description']}
-                        )
-
-                    # Create or update PartCode
-                    part_code, created = PartCode.objects.update_or_create(
-                        sap_code=row['sap_code'].strip(),
-                        defaults={
-                            'oracle_code': row['oracle_code'].strip(),
-                            'part': spare_part,
-                            'description': row['description'].strip(),
-                            'location': row['warehouse_number'].strip(),
-                            'category': row['category'].strip(),
-                            'condition': row['condition'].strip(),
-                            'part_number': row['part_number'].strip(),
-                            'manufacturer_co': row['MANUFATURE_CO'].strip(),
-                            'unit_of_measure': row['unit_of_measure'].strip(),
-                        }
-                    )
-
-                    # Associate with valve
-                    if row['tag_number']:
-                        def format_tag_number(tag):
-                            # Remove spaces and convert to uppercase
-                            tag = tag.strip().replace(' ', '').upper()
-                            # Add hyphen after the first two letters if followed by numbers
-                            if len(tag) > 2 and tag[0:2].isalpha() and tag[2:].isdigit():
-                                tag = f"{tag[0:2]}-{tag[2:]}"
-                            return tag
-
-                        # Normalize tag_number: replace commas with slashes, then format each tag
-                        cleaned_tag_numbers_str = row['tag_number'].replace(',', '/')
-                        tag_numbers = [format_tag_number(tag) for tag in cleaned_tag_numbers_str.split('/')]
-                        for tag_number in tag_numbers:
-                            try:
-                                valve = Valve.objects.get(tag_number__iexact=tag_number) # Use iexact for case-insensitive matching
-                                part_code.associated_valves.add(valve)
-                            except Valve.DoesNotExist:
-                                print(f"Valve with tag number {tag_number} not found.")
-
-                except Exception as e:
-                    print(f"Error processing row: {row}. Error: {e}")
-                    continue
-        print("Successfully imported part codes.")
+        rows = read_part_code_rows(part_codes_csv)
     except FileNotFoundError:
         print(f"Error: {part_codes_csv} not found.")
-    except Exception as e:
-        print(f"An error occurred while importing part codes: {e}")
+        return summary
+
+    valve_ids_by_tag = load_valve_ids_by_tag()
+    Association = PartCode.associated_valves.through
+    unresolved = []
+    touched_part_code_ids = []
+    items = list(rows.items())
+
+    for start in range(0, len(items), chunk_size):
+        chunk = items[start:start + chunk_size]
+        with transaction.atomic():
+            # Spare parts are only created, never renamed, as get_or_create did
+            spare_parts = {row['part_number']: row['description'] for _, (row, _) in chunk if row['part_number']}
+            existing = set(SparePart.objects.filter(part_id__in=spare_parts).values_list('part_id', flat=True))
+            SparePart.objects.bulk_create(
+                [SparePart(part_id=part_id, part_name=name) for part_id, name in spare_parts.items() if part_id not in existing],
+                ignore_conflicts=True,
+            )
+            summary['spare_parts_created'] += len(spare_parts.keys() - existing)
+
+            part_codes = [build_part_code(sap_code, row) for sap_code, (row, _) in chunk]
+            PartCode.objects.bulk_create(
+                part_codes,
+                update_conflicts=True,
+                unique_fields=['sap_code'],
+                update_fields=PART_CODE_UPDATE_FIELDS,
+            )
+
+            associations = set()
+            for part_code, (sap_code, (_, tags)) in zip(part_codes, chunk):
+                for tag in tags:
+                    valve_id = valve_ids_by_tag.get(tag.upper())
+                    if valve_id is None:
+                        unresolved.append((sap_code, tag))
+                    else:
+                        associations.add((part_code.pk, valve_id))
+            Association.objects.bulk_create(
+                [Association(partcode_id=part_code_id, valve_id=valve_id) for part_code_id, valve_id in associations],
+                ignore_conflicts=True,
+            )
+
+        summary['part_codes'] += len(part_codes)
+        summary['associations'] += len(associations)
+        touched_part_code_ids.extend(part_code.pk for part_code in part_codes)
+        print(f"Saved {start + len(chunk)}/{len(items)} part codes")
+
+    # bulk_create sends no model signals; refresh every valve showing one of these part codes.
+    # No valve field changed, so the search index, tag index and dashboard stay as they are
+    bump_valve_version(*Association.objects.filter(
+        partcode_id__in=touched_part_code_ids
+    ).values_list('valve_id', flat=True).distinct())
+    bump_part_codes_version()
+
+    summary['unresolved_tags'] = len(unresolved)
+    if unresolved:
+        write_unresolved_report(report_path, unresolved)
+        print(f"{len(unresolved)} tags did not match a valve; see {report_path}")
+    print(f"Successfully imported {summary['part_codes']} part codes.")
+    return summary
+
 
 def run():
-    run_part_code_importer()
\ No newline at end of file
+    run_part_code_importer()
@@ -0,0 +1,148 @@
+"""
+Ranked valve search.
+
+On PostgreSQL, the icontains predicates are served by pg_trgm GIN indexes (see migration 0007)
+and results are ranked by trigram similarity. On SQLite, a trigram-tokenized FTS5 shadow table
+(`valves_valve_fts`) is queried and ranked with bm25. The shadow table is kept in sync by the
+signal handlers in valves/signals.py; `manage.py rebuild_search_index` repopulates it after
+bulk loads that bypass signals.
+"""
+from django.db import connections
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest
+from .models import Valve, ValveType
+
+FTS_TABLE = 'valves_valve_fts'
+# The trigram tokenizer cannot match terms shorter than three characters
+MIN_FTS_QUERY_LENGTH = 3
+
+_fts_ready = {}
+
+
+def fts_available(using='default'):
+    """Returns True if the SQLite FTS5 shadow table exists on this database."""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    if not _fts_ready.get(using):
+        _fts_ready[using] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_ready[using]
+
+
+def _substring_filter(query):
+    # Valve types are a short lookup table; resolving them first keeps the main filter on one table
+    type_ids = list(ValveType.objects.filter(name__icontains=query).values_list('pk', flat=True))
+    return (
+        Q(tag_number__icontains=query) |
+        Q(name__icontains=query) |
+        Q(location__icontains=query) |
+        Q(valve_type_id__in=type_ids)
+    )
+
+
+def _search_postgres(queryset, query):
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    return queryset.filter(_substring_filter(query)).annotate(
+        search_rank=Greatest(
+            TrigramSimilarity('tag_number', query),
+            TrigramSimilarity('name', query),
+            TrigramSimilarity('location', query),
+            TrigramSimilarity('valve_type__name', query),
+        )
+    )
+
+
+def _fts_phrase(query):
+    # Quote the whole term so FTS5 treats it as a literal substring, not query syntax
+    return '"%s"' % query.replace('"', '""')
+
+
+def _search_sqlite(queryset, query):
+    phrase = _fts_phrase(query)
+    valve_table = connections[queryset.db].ops.quote_name(Valve._meta.db_table)
+    # Both stay subqueries, so the caller's filters, ordering and pagination see every match.
+    # bm25 scores are negative, lower meaning more relevant
+    return queryset.filter(
+        pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [phrase])
+    ).annotate(
+        search_rank=RawSQL(
+            f"SELECT -bm25({FTS_TABLE}, 10.0, 3.0, 2.0, 1.0) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {valve_table}.valve_id",
+            [phrase],
+            output_field=FloatField(),
+        )
+    )
+
+
+def _search_fallback(queryset, query):
+    return queryset.filter(_substring_filter(query)).annotate(
+        search_rank=Case(
+            When(tag_number__istartswith=query, then=Value(2.0)),
+            When(tag_number__icontains=query, then=Value(1.0)),
+            default=Value(0.5),
+            output_field=FloatField(),
+        )
+    )
+
+
+def search_valves(queryset, query):
+    """
+    Filters a Valve queryset by a free-text query over tag number, name, type and location.
+    The result is annotated with `search_rank` (higher is more relevant).
+    """
+    query = query.strip()
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        return _search_postgres(queryset, query)
+    if len(query) >= MIN_FTS_QUERY_LENGTH and fts_available(queryset.db):
+        return _search_sqlite(queryset, query)
+    return _search_fallback(queryset, query)
+
+
+def index_valve(valve, using='default'):
+    """Writes one valve into the FTS shadow table."""
+    if not fts_available(using):
+        return
+    valve_type = valve.valve_type.name if valve.valve_type_id else ''
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {FTS_TABLE} (rowid, tag_number, name, valve_type, location) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            [valve.pk, valve.tag_number, valve.name or '', valve_type, valve.location or ''],
+        )
+
+
+def unindex_valve(valve_id, using='default'):
+    if not fts_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [valve_id])
+
+
+def reindex_valve_type(valve_type, using='default'):
+    """Propagates a renamed valve type into the FTS rows of its valves."""
+    if not fts_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {FTS_TABLE} SET valve_type = %s WHERE rowid IN "
+            f"(SELECT valve_id FROM {Valve._meta.db_table} WHERE valve_type_id = %s)",
+            [valve_type.name, valve_type.pk],
+        )
+
+
+def rebuild_index(using='default'):
+    """Repopulates the FTS shadow table from the valves table in one statement. Returns the row count."""
+    if not fts_available(using):
+        return 0
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, tag_number, name, valve_type, location) "
+            f"SELECT v.valve_id, v.tag_number, COALESCE(v.name, ''), COALESCE(t.name, ''), COALESCE(v.location, '') "
+            f"FROM {Valve._meta.db_table} v LEFT JOIN {ValveType._meta.db_table} t ON t.id = v.valve_type_id"
+        )
+        return cursor.rowcount
+
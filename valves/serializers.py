@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Valve, SparePart, PartCode, MaintenanceHistory, MaintenancePart
+from .forms import MAINTENANCE_ACTIVITY_CHOICES
+from .models import Valve, SparePart, PartCode, MaintenanceHistory, MaintenancePart, MaintenanceActivity
 
 class ValveSerializer(serializers.ModelSerializer):
     # 'images' field has been removed
@@ -49,6 +50,11 @@ class PartCodeSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 class MaintenanceHistorySerializer(serializers.ModelSerializer):
+    technician_name = serializers.CharField(source='technician.name', read_only=True)
+    activities = serializers.SlugRelatedField(
+        many=True, slug_field='name', queryset=MaintenanceActivity.objects.all(), required=False
+    )
+
     class Meta:
         model = MaintenanceHistory
         # The fields have been explicitly defined including the new fields for clarity
@@ -57,6 +63,7 @@ class MaintenanceHistorySerializer(serializers.ModelSerializer):
             'valve',
             'technician_name',
             'maintenance_date',
+            'activities',
             'before_image',
             'after_image',
             'oracle_code',        # New field: Oracle code/order
@@ -68,4 +75,15 @@ class MaintenanceHistorySerializer(serializers.ModelSerializer):
 class MaintenancePartSerializer(serializers.ModelSerializer):
     class Meta:
         model = MaintenancePart
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+class BulkMaintenanceRowSerializer(serializers.Serializer):
+    """One record of a bulk maintenance submission (see valves/bulk_maintenance.py)."""
+    valve_tag_number = serializers.CharField(max_length=100)
+    technician_name = serializers.CharField(max_length=255)
+    maintenance_date = serializers.DateField()
+    oracle_code = serializers.CharField(max_length=255, required=False, allow_blank=True, allow_null=True)
+    maintenance_activities = serializers.ListField(
+        child=serializers.ChoiceField(choices=MAINTENANCE_ACTIVITY_CHOICES), required=False
+    )
+    maintenance_notes = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    is_active = serializers.BooleanField(default=True)
@@ -0,0 +1,199 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+from .models import (
+    Valve, Factory, ValveStatus, ValveType, Manufacturer, MaintenanceHistory, MaintenancePart,
+    PartCode, SparePart, Technician, ValveImage
+)
+from .caching import bump_lookups_version, bump_part_codes_version, bump_tag_index_version, bump_valve_version
+from .dashboard import invalidate_dashboard
+from .thumbnails import generate_thumbnails_in_background
+from . import activities, blobs, search
+
+
+@receiver([post_save, post_delete], sender=Valve)
+@receiver([post_save, post_delete], sender=Factory)
+@receiver([post_save, post_delete], sender=ValveStatus)
+def invalidate_dashboard_snapshot(sender, **kwargs):
+    """Drop the cached home page statistics whenever the data behind them changes."""
+    invalidate_dashboard()
+
+
+@receiver(post_save, sender=Valve)
+def index_saved_valve(sender, instance, using, **kwargs):
+    search.index_valve(instance, using=using)
+
+
+@receiver(post_delete, sender=Valve)
+def unindex_deleted_valve(sender, instance, using, **kwargs):
+    search.unindex_valve(instance.pk, using=using)
+
+
+@receiver(post_save, sender=ValveType)
+def reindex_renamed_valve_type(sender, instance, using, created, **kwargs):
+    if not created:
+        search.reindex_valve_type(instance, using=using)
+
+
+@receiver(post_delete, sender=ValveType)
+def reindex_after_valve_type_delete(sender, using, **kwargs):
+    # The FK is SET_NULL through a bulk UPDATE, which sends no Valve signals
+    search.rebuild_index(using=using)
+
+
+@receiver(pre_save, sender=Valve)
+def remember_tag_change(sender, instance, **kwargs):
+    # Most valve saves (status, notes) leave the autocomplete index as it is
+    previous = None
+    if instance.pk:
+        previous = Valve.objects.filter(pk=instance.pk).values_list('tag_number', 'factory_id').first()
+    instance._tag_changed = previous != (instance.tag_number, instance.factory_id)
+
+
+@receiver([post_save, post_delete], sender=Valve)
+@receiver(post_delete, sender=Factory)
+def bump_tag_index_on_write(sender, instance, signal, **kwargs):
+    # Deleting a factory sets its valves' factory to NULL with a bulk UPDATE, which sends no Valve signals
+    if signal is post_save and not getattr(instance, '_tag_changed', True):
+        return
+    # Takes effect after commit (see valves/caching.py), so other processes cannot rebuild
+    # their index from the data being replaced
+    bump_tag_index_version()
+
+
+@receiver([post_save, post_delete], sender=Valve)
+@receiver([post_save, post_delete], sender=ValveImage)
+def bump_valve_on_write(sender, instance, **kwargs):
+    bump_valve_version(instance.pk if sender is Valve else instance.valve_id)
+
+
+@receiver([post_save, post_delete], sender=ValveType)
+@receiver([post_save, post_delete], sender=ValveStatus)
+@receiver([post_save, post_delete], sender=Manufacturer)
+@receiver([post_save, post_delete], sender=Factory)
+def bump_lookups_on_write(sender, **kwargs):
+    bump_lookups_version()
+
+
+@receiver(pre_save, sender=MaintenanceHistory)
+def remember_previous_valve(sender, instance, **kwargs):
+    # A record moved to another valve must also refresh the valve it left
+    instance._previous_valve_id = None
+    if instance.pk:
+        instance._previous_valve_id = (
+            MaintenanceHistory.objects.filter(pk=instance.pk).values_list('valve_id', flat=True).first()
+        )
+
+
+@receiver([post_save, post_delete], sender=MaintenanceHistory)
+def bump_valve_on_maintenance_write(sender, instance, **kwargs):
+    bump_valve_version(instance.valve_id, getattr(instance, '_previous_valve_id', None))
+
+
+@receiver([post_save, post_delete], sender=MaintenancePart)
+def bump_valve_on_part_usage_write(sender, instance, **kwargs):
+    valve_id = MaintenanceHistory.objects.filter(
+        pk=instance.maintenance_event_id
+    ).values_list('valve_id', flat=True).first()
+    bump_valve_version(valve_id)
+
+
+@receiver(post_save, sender=PartCode)
+@receiver(pre_delete, sender=PartCode)
+def bump_valves_on_part_code_write(sender, instance, **kwargs):
+    # pre_delete, because the association rows are gone by the time post_delete fires
+    bump_part_codes_version()
+    if instance.pk:
+        bump_valve_version(*instance.associated_valves.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=PartCode.associated_valves.through)
+def bump_valves_on_association_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    bump_part_codes_version()
+    if reverse:
+        # instance is a Valve, pk_set holds part code ids
+        bump_valve_version(instance.pk)
+    elif action == 'pre_clear':
+        bump_valve_version(*instance.associated_valves.values_list('pk', flat=True))
+    else:
+        bump_valve_version(*pk_set)
+
+
+@receiver(m2m_changed, sender=MaintenanceHistory.activities.through)
+def sync_activity_labels(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # instance is a MaintenanceActivity; clear() does not say which records lose it
+        instance._cleared_record_ids = list(instance.maintenance_records.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        labels = activities.refresh_activity_labels([instance.pk])
+        instance.maintenance_activities = ','.join(labels[instance.pk])
+    elif action == 'post_clear':
+        activities.refresh_activity_labels(getattr(instance, '_cleared_record_ids', []))
+    else:
+        activities.refresh_activity_labels(pk_set)
+
+
+@receiver(post_save, sender=Technician)
+def bump_valves_on_technician_rename(sender, instance, created, **kwargs):
+    if not created:
+        bump_valve_version(*MaintenanceHistory.objects.filter(
+            technician=instance
+        ).values_list('valve_id', flat=True).distinct())
+
+
+@receiver(post_save, sender=SparePart)
+def bump_valves_on_spare_part_rename(sender, instance, created, **kwargs):
+    if not created:
+        bump_valve_version(*MaintenancePart.objects.filter(
+            part=instance
+        ).values_list('maintenance_event__valve_id', flat=True).distinct())
+
+
+@receiver(post_save, sender=ValveImage)
+@receiver(post_save, sender=MaintenanceHistory)
+def create_image_thumbnails(sender, instance, **kwargs):
+    # Up-to-date thumbnails are skipped, so saves that keep the same image cost a few stat calls.
+    # Resizing runs on background threads, so large uploads do not hold up the response
+    fields = ['image'] if sender is ValveImage else ['before_image', 'after_image']
+    for field_name in fields:
+        field_file = getattr(instance, field_name)
+        transaction.on_commit(lambda field_file=field_file: generate_thumbnails_in_background(field_file))
+
+
+def _media_names(sender, instance):
+    fields = ['image'] if sender is ValveImage else ['before_image', 'after_image']
+    return [getattr(instance, field_name).name for field_name in fields if getattr(instance, field_name)]
+
+
+@receiver(post_save, sender=ValveImage)
+@receiver(post_save, sender=MaintenanceHistory)
+def link_media_blobs(sender, instance, **kwargs):
+    for name in _media_names(sender, instance):
+        transaction.on_commit(lambda name=name: blobs.add_file(name))
+
+
+@receiver(post_delete, sender=ValveImage)
+@receiver(post_delete, sender=MaintenanceHistory)
+def release_media_blobs(sender, instance, **kwargs):
+    for name in _media_names(sender, instance):
+        transaction.on_commit(lambda name=name: blobs.release_file(name))
+
+
+def after_bulk_valve_write(valve_ids, lookups_changed=False, part_codes_changed=False):
+    """
+    Does what the handlers above would have done for valves written with bulk_create, bulk_update
+    or queryset.update(), which send no model signals. Bulk loaders call this once at the end.
+    """
+    bump_valve_version(*valve_ids)
+    if lookups_changed:
+        bump_lookups_version()
+    if part_codes_changed:
+        bump_part_codes_version()
+    invalidate_dashboard()
+    bump_tag_index_version()
+    search.rebuild_index()
@@ -0,0 +1,134 @@
+"""
+Lazily loaded tabs of the valve detail page.
+
+The detail page itself only renders the valve row and its lookups; each tab below is fetched
+from `valves/<pk>/tabs/<tab>/` when it is first opened. Rendered tabs are cached per valve and
+keyed by the valve's cache version (see valves/caching.py), which the signal handlers in
+valves/signals.py bump on every write that changes what a tab shows.
+"""
+import hashlib
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
+from django.utils.translation import get_language
+from .caching import part_codes_version, valve_version
+from .models import MaintenanceHistory, MaintenancePart, PartCode, Valve
+
+# Newest records first; maintenance_id breaks ties between records logged on the same day
+MAINTENANCE_ORDERING = ('-maintenance_date', '-maintenance_id')
+
+TAB_CACHE_TIMEOUT = 60 * 60  # Safety net for writes that bypass model signals
+
+
+def part_number_related_codes_for(basic_part_codes, selected_part_number=None):
+    """
+    Part codes sharing a part number with the valve's own codes (or with the selected part number),
+    excluding the valve's own codes.
+    """
+    if selected_part_number:
+        part_numbers_to_match = [selected_part_number]
+    else:
+        part_numbers_to_match = [pc.part_number for pc in basic_part_codes if pc.part_number]
+
+    if not part_numbers_to_match:
+        return PartCode.objects.none()
+    return PartCode.objects.filter(
+        part_number__in=part_numbers_to_match
+    ).exclude(
+        pk__in=[pc.pk for pc in basic_part_codes]
+    )
+
+
+def _maintenance_records(valve_id):
+    parts_used = Prefetch(
+        'maintenancepart_set',
+        queryset=MaintenancePart.objects.select_related('part', 'code'),
+    )
+    return list(
+        MaintenanceHistory.objects.filter(valve_id=valve_id)
+        .select_related('technician')
+        .prefetch_related(parts_used)
+        .order_by(*MAINTENANCE_ORDERING)
+    )
+
+
+def part_codes_tab(valve_id, params):
+    part_codes = list(PartCode.objects.filter(associated_valves=valve_id))
+    return {'basic_part_codes': part_codes}, len(part_codes)
+
+
+def maintenance_tab(valve_id, params):
+    records = list(
+        MaintenanceHistory.objects.filter(valve_id=valve_id)
+        .select_related('technician')
+        .order_by(*MAINTENANCE_ORDERING)
+    )
+    return {'maintenance_records': records}, len(records)
+
+
+def parts_tab(valve_id, params):
+    parts_used_in_history = [
+        part_usage
+        for record in _maintenance_records(valve_id)
+        for part_usage in record.maintenancepart_set.all()
+    ]
+    return {'parts_used_in_history': parts_used_in_history}, len(parts_used_in_history)
+
+
+def related_tab(valve_id, params):
+    selected_part_number = params.get('part_number') or None
+    basic_part_codes = list(PartCode.objects.filter(associated_valves=valve_id).only('pk', 'part_number'))
+    related_codes = list(part_number_related_codes_for(basic_part_codes, selected_part_number))
+    context = {
+        'part_number_related_codes': related_codes,
+        'selected_part_number': selected_part_number,
+    }
+    return context, len(related_codes)
+
+
+def documents_tab(valve_id, params):
+    valve = get_object_or_404(Valve.objects.only('valve_id', 'drawing_link'), pk=valve_id)
+    images_count = valve.images.count()
+    return {'drawing_link': valve.drawing_link, 'images_count': images_count}, images_count
+
+
+# name -> (builder, template, GET parameters the tab depends on)
+TABS = {
+    'part-codes': (part_codes_tab, 'valves/tabs/part_codes.html', ()),
+    'maintenance': (maintenance_tab, 'valves/tabs/maintenance.html', ()),
+    'parts': (parts_tab, 'valves/tabs/parts.html', ()),
+    'related': (related_tab, 'valves/tabs/related.html', ('part_number',)),
+    'documents': (documents_tab, 'valves/tabs/documents.html', ()),
+}
+
+
+def tab_cache_key(valve_id, tab, params):
+    key = 'valves:tab:%s:%s:%s:%s' % (valve_id, valve_version(valve_id), tab, get_language())
+    if tab == 'related':
+        # Related codes come from other valves' part codes too, so any catalogue change invalidates them
+        key += ':%s' % part_codes_version()
+    _, _, varies_on = TABS[tab]
+    if varies_on:
+        raw = '&'.join('%s=%s' % (name, params.get(name, '')) for name in varies_on)
+        key += ':' + hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return key
+
+
+def render_tab(request, valve_id, tab):
+    """
+    Returns {'html': ..., 'count': ...} for one tab of one valve, from the cache when possible.
+    Raises KeyError for unknown tab names.
+    """
+    builder, template_name, _ = TABS[tab]
+    key = tab_cache_key(valve_id, tab, request.GET)
+    payload = cache.get(key)
+    if payload is None:
+        context, count = builder(valve_id, request.GET)
+        context['valve_id'] = valve_id
+        payload = {
+            'html': render_to_string(template_name, context, request=request),
+            'count': count,
+        }
+        cache.set(key, payload, TAB_CACHE_TIMEOUT)
+    return payload
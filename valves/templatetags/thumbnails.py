@@ -0,0 +1,46 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+from valves.thumbnails import original_width, thumbnail_sources
+
+register = template.Library()
+
+
+def _srcset(candidates):
+    return ', '.join(f'{url} {width}w' for url, width in candidates)
+
+
+@register.simple_tag
+def responsive_image(field_file, sizes='100vw', alt='', css_class=''):
+    """
+    Renders a lazily loaded <picture> whose srcset lists the thumbnails of an ImageField's file and
+    the original as the largest candidate, so the browser downloads the smallest copy that fits
+    and wide or high-density screens still get full resolution. Falls back to the original when
+    no thumbnails exist.
+
+        {% responsive_image image.image sizes="(min-width: 768px) 33vw, 100vw" alt=image.description %}
+    """
+    if not field_file:
+        return ''
+    sources = thumbnail_sources(field_file)
+    if not sources:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" loading="lazy" decoding="async">', field_file.url, alt, css_class
+        )
+
+    # Browsers without srcset get the largest thumbnail
+    src = sources[-1][1][-1][0]
+    width = original_width(field_file)
+    if width:
+        # Listed in every format: a source's type only tells the browser whether it can use the
+        # source, and the original is the only candidate wider than the largest thumbnail
+        sources = [(mime_type, candidates + [(field_file.url, width)]) for mime_type, candidates in sources]
+
+    *alternatives, (_, fallback) = sources
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy" decoding="async"></picture>',
+        format_html_join(
+            '', '<source type="{}" srcset="{}" sizes="{}">',
+            ((mime_type, _srcset(candidates), sizes) for mime_type, candidates in alternatives),
+        ),
+        src, _srcset(fallback), sizes, alt, css_class,
+    )
@@ -1,6 +1,59 @@
-from django.test import TestCase
-from valves.models import Valve, MaintenanceHistory, PartCode
+import csv
+import datetime
+import gzip
+import hashlib
+import importlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.conf import settings
+from django.urls import reverse
+from valves.models import (
+    Valve, MaintenanceHistory, MaintenancePart, PartCode, SparePart,
+    Factory, ValveStatus, ValveType, Technician, Document, ValveImage, MediaBlob,
+    MaintenanceActivity, Manufacturer, Shutdown, ChunkedUpload
+)
+from valves.caching import bump_valve_version, valve_version
+from valves.dashboard import get_factory_dashboard
+from valves.activities import activity_counts
+from valves.autocomplete import autocomplete_tags
+from valves.blobs import _release, blob_path, deduplicate
+from valves.documents import scan_documents
+from valves.forms import DocumentUploadForm, MaintenanceHistoryForm, ShutdownReportForm
+from valves.image_linker import ImageLinker, folder_layout_rule
+from valves.pagination import KeysetPaginator
+from valves.search import rebuild_index, search_valves
+from valves.signals import after_bulk_valve_write
+from valves.tabs import TABS
+from valves.thumbnails import original_width
+from valves.scripts import data_loader, part_code_loader
+from valves.scripts.maintenance_loader import MaintenanceImporter
 from django.utils import timezone
+from PIL import ExifTags, Image, ImageDraw
+
+# Tests that count queries pin the local-memory cache, so the counts cover the ORM work and not
+# the round trips of the shared database cache the project uses by default
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'valves-tests'}}
 
 class ValveRelatedNameTest(TestCase):
     def setUp(self):
@@ -40,3 +93,1336 @@ class ValveRelatedNameTest(TestCase):
         self.assertEqual(db_valve.plug_stem_mat, "316SS")
         self.assertEqual(db_valve.packing_mat, "Graphite")
         self.assertEqual(db_valve.shut_off_pressure, "10 BAR")
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class FactoryDashboardTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        operational = ValveStatus.objects.create(name="Operational")
+        needs_maintenance = ValveStatus.objects.create(name="Needs Maintenance")
+        self.afc1 = Factory.objects.create(name="AFC I")
+        self.zld = Factory.objects.create(name="ZLD")
+        Valve.objects.create(tag_number="FV-1", name="V1", factory=self.afc1, status=operational)
+        Valve.objects.create(tag_number="FV-2", name="V2", factory=self.afc1, status=needs_maintenance)
+        Valve.objects.create(tag_number="FV-3", name="V3", factory=self.zld, status=operational)
+
+    def test_counts_come_from_a_single_query(self):
+        """Test that factory statistics are aggregated in one query and cached afterwards"""
+        with self.assertNumQueries(2):  # grouped counts + recent valves
+            snapshot = get_factory_dashboard()
+        afc1 = snapshot['main_factories'][0]
+        self.assertEqual((afc1.total_valves, afc1.operational_valves, afc1.needs_maintenance_valves), (2, 1, 1))
+        self.assertEqual(snapshot['zld_factory'].total_valves, 1)
+
+        with self.assertNumQueries(0):
+            get_factory_dashboard()
+
+    def test_valve_write_invalidates_snapshot(self):
+        """Test that saving or deleting a valve drops the cached snapshot"""
+        get_factory_dashboard()
+        with self.captureOnCommitCallbacks(execute=True):
+            Valve.objects.create(tag_number="FV-4", name="V4", factory=self.afc1)
+        self.assertEqual(get_factory_dashboard()['main_factories'][0].total_valves, 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Valve.objects.get(tag_number="FV-1").delete()
+        self.assertEqual(get_factory_dashboard()['main_factories'][0].total_valves, 2)
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.valve = Valve.objects.create(tag_number="FV-100", name="Valve")
+        start = datetime.date(2024, 1, 1)
+        # Several records share a date so the maintenance_id tie-breaker is exercised
+        for i in range(23):
+            MaintenanceHistory.objects.create(valve=self.valve, maintenance_date=start + datetime.timedelta(days=i // 3))
+
+    def walk(self, paginator):
+        pages = [paginator.get_page()]
+        while pages[-1].has_next:
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        return pages
+
+    def test_forward_and_backward_walks_match_offset_order(self):
+        """Test that next/previous cursors visit every record exactly once, in order"""
+        queryset = MaintenanceHistory.objects.all()
+        expected = list(queryset.order_by('-maintenance_date', '-maintenance_id').values_list('pk', flat=True))
+        paginator = KeysetPaginator(queryset, ('-maintenance_date', '-maintenance_id'), per_page=5)
+
+        pages = self.walk(paginator)
+        self.assertEqual([obj.pk for page in pages for obj in page], expected)
+        self.assertFalse(pages[0].has_previous)
+
+        back = paginator.get_page(pages[-1].previous_cursor)
+        self.assertEqual([obj.pk for obj in back], [obj.pk for obj in pages[-2]])
+
+        last = paginator.get_page(pages[0].last_cursor)
+        self.assertEqual([obj.pk for obj in last], expected[-5:])
+        self.assertFalse(last.has_next)
+
+    def test_nullable_key_and_bad_cursor(self):
+        """Test that NULL sort keys sort last and malformed cursors fall back to the first page"""
+        for code in ["B", None, "A", None, "C"]:
+            PartCode.objects.create(sap_code=code)
+        paginator = KeysetPaginator(PartCode.objects.all(), ('sap_code', 'part_code_id'), per_page=2)
+        codes = [obj.sap_code for page in self.walk(paginator) for obj in page]
+        self.assertEqual(codes, ["A", "B", "C", None, None])
+        self.assertEqual(len(paginator.get_page("not-a-cursor")), 2)
+
+
+class ValveSearchTest(TestCase):
+    def setUp(self):
+        globe = ValveType.objects.create(name="Globe Valve")
+        self.exact = Valve.objects.create(tag_number="FV-33002", name="Feed valve", location="Unit 1", valve_type=globe)
+        self.other = Valve.objects.create(tag_number="HV-12000", name="Hand valve near FV-33002", location="Unit 2")
+        Valve.objects.create(tag_number="PV-50000", name="Pressure valve", location="Unit 3")
+
+    def search(self, query):
+        return list(search_valves(Valve.objects.all(), query).order_by('-search_rank', 'tag_number'))
+
+    def test_ranked_results(self):
+        """Test that tag matches outrank matches in other columns and non-matches are excluded"""
+        self.assertEqual(self.search("v-33002"), [self.exact, self.other])
+        self.assertEqual(self.search("globe"), [self.exact])
+
+    def test_index_follows_valve_writes(self):
+        """Test that saves, deletes and valve type renames are reflected in search results"""
+        self.other.tag_number = "HV-77777"
+        self.other.name = "Hand valve"
+        self.other.save()
+        self.assertEqual(self.search("33002"), [self.exact])
+
+        self.exact.valve_type.name = "Angle Valve"
+        self.exact.valve_type.save()
+        self.assertEqual(self.search("angle"), [self.exact])
+
+        self.exact.delete()
+        self.assertEqual(self.search("33002"), [])
+
+    def test_every_match_reaches_filters_and_pagination(self):
+        """Test that large match sets are not cut before the caller's filters, count and pages"""
+        factory = Factory.objects.create(name="North")
+        Valve.objects.bulk_create([
+            Valve(tag_number="AV-%05d" % i, name="Valve", location="Unit 1", factory=factory if i >= 590 else None)
+            for i in range(600)
+        ])
+        rebuild_index()
+
+        self.assertEqual(search_valves(Valve.objects.all(), "AV-0").count(), 600)
+        filtered = search_valves(Valve.objects.filter(factory=factory), "AV-0")
+        self.assertEqual(filtered.count(), 10)
+        paginator = KeysetPaginator(filtered, ('-search_rank', 'tag_number'), per_page=4)
+        page, tags = paginator.get_page(), []
+        while True:
+            tags.extend(valve.tag_number for valve in page)
+            if not page.has_next:
+                break
+            page = paginator.get_page(page.next_cursor)
+        self.assertEqual(sorted(tags), ["AV-%05d" % i for i in range(590, 600)])
+
+    def test_short_query_falls_back_to_substring_match(self):
+        """Test that queries shorter than a trigram still match"""
+        self.assertEqual(self.search("PV"), [Valve.objects.get(tag_number="PV-50000")])
+
+
+class ValveDetailQueryCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("engineer", password="secret")
+        self.client.force_login(self.user)
+        self.part = SparePart.objects.create(part_id="P-1", part_name="Packing set")
+        self.code = PartCode.objects.create(sap_code="SAP-100", part_number="PN-1")
+        PartCode.objects.create(sap_code="SAP-101", part_number="PN-1")
+        self.technician = Technician.objects.create(name="ALAA")
+        cache.clear()
+
+    def make_valve(self, tag, records):
+        valve = Valve.objects.create(tag_number=tag, name=tag)
+        self.code.associated_valves.add(valve)
+        for i in range(records):
+            record = MaintenanceHistory.objects.create(
+                valve=valve, technician=self.technician, maintenance_date=datetime.date(2024, 1, 1) + datetime.timedelta(days=i)
+            )
+            MaintenancePart.objects.create(maintenance_event=record, part=self.part, code=self.code)
+        return valve
+
+    def count_queries(self, valve, url_name='valves:valve-detail-frontend', **kwargs):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name, kwargs={'pk': valve.pk, **kwargs}))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_history(self):
+        """Test that a valve with many maintenance events renders with the same number of queries"""
+        small_valve = self.make_valve("FV-1", 1)
+        large_valve = self.make_valve("FV-2", 40)
+        self.assertEqual(self.count_queries(small_valve), self.count_queries(large_valve))
+        for tab in TABS:
+            self.assertEqual(
+                self.count_queries(small_valve, 'valves:valve-detail-tab', tab=tab),
+                self.count_queries(large_valve, 'valves:valve-detail-tab', tab=tab),
+                tab,
+            )
+
+    def test_tab_is_cached_until_valve_data_changes(self):
+        """Test that a cached tab is served without queries and refreshed after a new maintenance record"""
+        valve = self.make_valve("FV-3", 2)
+        url = reverse('valves:valve-detail-tab', kwargs={'pk': valve.pk, 'tab': 'maintenance'})
+        self.assertEqual(self.client.get(url).json()['count'], 2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).json()['count'], 2)
+        self.assertFalse([q for q in queries if 'valves_maintenancehistory' in q['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            MaintenanceHistory.objects.create(valve=valve, technician=self.technician, maintenance_date=datetime.date(2025, 1, 1))
+        self.assertEqual(self.client.get(url).json()['count'], 3)
+
+    def test_related_tab_follows_part_code_changes(self):
+        """Test that the related tab picks up a part code added to another valve"""
+        valve = self.make_valve("FV-4", 0)
+        url = reverse('valves:valve-detail-tab', kwargs={'pk': valve.pk, 'tab': 'related'})
+        self.assertEqual(self.client.get(url).json()['count'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            PartCode.objects.create(sap_code="SAP-102", part_number="PN-1")
+        self.assertEqual(self.client.get(url).json()['count'], 2)
+
+    def test_unknown_tab_returns_404(self):
+        valve = self.make_valve("FV-5", 0)
+        response = self.client.get(reverse('valves:valve-detail-tab', kwargs={'pk': valve.pk, 'tab': 'nope'}))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class ValveFragmentCacheTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("engineer", password="secret")
+        self.client.force_login(self.user)
+        self.status = ValveStatus.objects.create(name="Operational")
+        self.valve = Valve.objects.create(tag_number="FV-100", name="Feed valve", status=self.status)
+        cache.clear()
+
+    def get_detail(self):
+        return self.client.get(reverse('valves:valve-detail-frontend', kwargs={'pk': self.valve.pk}))
+
+    def test_repeat_view_skips_valve_queries(self):
+        """Test that a second view of a valve renders its summary from the cache"""
+        self.get_detail()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_detail()
+        self.assertContains(response, "Feed valve")
+        self.assertFalse([q for q in queries if 'valves_' in q['sql']])
+
+    def test_valve_and_lookup_writes_refresh_fragments(self):
+        """Test that edits to the valve or its status are never served from a stale fragment"""
+        self.get_detail()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.valve.name = "Drain valve"
+            self.valve.save()
+        self.assertContains(self.get_detail(), "Drain valve")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.status.name = "Needs Maintenance"
+            self.status.save()
+        self.assertContains(self.get_detail(), "Needs Maintenance")
+        list_response = self.client.get(reverse('valves:valve-list-frontend'))
+        self.assertContains(list_response, "Needs Maintenance")
+
+    def test_list_row_refreshes_after_valve_write(self):
+        """Test that a cached list row picks up a changed location"""
+        url = reverse('valves:valve-list-frontend')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.valve.location = "Pump house"
+            self.valve.save()
+        self.assertContains(self.client.get(url), "Pump house")
+
+    def test_versions_move_only_after_commit(self):
+        """Test that a write leaves the cached fragments in place until its transaction commits"""
+        self.get_detail()
+        version = valve_version(self.valve.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.valve.name = "Drain valve"
+            self.valve.save()
+            # A concurrent request still sees the committed name, and caches it under the old version
+            self.assertEqual(valve_version(self.valve.pk), version)
+        self.assertNotEqual(valve_version(self.valve.pk), version)
+        self.assertContains(self.get_detail(), "Drain valve")
+
+
+
+class SharedCacheTest(TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.db_dir)
+        self.order_csv = os.path.join(self.db_dir, 'order.csv')
+        with open(self.order_csv, 'w', encoding='utf-8') as f:
+            f.write("tag_number\nFV-2\nFV-1\n")
+        for tag in ("FV-1", "FV-2"):
+            Valve.objects.create(tag_number=tag, name=tag, location="x", sort_order=99)
+
+    def test_loader_bumps_reach_every_process(self):
+        """Test that versions bumped by the bulk loaders are stored in the cache table the web workers read"""
+        self.assertIsInstance(caches['default'], DatabaseCache)
+        valve = Valve.objects.get(tag_number="FV-1")
+        version = valve_version(valve.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            after_bulk_valve_write([valve.pk])
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT cache_key FROM valves_cache WHERE cache_key LIKE %s", ['%valves:version:' + str(valve.pk)])
+            self.assertEqual(len(cursor.fetchall()), 1)
+        self.assertNotEqual(valve_version(valve.pk), version)
+
+    def test_bumps_write_a_new_version_without_incr(self):
+        """Test that bumps are single writes of unused values, so concurrent bumps cannot collapse into one"""
+        valve = Valve.objects.get(tag_number="FV-1")
+        seen = {valve_version(valve.pk)}
+        with mock.patch.object(DatabaseCache, 'incr', side_effect=AssertionError("incr is not atomic here")):
+            for _ in range(3):
+                with self.captureOnCommitCallbacks(execute=True):
+                    bump_valve_version(valve.pk)
+                seen.add(valve_version(valve.pk))
+        self.assertEqual(len(seen), 4)
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_commands_refuse_a_process_local_cache(self):
+        """Test that writing commands stop before writing when the cache is private to their process"""
+        with self.assertRaises(ImproperlyConfigured):
+            call_command('update_sort_order', file=self.order_csv, stdout=io.StringIO())
+        with self.assertRaises(ImproperlyConfigured):
+            call_command('link_images', '--no-input', stdout=io.StringIO())
+        self.assertEqual(set(Valve.objects.values_list('sort_order', flat=True)), {99})
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class ValveImporterTest(TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.db_dir)
+
+    def write_csv(self, filename, rows):
+        with open(os.path.join(self.db_dir, filename), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['﻿tag_number', 'Manufacturer / Model', 'Body Style', ''])
+            writer.writerows(rows)
+
+    def test_bulk_upsert(self):
+        """Test that valves are created, updated and skipped in a constant number of queries"""
+        Valve.objects.create(tag_number="FV-1", name="Old", location="Somewhere")
+        rows = [("FV-%d" % i, "Fisher / ED", "Globe", "") for i in range(1, 60)] + [("", "", "", "")]
+        self.write_csv('AFC1_VALVS.csv', rows)
+        self.write_csv('ZLD.csv', [("ZV-1", "Samson", "", "")])
+
+        with CaptureQueriesContext(connection) as queries:
+            summary = data_loader.run_valve_importer(db_dir=self.db_dir, chunk_size=25)
+
+        self.assertEqual(summary, {
+            'created': 59, 'updated': 1, 'skipped': 1, 'errors': [('AFC1_VALVS.csv:61', "no tag number")],
+        })
+        self.assertLess(len(queries), 40)
+        updated = Valve.objects.select_related('factory', 'manufacturer').get(tag_number="FV-1")
+        self.assertEqual(updated.name, "Valve FV-1")
+        self.assertEqual(updated.factory.name, "AFC I")
+        self.assertEqual(updated.manufacturer.name, "Fisher")
+        self.assertEqual(updated.model_number, "ED")
+        self.assertEqual(updated.body_style, "Globe")
+        zld = Valve.objects.get(tag_number="ZV-1")
+        self.assertEqual(zld.factory.name, "ZLD")
+        self.assertIsNone(zld.model_number)
+        self.assertIsNone(zld.body_style)
+
+        version = valve_version(zld.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            summary = data_loader.run_valve_importer(db_dir=self.db_dir)
+        self.assertEqual((summary['created'], summary['updated'], summary['skipped']), (0, 60, 1))
+        self.assertNotEqual(valve_version(zld.pk), version)
+
+    def test_invalid_rows_are_skipped_with_their_reason(self):
+        """Test that rows with values too long for their columns are reported and the rest imported"""
+        self.write_csv('AFC1_VALVS.csv', [
+            ("FV-1", "Fisher / ED", "Globe", ""),
+            ("FV-2", "Fisher / ED", "G" * 300, ""),
+            ("FV-3", "M" * 150, "", ""),
+            ("FV-4", "Samson", "", ""),
+        ])
+        summary = data_loader.run_valve_importer(db_dir=self.db_dir)
+
+        self.assertEqual((summary['created'], summary['skipped']), (2, 2))
+        self.assertEqual([where for where, _ in summary['errors']], ['AFC1_VALVS.csv:3 (FV-2)', 'AFC1_VALVS.csv:4 (FV-3)'])
+        self.assertIn('body_style', summary['errors'][0][1])
+        self.assertIn('manufacturer', summary['errors'][1][1])
+        self.assertEqual(sorted(Valve.objects.values_list('tag_number', flat=True)), ["FV-1", "FV-4"])
+        self.assertFalse(Manufacturer.objects.filter(name="M" * 150).exists())
+
+    def test_update_sort_order(self):
+        """Test that valves are re-sequenced in bulk and unknown tags are reported"""
+        for tag in ("FV-1", "FV-2", "FV-3"):
+            Valve.objects.create(tag_number=tag, name=tag, location="x", sort_order=99)
+        path = os.path.join(self.db_dir, 'order.csv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("tag_number\nFV-3\nXX-9\nFV-1\n\nFV-2\n")
+
+        with CaptureQueriesContext(connection) as queries:
+            updated, missing = data_loader.update_sort_order(path)
+
+        self.assertEqual((updated, missing), (3, ["XX-9"]))
+        self.assertLessEqual(len([q for q in queries if 'valves_valve' in q['sql']]), 2)
+        self.assertEqual(
+            list(Valve.objects.order_by('sort_order').values_list('tag_number', flat=True)),
+            ["FV-3", "FV-1", "FV-2"],
+        )
+        self.assertEqual(data_loader.update_sort_order(path), (0, ["XX-9"]))
+
+    def test_part_code_import(self):
+        """Test that part codes, spare parts and valve links are written in bulk"""
+        for tag in ("FV-33001", "FV-33002"):
+            Valve.objects.create(tag_number=tag, name=tag, location="x")
+        path = os.path.join(self.db_dir, 'part_codes.csv')
+        report = os.path.join(self.db_dir, 'unresolved.csv')
+        header = "warehouse_number,sap_code,oracle_code,condition,description,part_number,tag_number,MANUFATURE_CO,unit_of_measure,category\n"
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(header)
+            f.write("10,S1,O1,NEW,Packing,PN-1,fv33001 / FV33002,Fisher,PC,ZSPR\n")
+            f.write("10,S2,O2,NEW,Seal,PN-1,FV-99999,Fisher,PC,ZSPR\n")
+            f.write("10,,O3,NEW,No SAP code,PN-3,FV-33001,Fisher,PC,ZSPR\n")
+            f.write("11,S1,O1,USED,Packing set,PN-1,FV-33001,Fisher,PC,ZSPR\n")
+
+        valve = Valve.objects.get(tag_number="FV-33002")
+        version = valve_version(valve.pk)
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch('valves.search.rebuild_index') as rebuild_index, \
+                mock.patch('valves.signals.invalidate_dashboard') as invalidate_dashboard, \
+                self.captureOnCommitCallbacks(execute=True):
+            summary = part_code_loader.run_part_code_importer(path, report_path=report)
+
+        self.assertLess(len(queries), 20)
+        # Only the linked valves and the part code catalogue are refreshed; no valve field changed
+        self.assertNotEqual(valve_version(valve.pk), version)
+        rebuild_index.assert_not_called()
+        invalidate_dashboard.assert_not_called()
+        self.assertEqual(summary, {'part_codes': 2, 'spare_parts_created': 1, 'associations': 2, 'unresolved_tags': 1})
+        s1 = PartCode.objects.get(sap_code="S1")
+        self.assertEqual((s1.condition, s1.location, s1.part_id), ("USED", "11", "PN-1"))
+        self.assertEqual(sorted(s1.associated_valves.values_list('tag_number', flat=True)), ["FV-33001", "FV-33002"])
+        with open(report, encoding='utf-8') as f:
+            self.assertEqual(f.read().split(), ["sap_code,tag_number", "S2,FV-99999"])
+
+        part_code_loader.run_part_code_importer(path, report_path=report)
+        self.assertEqual(PartCode.associated_valves.through.objects.count(), 2)
+
+    def test_maintenance_import(self):
+        """Test that maintenance rows are upserted on (valve, date) in bulk"""
+        valve = Valve.objects.create(tag_number="FV-33002", name="x", location="x")
+        Valve.objects.create(tag_number="FV-33003", name="y", location="y")
+        existing = MaintenanceHistory.objects.create(valve=valve, maintenance_date=datetime.date(2017, 7, 16), maintenance_notes="old")
+        path = os.path.join(self.db_dir, 'maintenance.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Factory', 'Tag_Number', 'Date', 'Work_Done', 'Test', 'Technician'])
+            writer.writerow(['AFC I', 'FV-33002', '16-07-2017', 'replace packing', 'ok', 'ALAA'])
+            writer.writerow(['AFC I', 'FV-33003', '05/06/2018', 'lapping', '', 'ALAA'])
+            writer.writerow(['AFC I', 'FV-33003', '13/06/2018 10:30', 'stroke test', '', ''])
+            writer.writerow(['AFC I', 'FV-99999', '16-07-2017', 'unknown valve', '', ''])
+            writer.writerow(['AFC I', 'FV-33003', 'someday', 'bad date', '', ''])
+
+        importer = MaintenanceImporter(chunk_size=2)
+        summary = importer.run(path)
+
+        self.assertEqual(
+            summary,
+            {'rows': 5, 'created': 2, 'updated': 1, 'skipped': 2, 'technicians_created': 1},
+        )
+        existing.refresh_from_db()
+        self.assertEqual(existing.maintenance_notes, "replace packing\nTest: ok")
+        self.assertEqual(existing.technician.name, "ALAA")
+        self.assertEqual(
+            sorted(MaintenanceHistory.objects.filter(valve__tag_number="FV-33003").values_list('maintenance_date', flat=True)),
+            [datetime.date(2018, 5, 6), datetime.date(2018, 6, 13)],
+        )
+        self.assertEqual(importer.unknown_tags, {"FV-99999"})
+
+        summary = MaintenanceImporter().run(path)
+        self.assertEqual((summary['created'], summary['updated']), (0, 3))
+
+    def test_maintenance_export(self):
+        """Test that the export streams filtered records in one query and every format"""
+        afc = Factory.objects.create(name="AFC I")
+        zld = Factory.objects.create(name="ZLD")
+        technician = Technician.objects.create(name="ALAA")
+        for tag, factory in (("FV-1", afc), ("FV-2", zld), ("FV-3", None)):
+            valve = Valve.objects.create(tag_number=tag, name=tag, location="x", factory=factory)
+            MaintenanceHistory.objects.create(
+                valve=valve, maintenance_date=datetime.date(2020, 1, 2), technician=technician,
+                maintenance_notes="replace packing\nTest: ok",
+            )
+            MaintenanceHistory.objects.create(valve=valve, maintenance_date=datetime.date(2015, 1, 2))
+
+        path = os.path.join(self.db_dir, 'out.csv')
+        with CaptureQueriesContext(connection) as queries:
+            call_command('export_maintenance', output=path, stdout=io.StringIO())
+        self.assertEqual(len(queries), 1)
+        with open(path, encoding='utf-8') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[1], ["AFC I", "FV-1", "02-01-2020", "replace packing", "ok", "ALAA"])
+        self.assertEqual(rows[6], ["", "FV-3", "02-01-2015", "", "", ""])
+
+        gz_path = os.path.join(self.db_dir, 'out.csv.gz')
+        call_command('export_maintenance', output=gz_path, factory="zld", since="2019-01-01", stdout=io.StringIO())
+        with gzip.open(gz_path, 'rt', encoding='utf-8') as f:
+            self.assertEqual(list(csv.reader(f))[1:], [["ZLD", "FV-2", "02-01-2020", "replace packing", "ok", "ALAA"]])
+
+        jsonl_path = os.path.join(self.db_dir, 'out.jsonl')
+        call_command('export_maintenance', output=jsonl_path, since="2019-01-01", stdout=io.StringIO())
+        with open(jsonl_path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([r['Tag_Number'] for r in records], ["FV-1", "FV-2", "FV-3"])
+
+
+class ListExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("engineer", password="secret")
+        self.client.force_login(self.user)
+        factory = Factory.objects.create(name="AFC I")
+        for i in range(1, 4):
+            valve = Valve.objects.create(tag_number="FV-%d" % i, name="Valve %d" % i, location="Unit 1", factory=factory)
+            MaintenanceHistory.objects.create(valve=valve, maintenance_date=datetime.date(2024, 1, i), maintenance_notes="packing")
+        code = PartCode.objects.create(sap_code="SAP-1", description="Packing", part_number="PN-1")
+        code.associated_valves.add(*Valve.objects.all())
+
+    def export(self, url_name, **params):
+        response = self.client.get(reverse(url_name), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_export_uses_list_filters(self):
+        """Test that the CSV export streams the rows matching the list's query string"""
+        response, content = self.export('valves:valve-list-frontend', export='csv', q='FV-2', cursor='junk')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="valves.csv"')
+        rows = list(csv.reader(io.StringIO(content.decode('utf-8-sig'))))
+        self.assertEqual(rows[0][0], 'Tag Number')
+        self.assertEqual([row[0] for row in rows[1:]], ['FV-2'])
+
+        _, content = self.export('valves:maintenance-history-frontend', export='csv')
+        rows = list(csv.reader(io.StringIO(content.decode('utf-8-sig'))))
+        self.assertEqual([row[1] for row in rows[1:]], ['FV-3', 'FV-2', 'FV-1'])
+
+        _, content = self.export('valves:part-code-list-frontend', export='csv')
+        rows = list(csv.reader(io.StringIO(content.decode('utf-8-sig'))))
+        self.assertEqual(rows[1][-1], 'FV-1, FV-2, FV-3')
+
+    def test_xlsx_export_is_a_valid_workbook(self):
+        """Test that the XLSX export is a readable single-sheet workbook"""
+        response, content = self.export('valves:shutdown-report', export='xlsx', start_date='2024-01-02')
+        self.assertEqual(response['Content-Type'], 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        with zipfile.ZipFile(io.BytesIO(content)) as workbook:
+            self.assertIsNone(workbook.testzip())
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertEqual(sheet.count('<row>'), 3)
+        self.assertIn('FV-3', sheet)
+        self.assertNotIn('FV-1<', sheet)
+
+class DocumentIndexTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def write(self, relative_path, content=b'data'):
+        path = os.path.join(self.media_root, *relative_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_incremental_scan(self):
+        """Test that rescans only list changed folders and keep the index in sync"""
+        self.write('AFC I/Datasheets/FV-1.jpg')
+        self.write('AFC I/Datasheets/old/FV-2.pdf')
+        self.write('AFC I/readme.txt')
+        self.write('valves/FV-1/Valves_Specs/spec.jpg')
+
+        summary = scan_documents()
+        self.assertEqual(summary['added'], 2)
+        self.assertEqual(
+            sorted(Document.objects.values_list('name', flat=True)), ['FV-1.jpg', 'old/FV-2.pdf']
+        )
+        document = Document.objects.get(name='FV-1.jpg')
+        self.assertEqual((document.factory, document.doc_type, document.size), ('AFC I', 'Datasheets', 4))
+        self.assertEqual(len(document.sha256), 64)
+
+        summary = scan_documents()
+        self.assertEqual((summary['folders_scanned'], summary['added'], summary['removed']), (0, 0, 0))
+
+        os.remove(os.path.join(self.media_root, 'AFC I', 'Datasheets', 'old', 'FV-2.pdf'))
+        self.write('AFC I/Datasheets/old/FV-3.pdf')
+        summary = scan_documents()
+        self.assertEqual((summary['folders_scanned'], summary['added'], summary['removed']), (1, 1, 1))
+
+        shutil.rmtree(os.path.join(self.media_root, 'AFC I', 'Datasheets', 'old'))
+        scan_documents()
+        self.assertEqual(list(Document.objects.values_list('name', flat=True)), ['FV-1.jpg'])
+
+    def test_documents_page_reads_the_index(self):
+        """Test that uploads are indexed and the page lists and searches the index"""
+        self.client.force_login(User.objects.create_user("engineer", password="secret"))
+        self.write('AFC I/Datasheets/FV-1.jpg')
+        scan_documents()
+
+        response = self.client.post(reverse('valves:documents-page'), {
+            'factory': 'AFC I', 'document_type': 'Manuals', 'name': 'FV-2 manual',
+            'file': SimpleUploadedFile('manual.pdf', b'%PDF'),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Document.objects.filter(relative_path='AFC I/Manuals/FV-2 manual.pdf').exists())
+
+        with self.assertNumQueries(4):  # session, user, folder counts, one page of documents
+            response = self.client.get(reverse('valves:documents-page'), {'q': 'fv-2'})
+        self.assertEqual(response.context['folders'], {'AFC I': [('Datasheets', 1), ('Manuals', 1)]})
+        self.assertEqual([document.name for document in response.context['documents']], ['FV-2 manual.pdf'])
+
+class ChunkedUploadTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(User.objects.create_user("engineer", password="secret"))
+
+    def put_chunk(self, upload_id, offset, data, checksum=None):
+        headers = {'Upload-Offset': str(offset)}
+        if checksum:
+            headers['X-Chunk-SHA256'] = checksum
+        return self.client.put(
+            reverse('valves:upload-chunk', args=[upload_id]), data,
+            content_type='application/octet-stream', headers=headers,
+        )
+
+    def test_resumable_upload_is_moved_into_place(self):
+        """Test that chunks are verified, resumed by offset and the finished file is claimed by the form"""
+        content = b'P&ID drawing ' * 100
+        response = self.client.post(
+            reverse('valves:upload-start'),
+            json.dumps({'filename': 'drawing.pdf', 'size': len(content), 'sha256': hashlib.sha256(content).hexdigest()}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        upload_id = response.json()['upload_id']
+
+        first, rest = content[:500], content[500:]
+        self.assertEqual(self.put_chunk(upload_id, 0, first, hashlib.sha256(first).hexdigest()).json()['offset'], 500)
+        # A retried chunk or a skipped one gets the offset to resume from
+        response = self.put_chunk(upload_id, 0, first)
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 500))
+        response = self.put_chunk(upload_id, 500, rest, hashlib.sha256(b'corrupted').hexdigest())
+        self.assertEqual((response.status_code, response.json()['offset']), (400, 500))
+
+        self.assertEqual(self.client.get(reverse('valves:upload-chunk', args=[upload_id])).json()['offset'], 500)
+        self.assertTrue(self.put_chunk(upload_id, 500, rest, hashlib.sha256(rest).hexdigest()).json()['complete'])
+
+        response = self.client.post(reverse('valves:documents-page'), {
+            'factory': 'AFC I', 'document_type': 'P&ID', 'name': 'FV-1', 'upload': upload_id,
+        })
+        self.assertEqual(response.status_code, 302)
+        with open(os.path.join(self.media_root, 'AFC I', 'P&ID', 'FV-1.pdf'), 'rb') as f:
+            self.assertEqual(f.read(), content)
+        document = Document.objects.get(relative_path='AFC I/P&ID/FV-1.pdf')
+        self.assertEqual(document.sha256, hashlib.sha256(content).hexdigest())
+        self.assertFalse(os.listdir(os.path.join(self.media_root, '.uploads')))
+
+    def test_upload_can_only_be_claimed_by_its_owner(self):
+        """Test that another user who learns an upload id cannot attach that file"""
+        content = b'confidential drawing'
+        upload_id = self.client.post(
+            reverse('valves:upload-start'), json.dumps({'filename': 'drawing.pdf', 'size': len(content)}),
+            content_type='application/json',
+        ).json()['upload_id']
+        self.assertTrue(self.put_chunk(upload_id, 0, content).json()['complete'])
+
+        self.client.force_login(User.objects.create_user("intruder", password="secret"))
+        data = {'factory': 'AFC I', 'document_type': 'P&ID', 'name': 'FV-1', 'upload': upload_id}
+        response = self.client.post(reverse('valves:documents-page'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'AFC I', 'P&ID', 'FV-1.pdf')))
+        self.assertFalse(DocumentUploadForm(data).is_valid())
+        self.assertTrue(ChunkedUpload.objects.filter(pk=upload_id).exists())
+
+class ThumbnailTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.valve = Valve.objects.create(tag_number="FV-1", name="Valve", location="Unit 1")
+
+    def jpeg(self, width, height):
+        buffer = io.BytesIO()
+        Image.new('RGB', (width, height), 'gray').save(buffer, 'JPEG')
+        return SimpleUploadedFile('spec sheet.jpg', buffer.getvalue())
+
+    def thumbs(self):
+        directory = os.path.join(self.media_root, 'valves', 'FV-1', 'Valves_Specs', '_thumbs')
+        return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+    def test_thumbnails_on_upload_and_backfill(self):
+        """Test that saving an image creates smaller copies that the gallery serves with srcset"""
+        with mock.patch('valves.thumbnails.background', ThreadPoolExecutor(1)) as background:
+            with self.captureOnCommitCallbacks(execute=True):
+                image = ValveImage.objects.create(valve=self.valve, image=self.jpeg(1000, 500))
+            background.shutdown(wait=True)
+        self.assertEqual(
+            [name.rsplit('_', 1)[1] for name in self.thumbs()],
+            ['320.jpg', '320.webp', '640.jpg', '640.webp'],
+        )
+        with Image.open(os.path.join(self.media_root, 'valves', 'FV-1', 'Valves_Specs', '_thumbs', self.thumbs()[0])) as thumb:
+            self.assertEqual(thumb.size, (320, 160))
+
+        html = Template('{% load thumbnails %}{% responsive_image image.image sizes="33vw" %}').render(
+            Context({'image': image})
+        )
+        self.assertIn('<source type="image/webp" srcset="/media/valves/FV-1/Valves_Specs/_thumbs/spec_sheet_320.webp 320w', html)
+        self.assertIn('loading="lazy"', html)
+        # The original is the widest candidate of every format; the plain src stays a thumbnail
+        self.assertEqual(html.count('/media/valves/FV-1/Valves_Specs/spec_sheet.jpg 1000w'), 2)
+        self.assertIn('src="/media/valves/FV-1/Valves_Specs/_thumbs/spec_sheet_640.jpg"', html)
+
+        shutil.rmtree(os.path.join(self.media_root, 'valves', 'FV-1', 'Valves_Specs', '_thumbs'))
+        call_command('generate_thumbnails', workers=1, stdout=io.StringIO())
+        self.assertEqual(len(self.thumbs()), 4)
+
+    def test_upload_does_not_wait_for_thumbnails(self):
+        """Test that committing an upload only queues the resize on a background thread"""
+        threads = []
+
+        def record_thread(media_root, name):
+            threads.append((threading.current_thread(), name))
+            return 0
+
+        with mock.patch('valves.thumbnails.background', ThreadPoolExecutor(1)) as background, \
+                mock.patch('valves.thumbnails.make_thumbnails', side_effect=record_thread):
+            with self.captureOnCommitCallbacks(execute=True):
+                ValveImage.objects.create(valve=self.valve, image=self.jpeg(1000, 500))
+            background.shutdown(wait=True)
+        [(thread, name)] = threads
+        self.assertIsNot(thread, threading.current_thread())
+        self.assertEqual(name, 'valves/FV-1/Valves_Specs/spec_sheet.jpg')
+
+    def test_original_width_follows_exif_orientation(self):
+        """Test that a photo turned by its EXIF orientation is listed at its displayed width"""
+        image = ValveImage.objects.create(valve=self.valve, image=self.jpeg(1000, 500))
+        self.assertEqual(original_width(image.image), 1000)
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6
+        with Image.open(image.image.path) as original:
+            original.save(image.image.path, 'JPEG', exif=exif)
+        self.assertEqual(original_width(image.image), 500)
+
+
+class ImageLinkerTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        for i in range(1, 21):
+            Valve.objects.create(tag_number="FV-%d" % i, name="Valve %d" % i, location="Unit 1")
+            self.touch('AFC I/Valves_Specs/FV-%d/page_1.jpg' % i)
+        self.touch('AFC I/P&ID/FV-1/drawing.png')
+        self.touch('AFC I/P&ID/XV-9/drawing.png')
+        self.touch('AFC I/Valves_Specs/FV-1/_thumbs/page_1_320.jpg')
+        self.touch('AFC I/Other/FV-1/notes.jpg')
+
+    def touch(self, relative_path):
+        path = os.path.join(self.media_root, *relative_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_links_are_diffed_in_a_constant_number_of_queries(self):
+        """Test that new files are linked, existing links kept and missing files unlinked only when pruning"""
+        kept = ValveImage.objects.create(valve=Valve.objects.get(tag_number="FV-2"), image='AFC I/Valves_Specs/FV-2/page_1.jpg')
+        ValveImage.objects.create(valve=Valve.objects.get(tag_number="FV-3"), image='AFC I/Valves_Specs/FV-3/gone.jpg')
+
+        dry_run = ImageLinker(folder_layout_rule, media_root=self.media_root, dry_run=True, prune=True).run()
+        self.assertEqual((dry_run['created'], dry_run['deleted']), (20, 1))
+        self.assertEqual(ValveImage.objects.count(), 2)
+
+        linker = ImageLinker(folder_layout_rule, media_root=self.media_root, prune=True)
+        # valves, links, savepoint, insert, select + delete of the stale link, release
+        with self.assertNumQueries(7):
+            summary = linker.run()
+        self.assertEqual(summary, {'images': 23, 'created': 20, 'already_linked': 1, 'unmatched': 1, 'deleted': 1})
+        self.assertEqual(linker.unknown_tags, {'XV-9'})
+        self.assertTrue(ValveImage.objects.filter(pk=kept.pk).exists())
+        self.assertEqual(ValveImage.objects.get(image='AFC I/P&ID/FV-1/drawing.png').category, 'P&ID')
+
+        os.remove(os.path.join(self.media_root, 'AFC I', 'Valves_Specs', 'FV-4', 'page_1.jpg'))
+        summary = ImageLinker(folder_layout_rule, media_root=self.media_root).run()
+        self.assertEqual((summary['created'], summary['deleted']), (0, 0))
+        self.assertEqual(ValveImage.objects.count(), 21)
+
+    def test_commands_only_unlink_with_prune_and_never_an_empty_media_root(self):
+        ValveImage.objects.create(valve=Valve.objects.get(tag_number="FV-3"), image='AFC I/Valves_Specs/FV-3/gone.jpg')
+        empty_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, empty_root)
+        with override_settings(MEDIA_ROOT=empty_root):
+            call_command('relink_existing_valve_images', '--no-input', stdout=io.StringIO())
+            self.assertEqual(ValveImage.objects.count(), 1)
+            with self.assertRaises(CommandError):
+                call_command('relink_existing_valve_images', '--prune', '--no-input', stdout=io.StringIO())
+        self.assertEqual(ValveImage.objects.count(), 1)
+
+        with override_settings(MEDIA_ROOT=self.media_root):
+            call_command('relink_existing_valve_images', '--prune', '--no-input', stdout=io.StringIO())
+        self.assertFalse(ValveImage.objects.filter(image='AFC I/Valves_Specs/FV-3/gone.jpg').exists())
+
+class ProtectedMediaTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        os.makedirs(os.path.join(self.media_root, 'AFC I', 'P&ID'))
+        with open(os.path.join(self.media_root, 'AFC I', 'P&ID', 'FV-1.pdf'), 'wb') as f:
+            f.write(b'%PDF')
+
+    def test_media_requires_login_and_is_sent_by_nginx(self):
+        """Test that media needs a login and is handed to nginx through X-Accel-Redirect"""
+        url = '/media/AFC%20I/P%26ID/FV-1.pdf'
+        with override_settings(MEDIA_ROOT=self.media_root, MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/'):
+            self.assertEqual(self.client.get(url).status_code, 302)
+
+            self.client.force_login(User.objects.create_user("engineer", password="secret"))
+            response = self.client.get(url)
+            self.assertEqual(response['X-Accel-Redirect'], '/protected-media/AFC%20I/P%26ID/FV-1.pdf')
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+            self.assertEqual(response.content, b'')
+            self.assertEqual(self.client.get('/media/.uploads/x.part').status_code, 404)
+
+        with override_settings(MEDIA_ROOT=self.media_root, MEDIA_ACCEL_REDIRECT_PREFIX=''):
+            response = self.client.get(url)
+            self.assertEqual(b''.join(response.streaming_content), b'%PDF')
+
+class MediaBlobTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 20), 'gray').save(buffer, 'JPEG')
+        self.content = buffer.getvalue()
+        self.paths = ['AFC I/Valves_Specs/FV-1/spec.jpg', 'AFC II/Valves_Specs/FV-2/spec.jpg']
+        for i, relative_path in enumerate(self.paths, start=1):
+            path = os.path.join(self.media_root, *relative_path.split('/'))
+            os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(self.content)
+            valve = Valve.objects.create(tag_number="FV-%d" % i, name="Valve", location="Unit 1")
+            ValveImage.objects.create(valve=valve, image=relative_path)
+
+    def test_duplicates_share_one_refcounted_blob(self):
+        """Test that identical files become hard links of one blob that goes with its last reference"""
+        self.assertEqual(deduplicate(dry_run=True)['bytes_saved'], len(self.content))
+        summary = deduplicate()
+        self.assertEqual((summary['files'], summary['blobs'], summary['linked']), (2, 1, 2))
+
+        sha256 = hashlib.sha256(self.content).hexdigest()
+        blob = MediaBlob.objects.get()
+        self.assertEqual((blob.sha256, blob.ref_count), (sha256, 2))
+        first, second = (os.path.join(self.media_root, *path.split('/')) for path in self.paths)
+        self.assertTrue(os.path.samefile(first, second))
+        self.assertTrue(os.path.samefile(first, blob_path(sha256)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ValveImage.objects.get(image=self.paths[0]).delete()
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            ValveImage.objects.all().delete()
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertFalse(os.path.exists(blob_path(sha256)))
+
+    def test_releasing_twice_never_goes_below_zero(self):
+        """Test that releasing a blob with no references left neither fails nor goes negative"""
+        sha256 = "a" * 64
+        MediaBlob.objects.create(sha256=sha256, size=1, ref_count=0)
+        _release(sha256)
+        _release(sha256)
+        self.assertFalse(MediaBlob.objects.exists())
+
+@override_settings(CACHES=LOCAL_CACHE)
+class TagAutocompleteTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.north = Factory.objects.create(name="North")
+        self.south = Factory.objects.create(name="South")
+        for tag, factory in [("FV-1001", self.north), ("FV-1002", self.south), ("XV-2100", self.north),
+                             ("HV-3100A", self.south), ("FV-10", None)]:
+            Valve.objects.create(tag_number=tag, name="Valve", location="Unit 1", factory=factory)
+
+    def test_prefix_matches_rank_before_substring_matches(self):
+        """Test that tags starting with the term come first and hyphens or case do not matter"""
+        autocomplete_tags("fv")
+        with self.assertNumQueries(0):
+            self.assertEqual(autocomplete_tags("fv 10"), ["FV-10", "FV-1001", "FV-1002"])
+            self.assertEqual(autocomplete_tags("10"), ["FV-10", "FV-1001", "FV-1002", "HV-3100A", "XV-2100"])
+            self.assertEqual(autocomplete_tags("10", factory_id=self.north.pk), ["FV-1001", "XV-2100"])
+            self.assertEqual(autocomplete_tags("10", limit=2), ["FV-10", "FV-1001"])
+            self.assertEqual(autocomplete_tags("-"), [])
+
+    def test_index_follows_valve_writes(self):
+        """Test that renamed and deleted valves and factories reach the index after commit"""
+        self.assertEqual(autocomplete_tags("XV"), ["XV-2100"])
+        with self.captureOnCommitCallbacks(execute=True):
+            Valve.objects.filter(tag_number="XV-2100").get().delete()
+            valve = Valve.objects.get(tag_number="FV-10")
+            valve.tag_number = "XV-0010"
+            valve.save()
+        self.assertEqual(autocomplete_tags("XV"), ["XV-0010"])
+
+        south_id = self.south.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.south.delete()
+        self.assertEqual(autocomplete_tags("FV", factory_id=south_id), [])
+
+    def test_view_returns_bounded_json_list(self):
+        self.client.force_login(User.objects.create_user("engineer", password="secret"))
+        url = reverse('valves:valve-tag-autocomplete')
+        response = self.client.get(url, {'term': 'fv', 'limit': '1'})
+        self.assertEqual(response.json(), ["FV-10"])
+        self.assertEqual(self.client.get(url, {'term': 'fv', 'factory': 'north'}).status_code, 400)
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class FactoryValvesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user("engineer", password="secret"))
+        self.factory = Factory.objects.create(name="North")
+        for i in range(3):
+            Valve.objects.create(tag_number="FV-%03d" % i, name="Valve", location="Unit 1", factory=self.factory)
+        self.url = reverse('valves:get-valves-by-factory')
+
+    def test_full_list_is_cached_compressed_and_revalidated(self):
+        """Test that the full list comes gzipped from the cache and unchanged lists answer 304"""
+        response = self.client.get(self.url, {'factory': self.factory.pk}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        valves = json.loads(gzip.decompress(response.content))
+        self.assertEqual([valve['tag_number'] for valve in valves], ["FV-000", "FV-001", "FV-002"])
+
+        etag = response['ETag']
+        with self.assertNumQueries(2):  # session and user only
+            response = self.client.get(
+                self.url, {'factory': self.factory.pk}, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Valve.objects.create(tag_number="FV-003", name="Valve", location="Unit 1", factory=self.factory)
+        response = self.client.get(self.url, {'factory': self.factory.pk}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 4)
+
+    def test_each_encoding_has_its_own_etag(self):
+        """Test that a gzip ETag never validates the uncompressed body, and the other way round"""
+        gzipped = self.client.get(self.url, {'factory': self.factory.pk}, HTTP_ACCEPT_ENCODING='gzip')
+        plain = self.client.get(self.url, {'factory': self.factory.pk})
+        self.assertTrue(gzipped['ETag'].endswith('-gzip"'))
+        self.assertNotEqual(gzipped['ETag'], plain['ETag'])
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        response = self.client.get(self.url, {'factory': self.factory.pk}, HTTP_IF_NONE_MATCH=gzipped['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(len(response.json()), 3)
+        response = self.client.get(
+            self.url, {'factory': self.factory.pk}, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=plain['ETag']
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @unittest.skipUnless(importlib.util.find_spec('brotli'), "brotli is not installed")
+    def test_brotli_is_preferred_when_installed(self):
+        import brotli
+        response = self.client.get(self.url, {'factory': self.factory.pk}, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertTrue(response['ETag'].endswith('-br"'))
+        self.assertEqual(len(json.loads(brotli.decompress(response.content))), 3)
+
+    def test_search_is_paged(self):
+        response = self.client.get(self.url, {'factory': self.factory.pk, 'q': 'fv-00', 'limit': 2, 'offset': 1})
+        self.assertEqual([valve['tag_number'] for valve in response.json()], ["FV-001", "FV-002"])
+        self.assertEqual(self.client.get(self.url, {'factory': 'north'}).status_code, 400)
+
+
+class ShutdownValvePickerTest(TestCase):
+    def setUp(self):
+        self.north = Factory.objects.create(name="North")
+        self.south = Factory.objects.create(name="South")
+        self.north_valves = [
+            Valve.objects.create(tag_number="FV-%03d" % i, name="Valve", location="Unit 1", factory=self.north)
+            for i in range(20)
+        ]
+        self.south_valve = Valve.objects.create(tag_number="XV-001", name="Valve", location="Unit 2", factory=self.south)
+
+    def _data(self, valves):
+        return {
+            'name': "North turnaround", 'factory': self.north.pk, 'start_date': '2026-01-01', 'end_date': '2026-01-10',
+            'valves': [valve.pk for valve in valves],
+        }
+
+    def test_only_selected_valves_are_rendered(self):
+        """Test that the picker renders the chosen valves, not every valve of the factory"""
+        form = ShutdownReportForm(data=self._data(self.north_valves[:2]))
+        html = str(form['valves'])
+        self.assertEqual(html.count('<option'), 2)
+        self.assertIn('data-valve-picker="%s"' % reverse('valves:get-valves-by-factory'), html)
+        self.assertIn('js/valve_picker.js', str(form.media))
+
+    def test_submitted_valves_are_checked_in_one_query(self):
+        """Test that valve ids are validated with one query scoped to the chosen factory"""
+        form = ShutdownReportForm(data=self._data(self.north_valves[:5]))
+        with self.assertNumQueries(3):  # the factory, the valves, then the model validation of the factory
+            self.assertTrue(form.is_valid())
+        self.assertEqual(len(form.cleaned_data['valves']), 5)
+
+        form = ShutdownReportForm(data=self._data([self.north_valves[0], self.south_valve]))
+        self.assertFalse(form.is_valid())
+        self.assertIn('valves', form.errors)
+
+    def test_shutdown_page_renders_the_picker_and_saves_the_picked_valves(self):
+        """Test that the new shutdown page renders the picker and its script, and saves the picked valves"""
+        self.client.force_login(User.objects.create_user(username="planner", password="x"))
+        url = reverse('valves:shutdown-create')
+        response = self.client.get(url)
+        self.assertContains(response, 'data-valve-picker="%s"' % reverse('valves:get-valves-by-factory'))
+        self.assertContains(response, 'data-factory-input="factory"')
+        self.assertContains(response, 'js/valve_picker.js')
+        self.assertContains(response, 'name="factory"')
+        self.assertNotContains(response, "FV-000")
+
+        response = self.client.post(url, self._data(self.north_valves[:3]))
+        shutdown = Shutdown.objects.get()
+        self.assertRedirects(response, reverse('valves:shutdown-report-print', kwargs={'pk': shutdown.pk}))
+        self.assertEqual(set(shutdown.valves.all()), set(self.north_valves[:3]))
+
+        response = self.client.post(url, self._data([self.south_valve]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'data-valve-picker')
+        self.assertEqual(Shutdown.objects.count(), 1)
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class BulkMaintenanceTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user("engineer", password="secret"))
+        self.valves = [
+            Valve.objects.create(tag_number="FV-%03d" % i, name="Valve", location="Unit 1") for i in range(3)
+        ]
+        Technician.objects.create(name="Ali")
+
+    def _row(self, tag, technician="Ali"):
+        return {
+            'valve_tag_number': tag, 'technician_name': technician, 'maintenance_date': '2026-03-01',
+            'maintenance_activities': ['Gland tightening', 'Adding packing'],
+        }
+
+    def test_api_creates_all_rows_with_fixed_query_count(self):
+        """Test that tags, technicians and activities are resolved once each and the rows inserted together"""
+        rows = [self._row("FV-000"), self._row("FV-001", "Omar"), self._row("FV-002", "Omar")]
+        url = reverse('valves:maintenance-history-bulk-api')
+        # Session, user, valves, technicians, activities, the three inserts and their savepoint,
+        # then the activities of the response
+        with self.assertNumQueries(11):
+            response = self.client.post(url, rows, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(MaintenanceHistory.objects.count(), 3)
+        self.assertEqual(Technician.objects.filter(name="Omar").count(), 1)
+        record = MaintenanceHistory.objects.get(valve=self.valves[1])
+        self.assertEqual(record.technician.name, "Omar")
+        self.assertEqual(record.maintenance_activities, "Gland tightening,Adding packing")
+
+    def test_errors_are_reported_per_row_and_nothing_is_saved(self):
+        url = reverse('valves:maintenance-history-bulk-api')
+        response = self.client.post(url, [self._row("FV-000"), self._row("NOPE-1")], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0], {})
+        self.assertIn('valve_tag_number', response.json()['errors'][1])
+        self.assertFalse(MaintenanceHistory.objects.exists())
+
+    def test_grid_saves_filled_rows_and_skips_empty_ones(self):
+        data = {'form-TOTAL_FORMS': '3', 'form-INITIAL_FORMS': '0', 'form-MAX_NUM_FORMS': '200'}
+        for index, tag in enumerate(["FV-000", "FV-001"]):
+            for field, value in self._row(tag).items():
+                data['form-%d-%s' % (index, field)] = value
+            data['form-%d-is_active' % index] = 'on'
+        data['form-2-is_active'] = 'on'
+        self.assertContains(self.client.get(reverse('valves:maintenance-bulk-frontend')), 'name="form-9-valve_tag_number"')
+        response = self.client.post(reverse('valves:maintenance-bulk-frontend'), data)
+        self.assertRedirects(response, reverse('valves:maintenance-history-frontend'), fetch_redirect_response=False)
+        self.assertEqual(MaintenanceHistory.objects.count(), 2)
+
+
+class MaintenanceActivityTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user("engineer", password="secret"))
+        self.valve = Valve.objects.create(tag_number="FV-001", name="Valve", location="Unit 1")
+
+    def _record(self, activities):
+        form = MaintenanceHistoryForm(data={
+            'valve_tag_number': "FV-001", 'technician_name': "Ali", 'maintenance_date': '2026-03-01',
+            'maintenance_activities': activities,
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+        return form.save()
+
+    def test_form_links_activities_and_keeps_the_label(self):
+        record = self._record(['Replacing packing', 'On site'])
+        self.assertEqual(sorted(record.activities.values_list('name', flat=True)), ['On site', 'Replacing packing'])
+        self.assertEqual(MaintenanceHistory.objects.get().maintenance_activities, 'On site,Replacing packing')
+
+        record.activities.remove(MaintenanceActivity.objects.get(name='On site'))
+        self.assertEqual(MaintenanceHistory.objects.get().maintenance_activities, 'Replacing packing')
+
+    def test_list_filters_by_activity_and_counts_in_one_query(self):
+        """Test that the list and the API filter on activities and count them with one grouped query"""
+        self._record(['Replacing packing', 'On site'])
+        self._record(['Replacing packing'])
+        self._record(['Gland tightening'])
+
+        records = MaintenanceHistory.objects.all()
+        with self.assertNumQueries(1):
+            counts = activity_counts(records)
+        self.assertEqual(counts, [('Replacing packing', 2), ('Gland tightening', 1), ('On site', 1)])
+
+        response = self.client.get(reverse('valves:maintenance-history-frontend'), {'activity': 'Replacing packing'})
+        self.assertEqual(len(response.context['maintenance_records']), 2)
+        self.assertEqual(response.context['activity_counts'], [('Replacing packing', 2), ('On site', 1)])
+
+        response = self.client.get(
+            reverse('valves:maintenance-history-list-api'), {'activity': ['Replacing packing', 'On site']}
+        )
+        self.assertEqual([record['activities'] for record in response.json()], [['On site', 'Replacing packing']])
+
+    def test_migration_links_existing_strings(self):
+        record = MaintenanceHistory.objects.create(
+            valve=self.valve, maintenance_date=datetime.date(2025, 5, 1),
+            maintenance_activities='Adding packing, Hydro test,Adding packing',
+        )
+        migration = importlib.import_module('valves.migrations.0011_maintenance_activities')
+        migration.link_existing_activities(django_apps, None)
+        self.assertEqual(
+            sorted(record.activities.values_list('name', flat=True)), ['Adding packing', 'Hydro test']
+        )
+
+    def test_migration_truncates_over_long_activities(self):
+        """Test that a legacy entry longer than an activity name is cut to fit and logged, not fatal"""
+        note = "Removed the actuator and found the stem bent " + "x" * 120
+        record = MaintenanceHistory.objects.create(
+            valve=self.valve, maintenance_date=datetime.date(2025, 5, 1),
+            maintenance_activities='On site,' + note,
+        )
+        migration = importlib.import_module('valves.migrations.0011_maintenance_activities')
+        with self.assertLogs(migration.logger, 'WARNING') as logs:
+            migration.link_existing_activities(django_apps, None)
+        self.assertEqual(len(logs.output), 1)
+        self.assertEqual(sorted(record.activities.values_list('name', flat=True)), ['On site', note[:100]])
+
+
+def load_extraction_script():
+    path = os.path.join(settings.BASE_DIR, 'scripts', 'extract_data_from_images.py')
+    spec = importlib.util.spec_from_file_location('extract_data_from_images', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@unittest.skipUnless(importlib.util.find_spec('pytesseract'), "pytesseract is not installed")
+class SpecSheetExtractionTest(TestCase):
+    """
+    scripts/extract_data_from_images.py with tesseract mocked. OCR runs in threads instead of
+    processes, so the mock reaches it.
+    """
+    TAGS = ["FV-101", "FV-102", "FV-103", "FV-104"]
+
+    def setUp(self):
+        self.script = load_extraction_script()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.cache_dir = os.path.join(self.root, '.ocr_cache')
+        self.checkpoint = os.path.join(self.root, 'checkpoint.json')
+        self.output = os.path.join(self.root, 'out.csv')
+        # Each sheet is one flat grey, so the mocked OCR can tell them apart
+        self.shades = {}
+        for index, tag in enumerate(self.TAGS):
+            self.shades[tag] = 40 + 40 * index
+            self.write_sheet(tag, self.shades[tag])
+        self.settings = self.script.OCRSettings(max_width=None, binarize=False, deskew=False)
+        patcher = mock.patch.object(self.script, 'ProcessPoolExecutor', ThreadPoolExecutor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_sheet(self, tag, shade):
+        specs_dir = os.path.join(self.root, tag, 'Valves_Specs')
+        os.makedirs(specs_dir, exist_ok=True)
+        Image.new('L', (40, 20), shade).save(os.path.join(specs_dir, 'page_1.png'))
+
+    def fake_ocr(self, page, **kwargs):
+        return "Body Style: shade %d\n" % page.getpixel((0, 0))
+
+    def run_extraction(self, ocr_settings=None, workers=2):
+        with mock.patch('sys.stdout', new_callable=io.StringIO):
+            self.script.process_images(
+                self.root, self.output, workers=workers, cache_dir=self.cache_dir,
+                checkpoint_path=self.checkpoint, settings=ocr_settings or self.settings,
+            )
+        with open(self.output, newline='', encoding='utf-8') as f:
+            return list(csv.DictReader(f))
+
+    def test_cache_hits_by_content_and_misses_when_settings_change(self):
+        """Test that unchanged images are never OCR'd twice, even renamed, until the settings change"""
+        with mock.patch.object(self.script.pytesseract, 'image_to_string', side_effect=self.fake_ocr) as ocr:
+            rows = self.run_extraction()
+            self.assertEqual(ocr.call_count, 4)
+
+            os.remove(self.checkpoint)
+            # Same content under a new tag: found in the cache by its digest
+            self.write_sheet("FV-105", self.shades["FV-101"])
+            rows = self.run_extraction()
+            self.assertEqual(ocr.call_count, 4)
+            self.assertEqual(rows[-1]['Body Style'], "shade 40")
+
+            rows = self.run_extraction(self.script.OCRSettings(max_width=20, binarize=False, deskew=False))
+            self.assertEqual(ocr.call_count, 9)
+        self.assertEqual(len(rows), 5)
+
+    def test_run_resumes_from_the_checkpoint(self):
+        """Test that a second run only hashes and OCRs what the interrupted first run did not finish"""
+        def fail_on_one_sheet(page, **kwargs):
+            if page.getpixel((0, 0)) == self.shades["FV-103"]:
+                raise RuntimeError("tesseract was killed")
+            return self.fake_ocr(page)
+
+        with mock.patch.object(self.script.pytesseract, 'image_to_string', side_effect=fail_on_one_sheet):
+            rows = self.run_extraction()
+        self.assertEqual([row['tag_number'] for row in rows], ["FV-101", "FV-102", "FV-104"])
+        with open(self.checkpoint, encoding='utf-8') as f:
+            self.assertEqual(len(json.load(f)), 3)
+
+        file_digest = self.script.file_digest
+        with mock.patch.object(self.script.pytesseract, 'image_to_string', side_effect=self.fake_ocr) as ocr, \
+                mock.patch.object(self.script, 'file_digest', side_effect=file_digest) as digest:
+            rows = self.run_extraction()
+        self.assertEqual(ocr.call_count, 1)
+        self.assertEqual(digest.call_count, 1)
+        self.assertEqual([row['tag_number'] for row in rows], self.TAGS)
+
+    def test_output_order_does_not_depend_on_the_pool(self):
+        """Test that rows are written by tag whatever order the workers finish in"""
+        def slower_for_earlier_tags(page, **kwargs):
+            # The first tag finishes last
+            time.sleep((200 - page.getpixel((0, 0))) / 2000)
+            return self.fake_ocr(page)
+
+        with mock.patch.object(self.script.pytesseract, 'image_to_string', side_effect=slower_for_earlier_tags):
+            parallel = self.run_extraction(workers=4)
+        shutil.rmtree(self.cache_dir)
+        os.remove(self.checkpoint)
+        with mock.patch.object(self.script.pytesseract, 'image_to_string', side_effect=self.fake_ocr):
+            serial = self.run_extraction(workers=1)
+
+        self.assertEqual([row['tag_number'] for row in parallel], self.TAGS)
+        self.assertEqual(parallel, serial)
+
+
+@unittest.skipUnless(importlib.util.find_spec('pytesseract'), "pytesseract is not installed")
+class SpecSheetPreprocessingTest(TestCase):
+    def setUp(self):
+        self.script = load_extraction_script()
+
+    def lined_page(self):
+        """A white page with horizontal black text lines."""
+        page = Image.new('L', (400, 300), 255)
+        draw = ImageDraw.Draw(page)
+        for top in range(40, 260, 20):
+            draw.rectangle((40, top, 360, top + 4), fill=0)
+        return page
+
+    def test_otsu_threshold_splits_ink_from_paper(self):
+        """Test that the threshold falls between the ink and paper shades and binarizes the page"""
+        page = Image.new('L', (100, 100), 200)
+        ImageDraw.Draw(page).rectangle((0, 0, 29, 99), fill=60)
+        threshold = self.script.otsu_threshold(page)
+        self.assertTrue(60 <= threshold < 200, threshold)
+
+        settings = self.script.OCRSettings(max_width=None, deskew=False)
+        binary = self.script.preprocess(page, settings)
+        self.assertEqual(sorted(set(binary.getdata())), [0, 255])
+        self.assertEqual((binary.getpixel((10, 50)), binary.getpixel((80, 50))), (0, 255))
+
+    def test_deskew_undoes_the_rotation_of_a_scan(self):
+        """Test that a page rotated by 3 degrees is turned back and comes out straight and downscaled"""
+        skewed = self.lined_page().rotate(3, resample=Image.BILINEAR, fillcolor=255)
+        skewed = skewed.point(lambda value: 255 if value > 127 else 0)
+        self.assertAlmostEqual(self.script.estimate_skew(skewed), -3.0, delta=self.script.DESKEW_STEP)
+        self.assertEqual(self.script.estimate_skew(self.lined_page()), 0.0)
+
+        page = self.script.preprocess(skewed, self.script.OCRSettings(max_width=200))
+        self.assertEqual(page.size, (200, 150))
+        self.assertEqual(self.script.estimate_skew(page), 0.0)
+
+    def test_regions_are_cropped_and_parsed_per_field(self):
+        """Test that each region is OCR'd on its own crop and read with or without its label"""
+        regions = {'Body Style': [0.0, 0.0, 0.5, 0.5], 'Bench Range': [0.25, 0.5, 0.75, 1.0]}
+        settings = self.script.OCRSettings(regions=regions, max_width=None, binarize=False, deskew=False)
+        path = os.path.join(tempfile.mkdtemp(), 'page.png')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        Image.new('L', (200, 100), 255).save(path)
+
+        sizes = []
+
+        def fake_ocr(crop, config):
+            sizes.append((crop.size, config))
+            return "Body Style: Globe\n" if len(sizes) == 1 else " 0.2 - 1.0\nbar "
+
+        with mock.patch.object(self.script.pytesseract, 'image_to_string', side_effect=fake_ocr):
+            text = self.script.ocr_image(path, settings)
+        self.assertEqual(sizes, [((100, 50), '--psm 6'), ((100, 50), '--psm 6')])
+
+        row = self.script.parse_fields("FV-1", text, settings)
+        self.assertEqual(row['Body Style'], "Globe")
+        self.assertEqual(row['Bench Range'], "0.2 - 1.0 bar")
+        self.assertEqual(row['Power Failure Pos.'], "")
+
+    def test_benchmark_scores_fields_against_the_reference(self):
+        """Test that found, expected and agreeing values are counted per field against a reference CSV"""
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        for tag, shade in [("FV-1", 40), ("FV-2", 80)]:
+            os.makedirs(os.path.join(root, tag, 'Valves_Specs'))
+            Image.new('L', (40, 20), shade).save(os.path.join(root, tag, 'Valves_Specs', 'page_1.png'))
+        reference_csv = os.path.join(root, 'reference.csv')
+        with open(reference_csv, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=self.script.HEADERS, restval='')
+            writer.writeheader()
+            writer.writerow({'tag_number': "FV-1", 'Body Style': "globe", 'Bench Range': "0.2-1.0  bar",
+                             'Manufacturer / Model': "Fisher"})
+            writer.writerow({'tag_number': "FV-2", 'Body Style': "Butterfly"})
+
+        ocr_text = {40: "Body Style: Globe\nBench Range: 0.2-1.0 BAR\n", 80: "Body Style: Ball\n"}
+        settings = self.script.OCRSettings(max_width=None, binarize=False, deskew=False)
+        reference = self.script.load_reference(reference_csv)
+        images = list(self.script.find_spec_images(root))
+        with mock.patch.object(self.script, 'ProcessPoolExecutor', ThreadPoolExecutor), \
+                mock.patch.object(self.script.pytesseract, 'image_to_string',
+                                  side_effect=lambda page, **kwargs: ocr_text[page.getpixel((0, 0))]):
+            rows, seconds = self.script.run_benchmark(images, settings, workers=2)
+
+        scores = self.script.score_fields(rows, images, reference)
+        self.assertEqual(scores['Body Style'], (2, 2, 1))
+        self.assertEqual(scores['Bench Range'], (1, 1, 1))
+        self.assertEqual(scores['Manufacturer / Model'], (0, 1, 0))
+        self.assertEqual(scores['Power Failure Pos.'], (0, 0, 0))
@@ -0,0 +1,138 @@
+"""
+Resized copies of uploaded images, so pages can serve a thumbnail instead of the full scan.
+
+For an image stored as `<dir>/<stem>.<ext>`, a WebP and a JPEG copy are written at each width in
+THUMBNAIL_WIDTHS that is smaller than the original, as `<dir>/_thumbs/<stem>_<width>.webp|.jpg`.
+Copies are regenerated only when they are older than the original, so generate_thumbnails() can
+be called on every save and by the backfill command alike.
+
+Uploads hand the work to a small thread pool (generate_thumbnails_in_background) so the response
+does not wait for the resize. Until the copies exist pages serve the original; copies lost when a
+worker restarts mid-resize are written by the generate_thumbnails command.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import ExifTags, Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_WIDTHS = (320, 640, 1280)
+THUMBS_DIR = '_thumbs'
+BACKGROUND_THREADS = 2
+
+# EXIF orientations that turn the image by 90 degrees, swapping its width and height
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+background = ThreadPoolExecutor(max_workers=BACKGROUND_THREADS, thread_name_prefix='thumbnails')
+
+# (format, extension, mime type, save options), best first
+THUMBNAIL_FORMATS = [
+    ('WEBP', 'webp', 'image/webp', {'quality': 80, 'method': 4}),
+    ('JPEG', 'jpg', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+]
+if not features.check('webp'):
+    THUMBNAIL_FORMATS = THUMBNAIL_FORMATS[1:]
+
+
+def thumbnail_name(name, width, extension):
+    """Storage name of the `width` pixel copy of the image stored as `name`."""
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, THUMBS_DIR, f'{stem}_{width}.{extension}').replace('\\', '/')
+
+
+def _is_current(path, source_mtime):
+    try:
+        return os.stat(path).st_mtime >= source_mtime
+    except FileNotFoundError:
+        return False
+
+
+def make_thumbnails(media_root, name, force=False):
+    """
+    Writes the missing or outdated copies of one image and returns how many were written.
+    Only touches the filesystem, so it can run in a worker process.
+    """
+    source = os.path.join(media_root, name)
+    try:
+        source_mtime = os.stat(source).st_mtime
+    except FileNotFoundError:
+        return 0
+    targets = [
+        (width, fmt, os.path.join(media_root, thumbnail_name(name, width, extension)), options)
+        for width in THUMBNAIL_WIDTHS
+        for fmt, extension, _, options in THUMBNAIL_FORMATS
+    ]
+    if not force and all(_is_current(path, source_mtime) for _, _, path, _ in targets):
+        return 0
+
+    written = 0
+    try:
+        with Image.open(source) as original:
+            # Let the JPEG decoder scale down while decoding, keeping both sides at least the largest
+            # width (the image may still be rotated by its EXIF orientation); much cheaper than a full decode
+            original.draft('RGB', (max(THUMBNAIL_WIDTHS), max(THUMBNAIL_WIDTHS)))
+            image = ImageOps.exif_transpose(original).convert('RGB')
+            for width, fmt, path, options in targets:
+                # Never enlarge; the original itself is the largest size
+                if width > image.width or (not force and _is_current(path, source_mtime)):
+                    continue
+                height = max(1, round(image.height * width / image.width))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                image.resize((width, height), Image.LANCZOS, reducing_gap=3.0).save(path, fmt, **options)
+                written += 1
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning("Could not create thumbnails for %s: %s", name, e)
+    return written
+
+
+def generate_thumbnails(field_file, force=False):
+    """Creates the thumbnails of an ImageField's file, if it has one."""
+    if not field_file:
+        return 0
+    return make_thumbnails(settings.MEDIA_ROOT, field_file.name, force=force)
+
+
+def generate_thumbnails_in_background(field_file):
+    """Queues the thumbnails of an ImageField's file on the background threads; returns the future."""
+    if not field_file:
+        return None
+    # Both are read now: the settings may differ by the time a thread picks the job up
+    return background.submit(make_thumbnails, str(settings.MEDIA_ROOT), field_file.name)
+
+
+def original_width(field_file):
+    """
+    Width of the original as browsers display it, after its EXIF orientation. Reads only the
+    header; None when the file cannot be read.
+    """
+    try:
+        with Image.open(os.path.join(settings.MEDIA_ROOT, field_file.name)) as image:
+            width, height = image.size
+            if image.getexif().get(ExifTags.Base.Orientation) in TRANSPOSED_ORIENTATIONS:
+                return height
+            return width
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def thumbnail_sources(field_file):
+    """
+    Returns [(mime type, [(url, width), ...]), ...] for the thumbnails of `field_file` that exist,
+    best format first; empty when none have been generated (e.g. the original is already small).
+    """
+    if not field_file:
+        return []
+    sources = []
+    for _, extension, mime_type, _ in THUMBNAIL_FORMATS:
+        candidates = []
+        for width in THUMBNAIL_WIDTHS:
+            name = thumbnail_name(field_file.name, width, extension)
+            if os.path.exists(os.path.join(settings.MEDIA_ROOT, name)):
+                candidates.append((default_storage.url(name), width))
+        if candidates:
+            sources.append((mime_type, candidates))
+    return sources
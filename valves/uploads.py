@@ -0,0 +1,158 @@
+"""
+Chunked, resumable uploads.
+
+A client starts an upload with the file's name and size, then PUTs the file in chunks, each
+tagged with the offset it starts at and optionally its SHA-256. Chunks are streamed straight into
+a temp file under MEDIA_ROOT/.uploads/; the upload's offset only advances once a whole chunk has
+been written and verified, so an interrupted transfer resumes from the last good chunk. A completed
+upload is then claimed by a form, which moves the temp file to its final name.
+"""
+import hashlib
+import os
+from datetime import timedelta
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from .documents import file_sha256
+from .models import ChunkedUpload
+
+# Chunk size suggested to clients; nginx buffers each chunk, so a slow client never holds a worker
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+MAX_UPLOAD_SIZE = 2 * 1024 * 1024 * 1024
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """A rejected chunk or upload request; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def upload_state(upload):
+    return {
+        'upload_id': str(upload.upload_id),
+        'offset': upload.offset,
+        'size': upload.size,
+        'chunk_size': DEFAULT_CHUNK_SIZE,
+        'complete': upload.completed_at is not None,
+    }
+
+
+def start_upload(user, filename, size, sha256=''):
+    filename = os.path.basename((filename or '').replace('\\', '/')).strip()
+    if not filename:
+        raise UploadError('A file name is required.')
+    if not isinstance(size, int) or size <= 0:
+        raise UploadError('The file size must be a positive number of bytes.')
+    if size > MAX_UPLOAD_SIZE:
+        raise UploadError('The file is too large.', status=413)
+    sha256 = (sha256 or '').lower()
+    if sha256 and len(sha256) != 64:
+        raise UploadError('Invalid SHA-256 checksum.')
+
+    upload = ChunkedUpload(user=user, filename=filename[:255], size=size, sha256=sha256)
+    os.makedirs(os.path.dirname(upload.temp_path), exist_ok=True)
+    open(upload.temp_path, 'xb').close()
+    upload.save()
+    return upload
+
+
+def _write_chunk(f, stream, length):
+    """Copies `length` bytes from `stream` to `f`; returns (bytes written, hex digest)."""
+    digest = hashlib.sha256()
+    written = 0
+    while written < length:
+        block = stream.read(min(READ_BLOCK_SIZE, length - written))
+        if not block:
+            break
+        f.write(block)
+        digest.update(block)
+        written += len(block)
+    return written, digest.hexdigest()
+
+
+def append_chunk(upload_id, offset, stream, length, chunk_sha256=None):
+    """
+    Appends `length` bytes read from `stream` at `offset` and returns the updated upload.
+
+    Raises UploadError with status 409 when `offset` is not where the upload stands, so the
+    client can resume from the offset the server reports.
+    """
+    with transaction.atomic():
+        upload = ChunkedUpload.objects.select_for_update().get(pk=upload_id)
+        if upload.completed_at is not None:
+            raise UploadError('The upload is already complete.', status=409)
+        if offset != upload.offset:
+            raise UploadError(f'Expected a chunk at offset {upload.offset}.', status=409)
+        if length <= 0 or length > MAX_CHUNK_SIZE or offset + length > upload.size:
+            raise UploadError('Invalid chunk length.')
+
+        with open(upload.temp_path, 'r+b') as f:
+            # Drop whatever an interrupted request left past the last verified chunk
+            f.seek(offset)
+            f.truncate()
+            try:
+                written, digest = _write_chunk(f, stream, length)
+            except OSError:
+                written, digest = None, None
+            if written != length:
+                f.truncate(offset)
+                raise UploadError('The chunk was not received completely.')
+            if chunk_sha256 and digest != chunk_sha256.lower():
+                f.truncate(offset)
+                raise UploadError('Chunk checksum mismatch.')
+            f.flush()
+            os.fsync(f.fileno())
+
+        upload.offset += length
+        mismatch = False
+        if upload.offset == upload.size:
+            if upload.sha256 and file_sha256(upload.temp_path) != upload.sha256:
+                # The chunks arrived intact but do not make up the announced file; start over
+                with open(upload.temp_path, 'r+b') as f:
+                    f.truncate(0)
+                upload.offset = 0
+                mismatch = True
+            else:
+                upload.completed_at = timezone.now()
+        upload.save(update_fields=['offset', 'completed_at'])
+    if mismatch:
+        raise UploadError('File checksum mismatch; the upload has been reset.', status=409)
+    return upload
+
+
+def claim_upload(upload, name):
+    """
+    Moves a completed upload to `name` under MEDIA_ROOT and deletes the upload record.
+    Like Storage.save(), a free name is chosen if `name` is taken; returns the name used.
+    """
+    name = default_storage.get_available_name(name)
+    while True:
+        target = default_storage.path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            # link() never replaces an existing file, so a concurrent upload cannot be overwritten
+            os.link(upload.temp_path, target)
+            break
+        except FileExistsError:
+            name = default_storage.get_available_name(name)
+    os.remove(upload.temp_path)
+    upload.delete()
+    return name
+
+
+def purge_stale_uploads(max_age=timedelta(days=2)):
+    """Deletes uploads (finished or not) that were started before `max_age` ago and never claimed."""
+    count = 0
+    for upload in ChunkedUpload.objects.filter(created_at__lt=timezone.now() - max_age):
+        try:
+            os.remove(upload.temp_path)
+        except FileNotFoundError:
+            pass
+        upload.delete()
+        count += 1
+    return count
@@ -15,11 +15,13 @@ urlpatterns = [
     path('valves-list/', views.valve_list_frontend, name='valve-list-frontend'),
     path('valves/create/', views.valve_create_frontend, name='valve-create-frontend'),
     path('valves/<int:pk>/', views.valve_detail_frontend, name='valve-detail-frontend'),
+    path('valves/<int:pk>/tabs/<slug:tab>/', views.valve_detail_tab, name='valve-detail-tab'),
     path('valves/<int:pk>/update/', views.valve_update_frontend, name='valve-update-frontend'),
     path('valves/<int:pk>/delete/', views.valve_delete_frontend, name='valve-delete-frontend'),
     
     path('maintenance-history/', views.maintenance_history_frontend, name='maintenance-history-frontend'),
     path('maintenance/create/', views.maintenance_form_frontend, name='maintenance-create-frontend'),
+    path('maintenance/bulk/', views.maintenance_bulk_frontend, name='maintenance-bulk-frontend'),
     path('maintenance/<int:pk>/update/', views.maintenance_form_frontend, name='maintenance-update-frontend'),
 
 
@@ -37,6 +39,7 @@ urlpatterns = [
     path('api/part-codes/', views.PartCodeList.as_view(), name='part-code-list-api'),
     path('api/part-codes/<int:pk>/', views.PartCodeDetail.as_view(), name='part-code-detail-api'),
     path('api/maintenance-history/', views.MaintenanceHistoryList.as_view(), name='maintenance-history-list-api'),
+    path('api/maintenance-history/bulk/', views.MaintenanceHistoryBulkCreate.as_view(), name='maintenance-history-bulk-api'),
     path('api/maintenance-history/<int:pk>/', views.MaintenanceHistoryDetail.as_view(), name='maintenance-history-detail-api'),
     path('api/maintenance-parts/', views.MaintenancePartList.as_view(), name='maintenance-part-list-api'),
     path('api/maintenance-parts/<int:pk>/', views.MaintenancePartDetail.as_view(), name='maintenance-part-detail-api'),
@@ -47,7 +50,10 @@ urlpatterns = [
     path('valves/<int:pk>/images/', views.valve_images_gallery_frontend, name='valve-images-gallery-frontend'),
 
     path('shutdown-report/', views.shutdown_report, name='shutdown-report'),
+    path('shutdown-report/new/', views.shutdown_create, name='shutdown-create'),
     path('shutdown-report/<int:pk>/print/', views.shutdown_report_print, name='shutdown-report-print'),
     path('part-codes/<int:pk>/delete/', views.part_code_delete_frontend, name='part-code-delete-frontend'),
     path('documents/', views.documents_page, name='documents-page'),
+    path('uploads/', views.upload_start, name='upload-start'),
+    path('uploads/<uuid:upload_id>/', views.upload_chunk, name='upload-chunk'),
 ]
\ No newline at end of file
@@ -1,21 +1,51 @@
 import csv
+import json
+import mimetypes
 import os
+from urllib.parse import quote
 from django.conf import settings # Add this import
 from django.contrib import messages # To show messages to the user
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.views import LoginView
-from rest_framework import generics
+from rest_framework import generics, status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend # Added
 from .models import (
     Valve, PartCode, MaintenanceHistory, MaintenancePart,
-    Factory, ValveStatus, Shutdown, ValveType, Manufacturer, Technician
+    Factory, ValveStatus, Shutdown, ValveType, Manufacturer, Technician, Document, ChunkedUpload
 )
-from .serializers import ValveSerializer, PartCodeSerializer, MaintenanceHistorySerializer, MaintenancePartSerializer
-from .forms import ShutdownReportForm, MaintenanceHistoryForm
-from django.core.paginator import Paginator
-from django.db.models import Q
+from .serializers import (
+    ValveSerializer, PartCodeSerializer, MaintenanceHistorySerializer, MaintenancePartSerializer, BulkMaintenanceRowSerializer
+)
+from .forms import ShutdownReportForm, MaintenanceHistoryForm, DocumentUploadForm, BulkMaintenanceFormSet
+from django.core.files.storage import default_storage
+from django.db.models import Count, Q, prefetch_related_objects
 from .filters import PartCodeFilter # Added
+from .caching import lookups_version, valve_versions
+from .activities import activity_counts, filter_by_activities
+from .autocomplete import DEFAULT_LIMIT, autocomplete_tags
+from .blobs import add_file
+from .bulk_maintenance import MAX_ROWS, create_maintenance_records
+from .dashboard import get_factory_dashboard
+from .documents import index_document
+from .exports import (
+    EXPORT_FORMATS, MAINTENANCE_EXPORT_HEADERS, PART_CODE_EXPORT_HEADERS, SHUTDOWN_EXPORT_HEADERS,
+    VALVE_EXPORT_HEADERS, export_response, maintenance_export_rows, part_code_export_rows,
+    shutdown_export_rows, valve_export_rows,
+)
+from .factory_valves import DEFAULT_SEARCH_LIMIT, factory_valves_payload, negotiate_encoding, search_factory_valves
+from .fragments import get_valve_fragments
+from .pagination import KeysetPaginator
+from .search import search_valves
+from .tabs import MAINTENANCE_ORDERING, TABS, render_tab
+from .uploads import UploadError, append_chunk, claim_upload, start_upload, upload_state
+from django.http import Http404, HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET, require_http_methods, require_POST
+from django.views.static import serve
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
 from django.template.defaultfilters import slugify
 
 class CustomLoginView(LoginView):
@@ -25,56 +55,27 @@ class CustomLoginView(LoginView):
 @login_required
 def valve_detail_frontend(request, pk):
     """
-    Display detailed information about a specific valve, including its maintenance history,
-    spare parts, and related documents.
+    Display detailed information about a specific valve. The valve summary comes from the
+    versioned fragment cache; maintenance history, spare parts and documents are fetched per
+    tab from valve_detail_tab when the tab is opened.
     """
-    valve = get_object_or_404(
-        Valve.objects.select_related(
-            'valve_type', 'status', 'manufacturer', 'factory'
-        ).prefetch_related(
-            'images',
-            'maintenance_records',
-            'part_codes'
-        ), 
-        pk=pk
-    )
-    
-    # Get maintenance records ordered by date
-    maintenance_records = valve.maintenance_records.all().order_by('-maintenance_date')
-    
-    # Get part codes directly associated with the valve
-    basic_part_codes = valve.part_codes.all()
-    
-    # Get related part codes by part number
-    selected_part_number = request.GET.get('part_number')
-    if selected_part_number:
-        part_numbers_to_match = [selected_part_number]
-    else:
-        part_numbers_to_match = [pc.part_number for pc in basic_part_codes if pc.part_number]
-
-    part_number_related_codes = PartCode.objects.none()
-    if part_numbers_to_match:
-        part_number_related_codes = PartCode.objects.filter(
-            part_number__in=part_numbers_to_match
-        ).exclude(
-            pk__in=[pc.pk for pc in basic_part_codes]
-        )
-
-    # Get parts used in maintenance history
-    parts_used_in_history = []
-    for record in maintenance_records:
-        parts_used_in_history.extend(record.maintenancepart_set.all())
-    
     context = {
-        'valve': valve,
-        'maintenance_records': maintenance_records,
-        'basic_part_codes': basic_part_codes,
-        'part_number_related_codes': part_number_related_codes,
-        'parts_used_in_history': parts_used_in_history,
-        'selected_part_number': selected_part_number,
+        'valve_id': pk,
+        'fragments': get_valve_fragments(request, pk),
+        'selected_part_number': request.GET.get('part_number'),
     }
     return render(request, 'valves/valve_detail.html', context)
 
+@login_required
+@require_GET
+def valve_detail_tab(request, pk, tab):
+    """
+    Returns one tab of the valve detail page as JSON: the rendered fragment and its item count.
+    """
+    if tab not in TABS or not Valve.objects.filter(pk=pk).exists():
+        raise Http404
+    return JsonResponse(render_tab(request, pk, tab))
+
 @login_required
 def valve_create_frontend(request):
     """
@@ -152,15 +153,12 @@ def valve_create_frontend(request):
     }
     return render(request, 'valves/valve_form.html', context)
 
-@login_required
-def valve_list_frontend(request):
+def filter_valves(request, factories):
     """
-    Handles the frontend display of a list of valves with filtering, searching, and pagination.
+    Applies the valve list filters and search from the query string.
+    Returns (queryset, ordering).
     """
-    valves_list = Valve.objects.select_related('valve_type', 'status', 'manufacturer', 'factory').all().order_by('tag_number')
-    
-    factories = Factory.objects.all().order_by('name')
-    statuses = ValveStatus.objects.all().order_by('name')
+    valves_list = Valve.objects.select_related('valve_type', 'status', 'manufacturer', 'factory').all()
 
     selected_factory_slug = request.GET.get('factory', '')
     selected_status = request.GET.get('status', '')
@@ -179,22 +177,44 @@ def valve_list_frontend(request):
     if selected_status:
         valves_list = valves_list.filter(status__name=selected_status)
 
-    # Searching
-    if search_query:
-        valves_list = valves_list.filter(
-            Q(tag_number__icontains=search_query) |
-            Q(name__icontains=search_query) |
-            Q(valve_type__name__icontains=search_query) |
-            Q(location__icontains=search_query)
-        )
+    # Searching (ranked, index-backed; best matches first)
+    ordering = ('tag_number',)
+    if search_query.strip():
+        valves_list = search_valves(valves_list, search_query)
+        ordering = ('-search_rank', 'tag_number')
+    return valves_list, ordering
 
-    # Pagination
-    paginator = Paginator(valves_list, 15)  # Show 15 valves per page
-    page_number = request.GET.get('page')
-    valves = paginator.get_page(page_number)
+@login_required
+def valve_list_frontend(request):
+    """
+    Handles the frontend display of a list of valves with filtering, searching, and pagination.
+    With ?export=csv or ?export=xlsx, streams every matching valve instead.
+    """
+    factories = Factory.objects.all().order_by('name')
+    statuses = ValveStatus.objects.all().order_by('name')
+
+    selected_factory_slug = request.GET.get('factory', '')
+    selected_status = request.GET.get('status', '')
+    search_query = request.GET.get('q', '')
+    valves_list, ordering = filter_valves(request, factories)
+
+    export_format = request.GET.get('export')
+    if export_format in EXPORT_FORMATS:
+        rows = valve_export_rows(valves_list.order_by(*ordering))
+        return export_response(export_format, 'valves', VALVE_EXPORT_HEADERS, rows)
+
+    # Pagination (keyset, so deep pages cost the same as the first one)
+    paginator = KeysetPaginator(valves_list, ordering, per_page=15, with_count=True)
+    valves = paginator.get_page(request.GET.get('cursor'))
+
+    # Rendered rows are cached per valve version (see valve_list.html)
+    versions = valve_versions([valve.pk for valve in valves])
+    for valve in valves:
+        valve.cache_version = versions[valve.pk]
 
     context = {
         'valves': valves,
+        'lookups_version': lookups_version(),
         'factories': factories,
         'statuses': statuses,
         'selected_factory': selected_factory_slug,
@@ -209,25 +229,13 @@ def home(request):
     View for the home page, displaying dashboard with valve statistics.
     """
     try:
-        factories = Factory.objects.all().order_by('name')
-        main_factories = []
-        zld_factory = None
-
-        for factory in factories:
-            factory_valves = Valve.objects.filter(factory=factory)
-            factory.total_valves = factory_valves.count()
-            # Status matching should be robust
-            factory.operational_valves = factory_valves.filter(status__name__icontains='Operational').count()
-            factory.needs_maintenance_valves = factory_valves.filter(status__name__icontains='Needs Maintenance').count()
-
-            if factory.name == 'ZLD':
-                zld_factory = factory
-            else:
-                # Add factory to list
-                main_factories.append(factory)
+        # Factory counts come from one grouped query and are cached until a valve changes
+        snapshot = get_factory_dashboard()
+        main_factories = snapshot['main_factories']
+        zld_factory = snapshot['zld_factory']
+        recent_valves = snapshot['recent_valves']
 
         recent_maintenance = MaintenanceHistory.objects.all().order_by('-maintenance_date')[:5]
-        recent_valves = Valve.objects.all().order_by('-valve_id')[:5]
 
     except Exception as e:
         messages.error(request, f"Error loading dashboard data: {str(e)}")
@@ -265,13 +273,33 @@ class PartCodeDetail(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = PartCodeSerializer
 
 class MaintenanceHistoryList(generics.ListCreateAPIView):
-    queryset = MaintenanceHistory.objects.all()
     serializer_class = MaintenanceHistorySerializer
 
+    def get_queryset(self):
+        queryset = MaintenanceHistory.objects.select_related('technician').prefetch_related('activities')
+        return filter_by_activities(queryset, self.request.query_params.getlist('activity'))
+
 class MaintenanceHistoryDetail(generics.RetrieveUpdateDestroyAPIView):
     queryset = MaintenanceHistory.objects.all()
     serializer_class = MaintenanceHistorySerializer
 
+class MaintenanceHistoryBulkCreate(APIView):
+    """
+    Creates a list of maintenance records in one request: all of them, or none with the errors of each row.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = BulkMaintenanceRowSerializer(data=request.data, many=True, allow_empty=False, max_length=MAX_ROWS)
+        if not serializer.is_valid():
+            return Response({'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        records, errors = create_maintenance_records(serializer.validated_data)
+        if errors:
+            row_errors = [errors.get(index, {}) for index in range(len(serializer.validated_data))]
+            return Response({'errors': row_errors}, status=status.HTTP_400_BAD_REQUEST)
+        prefetch_related_objects(records, 'activities')
+        return Response(MaintenanceHistorySerializer(records, many=True).data, status=status.HTTP_201_CREATED)
+
 class MaintenancePartList(generics.ListCreateAPIView):
     queryset = MaintenancePart.objects.all()
     serializer_class = MaintenancePartSerializer
@@ -305,7 +333,7 @@ def maintenance_form_frontend(request, pk=None):
             initial_data['valve_tag_number'] = valve_instance.tag_number
 
     if request.method == 'POST':
-        form = MaintenanceHistoryForm(request.POST, request.FILES, instance=record)
+        form = MaintenanceHistoryForm(request.POST, request.FILES, instance=record, user=request.user)
         if form.is_valid():
             instance = form.save()
             messages.success(request, "Maintenance record saved successfully!")
@@ -314,7 +342,7 @@ def maintenance_form_frontend(request, pk=None):
         else:
             messages.error(request, "Please correct the errors below.")
     else:
-        form = MaintenanceHistoryForm(instance=record, initial=initial_data)
+        form = MaintenanceHistoryForm(instance=record, initial=initial_data, user=request.user)
 
     title = "Update Maintenance Record" if pk else "Create New Maintenance Record"
     context = {
@@ -326,6 +354,38 @@ def maintenance_form_frontend(request, pk=None):
     }
     return render(request, 'valves/maintenance_form.html', context)
 
+@login_required
+def maintenance_bulk_frontend(request):
+    """
+    Grid for entering many maintenance records at once, e.g. a whole shift during a shutdown.
+    """
+    if request.method == 'POST':
+        formset = BulkMaintenanceFormSet(request.POST)
+        if formset.is_valid():
+            rows = formset.rows()
+            if not rows:
+                messages.error(request, "Fill in at least one row.")
+            else:
+                records, errors = create_maintenance_records([data for _, data in rows])
+                if not errors:
+                    messages.success(request, "%d maintenance records saved successfully!" % len(records))
+                    return redirect('valves:maintenance-history-frontend')
+                for index, field_errors in errors.items():
+                    for field, field_messages in field_errors.items():
+                        for message in field_messages:
+                            rows[index][0].add_error(field, message)
+                messages.error(request, "Please correct the errors below.")
+        else:
+            messages.error(request, "Please correct the errors below.")
+    else:
+        formset = BulkMaintenanceFormSet()
+
+    context = {
+        'formset': formset,
+        'technicians': Technician.objects.order_by('name').values_list('name', flat=True),
+    }
+    return render(request, 'valves/maintenance_bulk_form.html', context)
+
 @login_required
 def valve_update_frontend(request, pk):
     """
@@ -395,14 +455,11 @@ def valve_delete_frontend(request, pk):
     context = {'valve': valve}
     return render(request, 'valves/valve_confirm_delete.html', context)
 
-@login_required
-def maintenance_history_frontend(request):
+def filter_maintenance_history(request):
     """
-    Display list of all maintenance records with filtering and pagination.
+    Applies the maintenance list search and activity filters from the query string.
     """
-    maintenance_list = MaintenanceHistory.objects.select_related(
-        'valve'
-    ).order_by('-maintenance_date')
+    maintenance_list = MaintenanceHistory.objects.select_related('valve')
     
     search_query = request.GET.get('q', '')
     if search_query:
@@ -412,14 +469,31 @@ def maintenance_history_frontend(request):
             Q(maintenance_activities__icontains=search_query) |
             Q(technician__name__icontains=search_query)
         )
+    # ?activity= may repeat; records must include every one
+    return filter_by_activities(maintenance_list, request.GET.getlist('activity'))
+
+@login_required
+def maintenance_history_frontend(request):
+    """
+    Display list of all maintenance records with filtering and pagination.
+    With ?export=csv or ?export=xlsx, streams every matching record instead.
+    """
+    search_query = request.GET.get('q', '')
+    maintenance_list = filter_maintenance_history(request)
+
+    export_format = request.GET.get('export')
+    if export_format in EXPORT_FORMATS:
+        rows = maintenance_export_rows(maintenance_list.order_by(*MAINTENANCE_ORDERING))
+        return export_response(export_format, 'maintenance_history', MAINTENANCE_EXPORT_HEADERS, rows)
     
-    paginator = Paginator(maintenance_list, 15)
-    page_number = request.GET.get('page')
-    maintenance_records = paginator.get_page(page_number)
+    paginator = KeysetPaginator(maintenance_list, MAINTENANCE_ORDERING, per_page=15, with_count=True)
+    maintenance_records = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'maintenance_records': maintenance_records,
         'search_query': search_query,
+        'selected_activities': request.GET.getlist('activity'),
+        'activity_counts': activity_counts(maintenance_list),
     }
     return render(request, 'valves/maintenance_list.html', context)
 
@@ -439,12 +513,11 @@ def maintenance_detail_frontend(request, pk):
     }
     return render(request, 'valves/maintenance_detail.html', context)
 
-@login_required
-def part_code_list_frontend(request):
+def filter_part_codes(request):
     """
-    Display list of all part codes with filtering and pagination.
+    Applies the part code list filters from the query string; an exact part number wins over search.
     """
-    part_codes_list = PartCode.objects.all().order_by('sap_code')
+    part_codes_list = PartCode.objects.select_related('part')
     
     search_query = request.GET.get('q', '')
     part_number_filter = request.GET.get('part_number', '')
@@ -458,10 +531,27 @@ def part_code_list_frontend(request):
             Q(description__icontains=search_query) |
             Q(part_number__icontains=search_query)
         )
+    return part_codes_list
+
+@login_required
+def part_code_list_frontend(request):
+    """
+    Display list of all part codes with filtering and pagination.
+    With ?export=csv or ?export=xlsx, streams every matching part code instead.
+    """
+    search_query = request.GET.get('q', '')
+    part_number_filter = request.GET.get('part_number', '')
+    part_codes_list = filter_part_codes(request)
+
+    export_format = request.GET.get('export')
+    if export_format in EXPORT_FORMATS:
+        rows = part_code_export_rows(part_codes_list.order_by('sap_code', 'part_code_id'))
+        return export_response(export_format, 'part_codes', PART_CODE_EXPORT_HEADERS, rows)
+
+    part_codes_list = part_codes_list.prefetch_related('associated_valves')
     
-    paginator = Paginator(part_codes_list, 15)
-    page_number = request.GET.get('page')
-    part_codes = paginator.get_page(page_number)
+    paginator = KeysetPaginator(part_codes_list, ('sap_code', 'part_code_id'), per_page=15, with_count=True)
+    part_codes = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'part_codes': part_codes,
@@ -559,43 +649,61 @@ from django.http import JsonResponse
 from django.views.decorators.http import require_GET
 
 @login_required
+@require_GET
 def valve_tag_autocomplete(request):
-    if 'term' in request.GET:
-        qs = Valve.objects.filter(tag_number__icontains=request.GET.get('term'))
-        tags = [valve.tag_number for valve in qs]
-        return JsonResponse(tags, safe=False)
-    return JsonResponse([], safe=False)
+    """
+    Tag numbers matching ?term=, served from the in-process tag index (valves/autocomplete.py).
+    Optional ?factory=<id> limits the tags to one factory and ?limit= caps the list (at most 50).
+    """
+    try:
+        factory_id = int(request.GET['factory']) if request.GET.get('factory') else None
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': 'factory and limit must be integers'}, status=400)
+    tags = autocomplete_tags(request.GET.get('term', ''), factory_id=factory_id, limit=limit)
+    return JsonResponse(tags, safe=False)
 
 @login_required
 @require_GET
 def get_valves_by_factory(request):
     """
-    API endpoint to get valves by factory, with optional search.
+    API endpoint to get the valves of a factory as [{"valve_id": ..., "tag_number": ...}, ...].
+    Without ?q= the whole list is served from the cache, brotli- or gzip-compressed when the client
+    accepts it and as a 304 when the client's copy is current. With ?q= the matching valves are returned
+    a page at a time, using ?limit= (default 50, at most 200) and ?offset=.
     """
-    factory_id = request.GET.get('factory')
-    search_term = request.GET.get('q', '')
-
-    if not factory_id:
-        return JsonResponse({'error': 'Factory ID is required'}, status=400)
-    
     try:
-        valves = Valve.objects.filter(factory_id=factory_id)
-        if search_term:
-            valves = valves.filter(tag_number__icontains=search_term)
-        
-        valves = valves.values('valve_id', 'tag_number')
-        return JsonResponse(list(valves), safe=False)
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+        factory_id = int(request.GET.get('factory', ''))
+    except ValueError:
+        return JsonResponse({'error': 'Factory ID is required'}, status=400)
+    search_term = request.GET.get('q', '')
 
-@login_required
-def shutdown_report(request):
-    """
-    Handle creation and display of shutdown reports, with filtering and pagination.
-    """
-    maintenance_records_list = MaintenanceHistory.objects.select_related(
-        'valve', 'valve__factory', 'technician'
-    ).prefetch_related('maintenancepart_set__part_code').all()
+    if search_term:
+        try:
+            limit = int(request.GET.get('limit', DEFAULT_SEARCH_LIMIT))
+            offset = int(request.GET.get('offset', 0))
+        except ValueError:
+            return JsonResponse({'error': 'limit and offset must be integers'}, status=400)
+        return JsonResponse(search_factory_valves(factory_id, search_term, limit, offset), safe=False)
+
+    payload = factory_valves_payload(factory_id)
+    body, encoding, etag = negotiate_encoding(payload, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    # Browsers keep the list but check it with the ETag on every use
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+def filter_shutdown_records(request):
+    """
+    Applies the shutdown report factory and date range filters from the query string.
+    """
+    maintenance_records_list = MaintenanceHistory.objects.all()
 
     # Get filter parameters from GET request
     selected_factory_id = request.GET.get('factory')
@@ -609,13 +717,31 @@ def shutdown_report(request):
         maintenance_records_list = maintenance_records_list.filter(maintenance_date__gte=selected_start_date)
     if selected_end_date:
         maintenance_records_list = maintenance_records_list.filter(maintenance_date__lte=selected_end_date)
+    return maintenance_records_list
+
+@login_required
+def shutdown_report(request):
+    """
+    Handle creation and display of shutdown reports, with filtering and pagination.
+    With ?export=csv or ?export=xlsx, streams every matching record instead.
+    """
+    selected_factory_id = request.GET.get('factory')
+    selected_start_date = request.GET.get('start_date')
+    selected_end_date = request.GET.get('end_date')
+    maintenance_records_list = filter_shutdown_records(request)
+
+    export_format = request.GET.get('export')
+    if export_format in EXPORT_FORMATS:
+        rows = shutdown_export_rows(maintenance_records_list.order_by(*MAINTENANCE_ORDERING))
+        return export_response(export_format, 'shutdown_report', SHUTDOWN_EXPORT_HEADERS, rows)
 
-    maintenance_records_list = maintenance_records_list.order_by('-maintenance_date')
+    maintenance_records_list = maintenance_records_list.select_related(
+        'valve', 'valve__factory', 'technician'
+    ).prefetch_related('maintenancepart_set__code')
 
     # Pagination
-    paginator = Paginator(maintenance_records_list, 15)  # Show 15 records per page
-    page_number = request.GET.get('page')
-    maintenance_records = paginator.get_page(page_number)
+    paginator = KeysetPaginator(maintenance_records_list, MAINTENANCE_ORDERING, per_page=15)  # Show 15 records per page
+    maintenance_records = paginator.get_page(request.GET.get('cursor'))
 
     factories = Factory.objects.all().order_by('name') # For the filter dropdown
 
@@ -639,6 +765,24 @@ def shutdown_report(request):
     return render(request, 'valves/shutdown_report.html', context)
 
 
+@login_required
+def shutdown_create(request):
+    """
+    Records a shutdown and the valves it covers. Valves are picked with the searchable picker of
+    ShutdownReportForm, which pages through the chosen factory's valves from get_valves_by_factory.
+    """
+    if request.method == 'POST':
+        form = ShutdownReportForm(request.POST)
+        if form.is_valid():
+            shutdown = form.save()
+            messages.success(request, f'Shutdown {shutdown.name} was saved with {shutdown.valves.count()} valves.')
+            return redirect('valves:shutdown-report-print', pk=shutdown.pk)
+        messages.error(request, "Please correct the errors below.")
+    else:
+        form = ShutdownReportForm()
+    return render(request, 'valves/shutdown_form.html', {'form': form})
+
+
 
 @login_required
 
@@ -665,859 +809,134 @@ def shutdown_report_print(request, pk):
     return render(request, 'valves/shutdown_report_print.html', context)
 
 
-
-
-
-import os
-
-
-
-
-
-from django.conf import settings
-
-
-
-
-
-from django.core.files.storage import default_storage
-
-
-
-
-
-from .forms import DocumentUploadForm
-
-
-
-
-
-
-
-
-
-
-
 @login_required
-
-
-
-
-
-
-
-
-
-
-
 def documents_page(request):
-
-
-
-
-
-
-
-
-
-
-
     """
-
-
-
-
-
-
-
-
-
-
-
-    Display a list of documents and folders from the media directory
-
-
-
-
-
-
-
-
-
-
-
-    and handle file uploads.
-
-
-
-
-
-
-
-
-
-
-
+    Display the indexed documents of the media directory and handle file uploads.
+    Folders come from the Document index (see valves/documents.py); the files of the selected
+    factory / document type, or the search results, are paginated.
     """
-
-
-
-
-
-
-
-
-
-
-
     if request.method == 'POST':
+        form = DocumentUploadForm(request.POST, request.FILES, user=request.user)
+        if form.is_valid():
+            factory = form.cleaned_data['factory']
+            document_type = form.cleaned_data['document_type']
+            name = form.cleaned_data['name']
+            uploaded_file = form.cleaned_data['file']
+            upload = form.cleaned_data['upload']
 
+            # Get the file extension
+            file_extension = os.path.splitext(upload.filename if upload else uploaded_file.name)[1]
 
+            # Save the file; storage may rename it if the name is taken
+            file_path = f"{factory}/{document_type}/{name}{file_extension}"
+            if upload:
+                saved_name = claim_upload(upload, file_path)
+            else:
+                saved_name = default_storage.save(file_path, uploaded_file)
+            document = index_document(saved_name)
+            add_file(saved_name, document.sha256 if document else None)
 
+            messages.success(request, f"File '{name}{file_extension}' uploaded successfully to {factory}/{document_type}.")
+            return redirect('valves:documents-page')
+        else:
+            messages.error(request, "There was an error with your upload. Please check the form.")
+    else:
+        form = DocumentUploadForm(user=request.user)
+
+    folders = {}
+    for folder in Document.objects.values('factory', 'doc_type').annotate(count=Count('id')).order_by('factory', 'doc_type'):
+        folders.setdefault(folder['factory'], []).append((folder['doc_type'], folder['count']))
+
+    selected_factory = request.GET.get('factory', '')
+    selected_doc_type = request.GET.get('doc_type', '')
+    # 'tag' is the old name of the search parameter, kept for bookmarked links
+    query = request.GET.get('q', request.GET.get('tag', '')).strip()
+
+    documents = None
+    if selected_factory or query:
+        document_list = Document.objects.only('factory', 'doc_type', 'relative_path', 'name', 'size')
+        if selected_factory:
+            document_list = document_list.filter(factory=selected_factory)
+        if selected_doc_type:
+            document_list = document_list.filter(doc_type=selected_doc_type)
+        if query:
+            document_list = document_list.filter(name__icontains=query)
+        paginator = KeysetPaginator(document_list, ('factory', 'doc_type', 'name', 'id'), per_page=50)
+        documents = paginator.get_page(request.GET.get('cursor'))
 
+    context = {
+        'folders': folders,
+        'doc_types': sorted({doc_type for doc_types in folders.values() for doc_type, _ in doc_types}),
+        'documents': documents,
+        'selected_factory': selected_factory,
+        'selected_doc_type': selected_doc_type,
+        'query': query,
+        'upload_form': form,
+    }
+    return render(request, 'valves/documents.html', context)
 
 
+@login_required
+@require_POST
+def upload_start(request):
+    """
+    Starts a chunked upload from a JSON body {filename, size, sha256 (optional)}.
+    Chunks are then PUT to upload_chunk; see valves/uploads.py.
+    """
+    try:
+        data = json.loads(request.body)
+        upload = start_upload(request.user, data.get('filename'), data.get('size'), data.get('sha256'))
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'Invalid request body.'}, status=400)
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    return JsonResponse(upload_state(upload), status=201)
 
 
+@login_required
+@require_http_methods(['GET', 'PUT'])
+def upload_chunk(request, upload_id):
+    """
+    GET reports the offset to resume from. PUT appends the request body at the offset given in the
+    Upload-Offset header, checked against the optional X-Chunk-SHA256 header.
+    """
+    upload = get_object_or_404(ChunkedUpload, pk=upload_id, user=request.user)
+    if request.method == 'GET':
+        return JsonResponse(upload_state(upload))
 
+    try:
+        offset = int(request.headers['Upload-Offset'])
+        length = int(request.headers['Content-Length'])
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Upload-Offset and Content-Length headers are required.'}, status=400)
+    try:
+        # The body is read as a stream, so a chunk is never held in memory
+        upload = append_chunk(upload.pk, offset, request, length, request.headers.get('X-Chunk-SHA256'))
+    except UploadError as e:
+        upload.refresh_from_db()
+        return JsonResponse({'error': str(e), **upload_state(upload)}, status=e.status)
+    return JsonResponse(upload_state(upload))
 
 
-        form = DocumentUploadForm(request.POST, request.FILES)
-
-
-
-
-
-
-
-
-
-
-
-        if form.is_valid():
-
-
-
-
-
-
-
-
-
-
-
-            factory = form.cleaned_data['factory']
-
-
-
-
-
-
-
-
-
-
-
-            document_type = form.cleaned_data['document_type']
-
-
-
-
-
-
-
-
-
-
-
-            name = form.cleaned_data['name']
-
-
-
-
-
-
-
-
-
-
-
-            uploaded_file = form.cleaned_data['file']
-
-
-
-
-
-
-
-
-
-
-
-            
-
-
-
-
-
-
-
-
-
-
-
-            # Get the file extension
-
-
-
-
-
-
-
-
-
-
-
-            file_extension = os.path.splitext(uploaded_file.name)[1]
-
-
-
-
-
-
-
-
-
-
-
-            
-
-
-
-
-
-
-
-
-
-
-
-            # Construct the path
-
-
-
-
-
-
-
-
-
-
-
-            upload_dir = os.path.join(settings.MEDIA_ROOT, factory, document_type)
-
-
-
-
-
-
-
-
-
-
-
-            os.makedirs(upload_dir, exist_ok=True)
-
-
-
-
-
-
-
-
-
-
-
-            
-
-
-
-
-
-
-
-
-
-
-
-            file_path = os.path.join(upload_dir, f"{name}{file_extension}")
-
-
-
-
-
-
-
-
-
-
-
-            
-
-
-
-
-
-
-
-
-
-
-
-            # Save the file
-
-
-
-
-
-
-
-
-
-
-
-            default_storage.save(file_path, uploaded_file)
-
-
-
-
-
-
-
-
-
-
-
-            
-
-
-
-
-
-
-
-
-
-
-
-            messages.success(request, f"File '{name}{file_extension}' uploaded successfully to {factory}/{document_type}.")
-
-
-
-
-
-
-
-
-
-
-
-            return redirect('valves:documents-page')
-
-
-
-
-
-
-
-
-
-
-
-        else:
-
-
-
-
-
-
-
-
-
-
-
-            messages.error(request, "There was an error with your upload. Please check the form.")
-
-
-
-
-
-
-
-
-
-
-
-    else:
-
-
-
-
-
-
-
-
-
-
-
-        form = DocumentUploadForm()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-    media_path = settings.MEDIA_ROOT
-
-
-
-
-
-
-
-
-
-
-
-    documents_structure = {}
-
-
-
-
-
-
-
-
-
-
-
-    
-
-
-
-
-
-
-
-
-
-
-
-    if os.path.exists(media_path):
-
-
-
-
-
-
-
-
-
-
-
-        for factory_dir in os.listdir(media_path):
-
-
-
-
-
-
-
-
-
-
-
-            if factory_dir.lower() == 'valves':
-
-
-
-
-
-
-
-
-
-
-
-                continue
-
-
-
-
-
-
-
-
-
-
-
-            factory_path = os.path.join(media_path, factory_dir)
-
-
-
-
-
-
-
-
-
-
-
-            if os.path.isdir(factory_path):
-
-
-
-
-
-
-
-
-
-
-
-                documents_structure[factory_dir] = {}
-
-
-
-
-
-
-
-
-
-
-
-                for doc_type_dir in os.listdir(factory_path):
-
-
-
-
-
-
-
-
-
-
-
-                    doc_type_path = os.path.join(factory_path, doc_type_dir)
-
-
-
-
-
-
-
-
-
-
-
-                    if os.path.isdir(doc_type_path):
-
-
-
-
-
-
-
-
-
-
-
-                        documents_structure[factory_dir][doc_type_dir] = []
-
-
-
-
-
-
-
-
-
-
-
-                        # Recursive search using os.walk
-
-
-
-
-
-
-
-
-
-
-
-                        for root, _, files in os.walk(doc_type_path):
-
-
-
-
-
-
-
-
-
-
-
-                            for filename in files:
-
-
-
-
-
-
-
-
-
-
-
-                                file_path = os.path.join(root, filename)
-
-
-
-
-
-
-
-
-
-
-
-                                
-
-
-
-
-
-
-
-
-
-
-
-                                # Get relative path from doc_type_path for display name
-
-
-
-
-
-
-
-
-
-
-
-                                relative_name = os.path.relpath(file_path, doc_type_path).replace("\\", "/")
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-                                # Get relative path from media_path for URL
-
-
-
-
-
-
-
-
-
-
-
-                                relative_url_path = os.path.relpath(file_path, media_path).replace("\\", "/")
-
-
-
-
-
-
-
-
-
-
-
-                                media_url = os.path.join(settings.MEDIA_URL, relative_url_path).replace("\\", "/")
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-                                documents_structure[factory_dir][doc_type_dir].append({
-
-
-
-
-
-
-
-
-
-
-
-                                    'name': relative_name,
-
-
-
-
-
-
-
-
-
-
-
-                                    'path': media_url
-
-
-
-
-
-
-
-
-
-
-
-                                })
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-    context = {
-
-
-
-
-
-
-
-
-
-
-
-        'documents': documents_structure,
-
-
-
-
-
-
-
-
-
-
-
-        'upload_form': form,
-
-
-
-
-
-
-
-
-
-
-
-    }
-
-
-
-
-
-
-
-
-
-
-
-    return render(request, 'valves/documents.html', context)
-
-
-
-
-
-
+@login_required
+@require_GET
+def protected_media(request, path):
+    """
+    Serves a file under MEDIA_ROOT to logged-in users. Only the login is checked here; the file
+    itself is sent by nginx through an X-Accel-Redirect to MEDIA_ACCEL_REDIRECT_PREFIX, so no
+    worker is tied up copying bytes.
+    """
+    parts = path.split('/')
+    # Hidden folders hold unfinished uploads
+    if any(part in ('', '.', '..') or part.startswith('.') for part in parts):
+        raise Http404
+    prefix = settings.MEDIA_ACCEL_REDIRECT_PREFIX
+    if not prefix:
+        return serve(request, path, document_root=settings.MEDIA_ROOT)
+
+    content_type, encoding = mimetypes.guess_type(path)
+    # A .gz download stays compressed
+    response = HttpResponse(content_type=content_type if content_type and not encoding else 'application/octet-stream')
+    response['X-Accel-Redirect'] = quote(prefix + path)
+    return response